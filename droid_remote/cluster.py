@@ -0,0 +1,103 @@
+"""Node side of cluster mode: servers register with the coordinator (see
+`coordinator`) by sending it heartbeats listing their devices, and
+watchdogs report the servers they find unhealthy."""
+
+from dataclasses import dataclass
+import logging
+from typing import Optional
+import aiohttp
+import asyncio
+from dataclasses_json import dataclass_json, DataClassJsonMixin
+from .config import ServerConfig
+from .device import adb
+from .readiness import ReadinessMonitor
+
+
+HEARTBEAT_PATH = "/cluster/heartbeat"
+HEALTH_REPORT_PATH = "/cluster/health-report"
+HEARTBEAT_INTERVAL = 5
+CLUSTER_REQUEST_TIMEOUT = 5
+logger = logging.getLogger(__name__)
+
+
+@dataclass_json
+@dataclass(frozen=True)
+class Heartbeat(DataClassJsonMixin):
+    node_id: str
+    base_url: str
+    devices: list[str]
+    """Serials of the online devices"""
+    ready: bool
+
+
+@dataclass_json
+@dataclass(frozen=True)
+class HealthReport(DataClassJsonMixin):
+    """A node's server was found unhealthy. Heartbeats decide when it's
+    healthy again."""
+    node_id: str
+    reason: str
+
+
+def coordinator_auth(config: ServerConfig) -> Optional[aiohttp.BasicAuth]:
+    """The coordinator is secured with the same password as the nodes"""
+    if config.http_basic_password is None:
+        return None
+    return aiohttp.BasicAuth("admin", config.http_basic_password)
+
+
+def create_session(config: ServerConfig):
+    return aiohttp.ClientSession(
+        auth=coordinator_auth(config),
+        timeout=aiohttp.ClientTimeout(total=CLUSTER_REQUEST_TIMEOUT),
+    )
+
+
+async def send_heartbeats_forever(config: ServerConfig, readiness: ReadinessMonitor):
+    assert config.coordinator_url is not None
+    url = f"{config.coordinator_url}{HEARTBEAT_PATH}"
+    node_id = config.cluster_node_id
+    logger.info(f"Registering with cluster coordinator at {config.coordinator_url} as '{node_id}'...")
+    # Register with the devices listed, rather than with none before device
+    # tracking filled the registry, which would let another node claim them
+    try:
+        await adb.list_devices()
+    except Exception as e:
+        logger.warning(f"Could not list devices before registering: {e.__class__.__name__}: {e}")
+    registered = False
+    async with create_session(config) as session:
+        while True:
+            ready, _ = readiness.report()
+            heartbeat = Heartbeat(
+                node_id=node_id,
+                base_url=config.cluster_node_base_url,
+                devices=[device.serial for device in adb.registry.online],
+                ready=ready,
+            )
+            try:
+                async with session.post(url, json=heartbeat.to_dict()) as resp:
+                    resp.raise_for_status()
+                if not registered:
+                    logger.info("Registered with cluster coordinator")
+                registered = True
+            except Exception as e:
+                if registered:
+                    logger.warning(f"Heartbeat to cluster coordinator failed: {e.__class__.__name__}: {e}")
+                else:
+                    logger.debug(f"Heartbeat to cluster coordinator failed: {e.__class__.__name__}: {e}")
+                registered = False
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+async def report_node_unhealthy(config: ServerConfig, reason: str):
+    """Tell the coordinator, if any, that this node's server is unhealthy so
+    it can fail over without waiting for heartbeats to time out"""
+    if config.coordinator_url is None:
+        return
+    report = HealthReport(config.cluster_node_id, reason)
+    try:
+        async with create_session(config) as session:
+            async with session.post(f"{config.coordinator_url}{HEALTH_REPORT_PATH}", json=report.to_dict()) as resp:
+                resp.raise_for_status()
+    except Exception as e:
+        logger.warning(f"Could not report node health to cluster coordinator: {e.__class__.__name__}: {e}")
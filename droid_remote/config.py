@@ -6,6 +6,7 @@ from enum import Enum, auto
 from functools import cached_property, cache
 import os
 from pathlib import Path
+import socket
 import sys
 from tempfile import mkstemp
 from typing import Callable, Optional, TypeVar, Union
@@ -24,15 +25,45 @@ class ServerConfig(DataClassJsonMixin):
     pid_file_path: Path
     child_pgids_file_path: Path
     ngrok_agent_pid_file_path: Path
+    known_actions_file_path: Path
     itsme_pin: str
     http_basic_password: Optional[str] = None
     ngrok_domain: Optional[str] = None
     ensure_ready_for_action: bool = False
     log_file_log_level: int = logging.INFO
+    adb_backend: str = "process"
+    adb_replay_serials: list[str] = dataclasses.field(default_factory=lambda: ["replay"])
+    """Devices the "replay" adb backend pretends to have"""
+    http_host: str = "localhost"
+    http_port: int = 8080
+    tasker_http_port: int = 2981
+    tasker_channel_token: Optional[str] = None
+    """Secret Tasker must present to use the Tasker channel, which is
+    disabled without one"""
+    coordinator_url: Optional[str] = None
+    """Cluster coordinator to send heartbeats to, if any"""
+    node_id: Optional[str] = None
+    node_base_url: Optional[str] = None
+    """URL the coordinator reaches this node at"""
+    daemonized: bool = False
+    """Started by `start_daemon`, which stops reading stdout after the first
+    INFO line"""
 
     @property
     def daemon_name(self):
         return "droid remote server"
+
+    @property
+    def cluster_node_id(self):
+        return self.node_id if self.node_id is not None else f"{socket.gethostname()}:{self.http_port}"
+
+    @property
+    def cluster_node_base_url(self):
+        if self.node_base_url is not None:
+            return self.node_base_url
+        # Listening on all interfaces
+        host = socket.gethostname() if self.http_host in ("", "0.0.0.0", "::") else self.http_host
+        return f"http://{host}:{self.http_port}"
     
     @property
     def daemon_name_cap(self):
@@ -51,14 +82,27 @@ class CtlConfig(ServerConfig):
     treat_kill_permission_error_as_not_running: bool = False
     watchdog: bool = False
     ctl_log_file_log_level: int = logging.INFO
+    watchdog_metrics_port: Optional[int] = None
+    coordinator: bool = False
+    coordinator_pid_file_path: Path
+    coordinator_host: str = "localhost"
+    coordinator_port: int = 8090
 
     @property
     def daemon_name(self):
+        if self.coordinator:
+            return "coordinator"
         return "watchdog" if self.watchdog else super().daemon_name
 
     @cached_property
     def pid_file_paths(self):
-        if self.watchdog:
+        if self.coordinator:
+            # Child PGIDs: the coordinator's ngrok agent
+            return PidFilePaths(
+                self.coordinator_pid_file_path,
+                self.coordinator_pid_file_path.with_suffix(".child_pgids.txt"),
+            )
+        elif self.watchdog:
             return PidFilePaths(self.watchdog_pid_file_path)
         else:
             return PidFilePaths(self.pid_file_path, self.child_pgids_file_path)
@@ -155,6 +199,10 @@ def bool_arg_env_or(args: argparse.Namespace, name: str, default_or_getter: Call
     return arg_env_or(args, name, default_or_getter, lambda s: s.lower() in ["true", "yes", "1", "y", "on"])
 
 
+def parse_serials(s: str) -> list[str]:
+    return [serial.strip() for serial in s.split(",") if len(serial.strip()) > 0]
+
+
 @cache
 def generate_defaults():
     root_dir = get_root_dir()
@@ -164,10 +212,12 @@ def generate_defaults():
         pid_file_path=var / "run" / "droid_remote.pid",
         child_pgids_file_path=var / "run" / "droid_remote_child_pgids.txt",
         ngrok_agent_pid_file_path=var / "run" / "droid_remote_ngrok_agent.pid",
+        known_actions_file_path=var / "lib" / "droid_remote" / "itsme_known_actions.json",
         # Will simply generate a RuntimeError when attempting to use
         itsme_pin="",
         ctl_log_file_path=var / "log" / "droid_remote_ctl.log",
         watchdog_pid_file_path=var / "run" / "droid_remote_watchdog.pid",
+        coordinator_pid_file_path=var / "run" / "droid_remote_coordinator.pid",
         monitoring_base_url="http://localhost:8080",
     )
 
@@ -182,6 +232,9 @@ def generate_server_config_from_args(args: argparse.Namespace) -> ServerConfig:
         str_arg_env_or(args, "child_pgids_file", defaults.child_pgids_file_path)
     )
     log_file_path = Path(str_arg_env_or(args, "log_file", defaults.log_file_path))
+    known_actions_file_path = Path(
+        str_arg_env_or(args, "known_actions_file", defaults.known_actions_file_path)
+    )
     itsme_pin = str_arg_env_or(args, "itsme_pin", throw_on_missing_config_value("itsme_pin"))
     http_basic_password: str | None = str_arg_env_or(args, "http_basic_password", None)
     if len(str(http_basic_password).strip()) == 0:
@@ -194,16 +247,40 @@ def generate_server_config_from_args(args: argparse.Namespace) -> ServerConfig:
         args, "log_file_log_level", defaults.log_file_log_level,
         convert_from_str=lambda s: logging.getLevelNamesMapping()[s.upper()],
     )
+    adb_backend = str_arg_env_or(args, "adb_backend", defaults.adb_backend)
+    adb_replay_serials = arg_env_or(
+        args, "adb_replay_serials", defaults.adb_replay_serials,
+        convert_from_str=parse_serials,
+    )
+    http_host = str_arg_env_or(args, "http_host", defaults.http_host)
+    http_port = int_arg_env_or(args, "http_port", defaults.http_port)
+    tasker_http_port = int_arg_env_or(args, "tasker_http_port", defaults.tasker_http_port)
+    tasker_channel_token: str | None = str_arg_env_or(args, "tasker_channel_token", None)
+    if len(str(tasker_channel_token).strip()) == 0:
+        tasker_channel_token = None
+    coordinator_url = str_arg_env_or(args, "coordinator_url", defaults.coordinator_url)
+    node_id = str_arg_env_or(args, "node_id", defaults.node_id)
+    node_base_url = str_arg_env_or(args, "node_base_url", defaults.node_base_url)
     return ServerConfig(
         log_file_path=log_file_path,
         pid_file_path=pid_file_path,
         child_pgids_file_path=child_pgids_file_path,
         ngrok_agent_pid_file_path=defaults.ngrok_agent_pid_file_path,
+        known_actions_file_path=known_actions_file_path,
         itsme_pin=itsme_pin,
         http_basic_password=http_basic_password,
         ngrok_domain=ngrok_domain,
         ensure_ready_for_action=ensure_ready_for_action,
         log_file_log_level=log_file_log_level,
+        adb_backend=adb_backend,
+        adb_replay_serials=adb_replay_serials,
+        http_host=http_host,
+        http_port=http_port,
+        tasker_http_port=tasker_http_port,
+        tasker_channel_token=tasker_channel_token,
+        coordinator_url=coordinator_url,
+        node_id=node_id,
+        node_base_url=node_base_url,
     )
 
 
@@ -227,7 +304,7 @@ def generate_ctl_config_from_args(args: argparse.Namespace) -> CtlConfig:
             raise ValueError("Cannot specify --monitor-ngrok-domain without --ngrok-domain")
         monitoring_base_url = f"https://{ngrok_domain}"
     elif monitoring_base_url is None:
-        monitoring_base_url = defaults.monitoring_base_url
+        monitoring_base_url = f"http://localhost:{server_config.http_port}"
     ctl_log_file_path = Path(str_arg_env_or(
         args, "ctl_log_file", defaults.ctl_log_file_path
     ))
@@ -238,6 +315,17 @@ def generate_ctl_config_from_args(args: argparse.Namespace) -> CtlConfig:
         args, "ctl_log_file_log_level", defaults.ctl_log_file_log_level,
         convert_from_str=lambda s: logging.getLevelNamesMapping()[s.upper()],
     )
+    watchdog_metrics_port = int_arg_env_or(
+        args, "watchdog_metrics_port", defaults.watchdog_metrics_port
+    )
+    coordinator = bool_arg_env_or(args, "coordinator", defaults.coordinator)
+    coordinator_pid_file_path = Path(str_arg_env_or(
+        args, "coordinator_pid_file", defaults.coordinator_pid_file_path
+    ))
+    coordinator_host = str_arg_env_or(args, "coordinator_host", defaults.coordinator_host)
+    coordinator_port = int_arg_env_or(args, "coordinator_port", defaults.coordinator_port)
+    if coordinator and watchdog:
+        raise ValueError("Cannot specify both --coordinator and --watchdog")
     return CtlConfig(
         **dataclasses.asdict(server_config),
         ctl_log_file_path=ctl_log_file_path,
@@ -246,6 +334,11 @@ def generate_ctl_config_from_args(args: argparse.Namespace) -> CtlConfig:
         treat_kill_permission_error_as_not_running=treat_kill_permission_error_as_not_running,
         watchdog=watchdog,
         ctl_log_file_log_level=ctl_log_file_log_level,
+        watchdog_metrics_port=watchdog_metrics_port,
+        coordinator=coordinator,
+        coordinator_pid_file_path=coordinator_pid_file_path,
+        coordinator_host=coordinator_host,
+        coordinator_port=coordinator_port,
     )
 
 
@@ -276,6 +369,10 @@ def populate_server_arg_parser(parser: argparse.ArgumentParser):
         "--log-file",
         help="Path to log file",
     )
+    parser.add_argument(
+        "--known-actions-file",
+        help=f"Where to keep the known itsme actions. Default: {defaults.known_actions_file_path}",
+    )
     parser.add_argument(
         "--ngrok-domain",
         default=None,
@@ -306,6 +403,50 @@ def populate_server_arg_parser(parser: argparse.ArgumentParser):
         type=lambda s: logging.getLevelNamesMapping()[s.upper()],
         help=f"Log level for log file. Default: {logging.getLevelName(defaults.log_file_log_level)}",
     )
+    parser.add_argument(
+        "--adb-backend",
+        choices=["process", "socket", "replay"],
+        help=f"How to talk to adb: exec the adb binary ('process'), connect to the adb server socket directly ('socket') or replay itsme_adb's fixture dumps instead of using a device, for tests ('replay'). Default: {defaults.adb_backend}",
+    )
+    parser.add_argument(
+        "--adb-replay-serials",
+        type=parse_serials,
+        help=f"Comma-separated serials of the devices the 'replay' adb backend pretends to have. Default: {','.join(defaults.adb_replay_serials)}",
+    )
+    parser.add_argument(
+        "--http-host",
+        help=f"Interface the webapp listens on. A cluster node on another host than the coordinator needs one the coordinator can reach, e.g. 0.0.0.0. Default: {defaults.http_host}",
+    )
+    parser.add_argument(
+        "--http-port",
+        type=int,
+        help=f"Port the webapp listens on (on --http-host). Default: {defaults.http_port}",
+    )
+    parser.add_argument(
+        "--tasker-http-port",
+        type=int,
+        help=f"Port the Tasker callback server listens on (on 127.0.0.1). Default: {defaults.tasker_http_port}",
+    )
+    parser.add_argument(
+        "--tasker-channel-token",
+        default=None,
+        help="Secret Tasker must send (as 'Authorization: Bearer <token>') to connect to the Tasker channel. Default: channel disabled",
+    )
+    parser.add_argument(
+        "--coordinator-url",
+        default=None,
+        help="Base URL of the cluster coordinator to register this server with. Default: standalone",
+    )
+    parser.add_argument(
+        "--node-id",
+        default=None,
+        help="Name of this server in the cluster. Default: <hostname>:<http port>",
+    )
+    parser.add_argument(
+        "--node-base-url",
+        default=None,
+        help="Base URL the cluster coordinator reaches this server at. Default: http://<http host>:<http port>, with the hostname for 0.0.0.0",
+    )
 
 
 class CtlActions(Enum):
@@ -365,3 +506,28 @@ def populate_ctl_arg_parser(parser: argparse.ArgumentParser):
         type=lambda s: logging.getLevelNamesMapping()[s.upper()],
         help=f"Log level for ctl log file. Default: {logging.getLevelName(defaults.ctl_log_file_log_level)}",
     )
+    parser.add_argument(
+        "--watchdog-metrics-port",
+        type=int,
+        help="Port on which the watchdog serves its own Prometheus metrics (health probe latency). Default: disabled",
+    )
+    parser.add_argument(
+        "--coordinator",
+        action="store_true",
+        default=None,
+        help="Run the cluster coordinator instead of the droid remote server.",
+    )
+    parser.add_argument(
+        "--coordinator-pid-file",
+        default=None,
+        help="Path to coordinator PID file.",
+    )
+    parser.add_argument(
+        "--coordinator-host",
+        help=f"Interface the cluster coordinator listens on, e.g. 0.0.0.0 for nodes on other hosts. Default: {defaults.coordinator_host}",
+    )
+    parser.add_argument(
+        "--coordinator-port",
+        type=int,
+        help=f"Port the cluster coordinator listens on. Default: {defaults.coordinator_port}",
+    )
@@ -0,0 +1,404 @@
+"""Cluster coordinator: a single entry point in front of several droid remote
+servers (nodes), each driving its own devices.
+
+Nodes started with `--coordinator-url` send a heartbeat every few seconds
+listing their online devices. A device is owned by the first registered node
+listing it that is healthy: its heartbeats are recent and its watchdog hasn't
+reported it unhealthy since the last one. Other nodes listing the same device
+are standbys. When the owner becomes unhealthy, the first healthy standby
+takes over, and keeps the device until it becomes unhealthy in turn: a
+recovered node doesn't take it back, so a device never has two owners.
+
+- `/devices/<serial>/...` is forwarded to the owner of that device
+- other requests (`/itsme/...`, `/jobs/...`...) go to the owner of the only
+  device in the cluster, or, without devices, to any healthy node
+- `/metrics` has the metrics of all healthy nodes, labeled `cluster_node`
+- `/healthz/ready` is ready when every device has a healthy owner
+
+WebSockets (the dashboard's log stream) are not forwarded.
+"""
+
+import asyncio
+from dataclasses import dataclass
+import logging
+import time
+from typing import Optional
+import aiohttp
+from aiohttp import web
+from aiohttp.web import Request, Response
+from aiohttp_basicauth import BasicAuthMiddleware
+from multidict import CIMultiDict
+import prometheus_client
+from prometheus_client.parser import text_string_to_metric_families
+from prometheus_client.samples import Sample
+from prometheus_client.utils import floatToGoString
+from .cluster import HEALTH_REPORT_PATH, HEARTBEAT_INTERVAL, HEARTBEAT_PATH, HealthReport, Heartbeat
+from .config import CtlConfig
+from .health import HEALTH_CHECK_PATH, READINESS_CHECK_PATH
+from .metrics import COORDINATOR_FAILOVERS, COORDINATOR_PROXY_DURATION
+from .ngrok import run_ngrok
+from .pid_management import clear_pid_files, ensure_no_existing_process_or_exit, init_pid_files
+from .signal_handling import add_signal_handlers
+from .webapp.aio_util import wrap_all
+
+
+# Missing this many heartbeats in a row makes a node unhealthy
+NODE_HEARTBEAT_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+# Device flows can take a while, see the job routes for longer ones
+PROXY_TIMEOUT = 120
+METRICS_FETCH_TIMEOUT = 5
+# Requests safe to send to a standby after the connection to the owner broke
+# down mid-request
+RETRYABLE_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+HOP_BY_HOP_HEADERS = frozenset([
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host", "content-length",
+])
+# The body is decompressed by the client session
+RESPONSE_HEADERS_DROPPED = HOP_BY_HOP_HEADERS | {"content-encoding"}
+NODE_LABEL = "cluster_node"
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Node:
+    node_id: str
+    base_url: str
+    devices: list[str]
+    ready: bool
+    last_heartbeat: float
+    """Monotonic time"""
+    unhealthy_reason: Optional[str] = None
+
+    @property
+    def heartbeat_age(self):
+        return time.monotonic() - self.last_heartbeat
+
+    @property
+    def is_healthy(self):
+        return self.unhealthy_reason is None and self.heartbeat_age <= NODE_HEARTBEAT_TIMEOUT
+
+    def to_report(self):
+        return {
+            "base_url": self.base_url,
+            "devices": self.devices,
+            "healthy": self.is_healthy,
+            "ready": self.ready,
+            "heartbeat_age": round(self.heartbeat_age, 3),
+            "unhealthy_reason": self.unhealthy_reason,
+        }
+
+
+class NodeRegistry:
+    def __init__(self):
+        # In registration order, which is the order new owners are picked in
+        self.nodes: dict[str, Node] = {}
+        self._owners: dict[str, str] = {}
+
+    def heartbeat(self, heartbeat: Heartbeat):
+        node = self.nodes.get(heartbeat.node_id)
+        if node is None:
+            logger.info(f"Node '{heartbeat.node_id}' registered at {heartbeat.base_url} with devices {heartbeat.devices}")
+            self.nodes[heartbeat.node_id] = Node(
+                heartbeat.node_id, heartbeat.base_url, heartbeat.devices, heartbeat.ready, time.monotonic(),
+            )
+            return
+        if not node.is_healthy:
+            logger.info(f"Node '{node.node_id}' is healthy again")
+        if node.devices != heartbeat.devices:
+            logger.info(f"Node '{node.node_id}' now has devices {heartbeat.devices}")
+        node.base_url = heartbeat.base_url
+        node.devices = heartbeat.devices
+        node.ready = heartbeat.ready
+        node.last_heartbeat = time.monotonic()
+        node.unhealthy_reason = None
+
+    def mark_unhealthy(self, node_id: str, reason: str):
+        node = self.nodes.get(node_id)
+        if node is None:
+            return False
+        if node.unhealthy_reason is None:
+            logger.warning(f"Node '{node_id}' is unhealthy: {reason}")
+        node.unhealthy_reason = reason
+        return True
+
+    @property
+    def healthy(self):
+        return [node for node in self.nodes.values() if node.is_healthy]
+
+    @property
+    def devices(self) -> list[str]:
+        return sorted({serial for node in self.nodes.values() for serial in node.devices})
+
+    def candidates(self, serial: str):
+        return [node for node in self.nodes.values() if serial in node.devices]
+
+    def owner(self, serial: str) -> Optional[Node]:
+        previous = self._owners.get(serial)
+        current = self.nodes.get(previous) if previous is not None else None
+        if current is not None and current.is_healthy and serial in current.devices:
+            return current
+        owner = next((node for node in self.candidates(serial) if node.is_healthy), None)
+        if owner is not None and owner.node_id != previous:
+            if previous is not None:
+                logger.warning(f"Failing device {serial} over from node '{previous}' to '{owner.node_id}'")
+                COORDINATOR_FAILOVERS.labels(serial=serial).inc()
+            self._owners[serial] = owner.node_id
+        return owner
+
+    def default_node(self) -> Optional[Node]:
+        """Node for requests that don't name a device, None if ambiguous"""
+        devices = self.devices
+        if len(devices) == 1:
+            return self.owner(devices[0])
+        if len(devices) == 0:
+            return next(iter(self.healthy), None)
+        return None
+
+
+def escape_label_value(value: str):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsAggregator:
+    """Merges Prometheus text exposition from several sources into one,
+    labeling every sample with its source"""
+
+    def __init__(self):
+        self.families: dict[str, tuple[str, str, list[Sample]]] = {}
+
+    def add(self, exposition: str, node_id: str):
+        for family in text_string_to_metric_families(exposition):
+            _, _, samples = self.families.setdefault(family.name, (family.documentation, family.type, []))
+            samples.extend(
+                sample._replace(labels={NODE_LABEL: node_id, **sample.labels})
+                for sample in family.samples
+            )
+
+    def render(self):
+        lines: list[str] = []
+        for name, (documentation, family_type, samples) in self.families.items():
+            help_text = documentation.replace("\\", "\\\\").replace("\n", "\\n")
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {family_type}")
+            for sample in samples:
+                labels = ",".join(f'{key}="{escape_label_value(value)}"' for key, value in sample.labels.items())
+                lines.append(f"{sample.name}{{{labels}}} {floatToGoString(sample.value)}")
+        return "\n".join(lines) + "\n"
+
+
+async def parse_body(request: Request, cls):
+    try:
+        return cls.from_dict(await request.json())
+    except (ValueError, KeyError, TypeError) as e:
+        raise web.HTTPBadRequest(text=f"Invalid {cls.__name__}: {e.__class__.__name__}: {e}")
+
+
+class Coordinator:
+    def __init__(self, config: CtlConfig):
+        self.config = config
+        self.nodes = NodeRegistry()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.auth: Optional[BasicAuthMiddleware] = None
+        if config.http_basic_password is not None:
+            self.auth = BasicAuthMiddleware(username="admin", password=config.http_basic_password, force=False)
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=PROXY_TIMEOUT),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def handle_heartbeat(self, request: Request):
+        self.nodes.heartbeat(await parse_body(request, Heartbeat))
+        return web.json_response({"ok": True})
+
+    async def handle_health_report(self, request: Request):
+        report = await parse_body(request, HealthReport)
+        if not self.nodes.mark_unhealthy(report.node_id, f"reported: {report.reason}"):
+            return web.json_response({"error": f"Unknown node '{report.node_id}'"}, status=404)
+        return web.json_response({"ok": True})
+
+    async def handle_nodes(self, _: Request):
+        return web.json_response({node_id: node.to_report() for node_id, node in self.nodes.nodes.items()})
+
+    def device_report(self):
+        report = {}
+        for serial in self.nodes.devices:
+            owner = self.nodes.owner(serial)
+            report[serial] = {
+                "owner": owner.node_id if owner is not None else None,
+                "standbys": [
+                    node.node_id for node in self.nodes.candidates(serial)
+                    if node.is_healthy and node is not owner
+                ],
+            }
+        return report
+
+    async def handle_devices(self, _: Request):
+        return web.json_response(self.device_report())
+
+    async def handle_readiness(self, request: Request):
+        devices = self.device_report()
+        ready = len(devices) > 0 and all(device["owner"] is not None for device in devices.values())
+        # Open for probes, details (devices and nodes) only with credentials
+        if self.auth is not None and not await self.auth.authenticate(request):
+            return web.json_response({"ready": ready}, status=200 if ready else 503)
+        return web.json_response(
+            {
+                "ready": ready,
+                "devices": devices,
+                "nodes": {node_id: node.to_report() for node_id, node in self.nodes.nodes.items()},
+            },
+            status=200 if ready else 503,
+        )
+
+    async def fetch_metrics(self, node: Node) -> Optional[str]:
+        try:
+            async with self._get_session().get(
+                f"{node.base_url}/metrics",
+                timeout=aiohttp.ClientTimeout(total=METRICS_FETCH_TIMEOUT),
+            ) as resp:
+                resp.raise_for_status()
+                return await resp.text()
+        except Exception as e:
+            logger.warning(f"Could not fetch metrics of node '{node.node_id}': {e.__class__.__name__}: {e}")
+            return None
+
+    async def handle_metrics(self, _: Request):
+        nodes = self.nodes.healthy
+        expositions = await asyncio.gather(*(self.fetch_metrics(node) for node in nodes))
+        aggregator = MetricsAggregator()
+        aggregator.add(prometheus_client.generate_latest().decode(), "coordinator")
+        for node, exposition in zip(nodes, expositions):
+            if exposition is not None:
+                aggregator.add(exposition, node.node_id)
+        return Response(text=aggregator.render())
+
+    async def forward(self, node: Node, request: Request) -> Response:
+        url = f"{node.base_url}{request.rel_url}"
+        headers = CIMultiDict(
+            (key, value) for key, value in request.headers.items()
+            if key.lower() not in HOP_BY_HOP_HEADERS
+        )
+        body = await request.read()
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            async with self._get_session().request(
+                request.method, url, headers=headers, data=body, allow_redirects=False,
+            ) as resp:
+                content = await resp.read()
+                outcome = f"{resp.status // 100}xx"
+                response_headers = CIMultiDict(
+                    (key, value) for key, value in resp.headers.items()
+                    if key.lower() not in RESPONSE_HEADERS_DROPPED
+                )
+                return Response(body=content, status=resp.status, headers=response_headers)
+        finally:
+            COORDINATOR_PROXY_DURATION.labels(node=node.node_id, outcome=outcome).observe(
+                time.perf_counter() - start
+            )
+
+    async def forward_with_failover(self, pick_node, request: Request, target: str):
+        while True:
+            node = pick_node()
+            if node is None:
+                return web.json_response({"error": f"No healthy node for {target}"}, status=503)
+            try:
+                return await self.forward(node, request)
+            except aiohttp.ClientConnectorError as e:
+                # Never reached the node, safe to send to the next one
+                self.nodes.mark_unhealthy(node.node_id, f"unreachable: {e.__class__.__name__}: {e}")
+            except aiohttp.ClientConnectionError as e:
+                self.nodes.mark_unhealthy(node.node_id, f"connection lost: {e.__class__.__name__}: {e}")
+                if request.method not in RETRYABLE_METHODS:
+                    return web.json_response({"error": f"Lost connection to node '{node.node_id}' while handling the request"}, status=502)
+            except TimeoutError:
+                return web.json_response({"error": f"Node '{node.node_id}' did not answer in time"}, status=504)
+
+    async def handle_device_request(self, request: Request):
+        serial = request.match_info["serial"]
+        if len(self.nodes.candidates(serial)) == 0:
+            raise web.HTTPNotFound(text=f"No node has a device with serial '{serial}'")
+        return await self.forward_with_failover(lambda: self.nodes.owner(serial), request, f"device {serial}")
+
+    async def handle_default_request(self, request: Request):
+        if len(self.nodes.devices) > 1:
+            raise web.HTTPBadRequest(
+                text=f"The cluster has several devices ({', '.join(self.nodes.devices)}), use /devices/<serial>{request.rel_url}"
+            )
+        return await self.forward_with_failover(self.nodes.default_node, request, "this request")
+
+    async def handle_static(self, request: Request):
+        return await self.forward_with_failover(lambda: next(iter(self.nodes.healthy), None), request, "static files")
+
+    def create_routes(self):
+        secure_routes = [
+            web.post(HEARTBEAT_PATH, self.handle_heartbeat),
+            web.post(HEALTH_REPORT_PATH, self.handle_health_report),
+            web.get("/cluster/nodes", self.handle_nodes),
+            web.get("/devices", self.handle_devices),
+            web.route("*", "/devices/{serial}/{tail:.*}", self.handle_device_request),
+            web.get("/static/{tail:.*}", self.handle_static),
+            web.route("*", "/{tail:.*}", self.handle_default_request),
+        ]
+        if self.auth is not None:
+            secure_routes = wrap_all(secure_routes, self.auth.required)
+        return [
+            web.get(HEALTH_CHECK_PATH, lambda _: Response(text="OK")),
+            web.get(READINESS_CHECK_PATH, self.handle_readiness),
+            web.get("/metrics", self.handle_metrics),
+            *secure_routes,
+        ]
+
+
+async def start_coordinator(config: CtlConfig):
+    coordinator = Coordinator(config)
+    app = web.Application()
+    app.add_routes(coordinator.create_routes())
+    app.on_cleanup.append(lambda _: coordinator.close())
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.coordinator_host, config.coordinator_port)
+    await site.start()
+    logger.info(f"Coordinator listening on {config.coordinator_host}:{config.coordinator_port}")
+    return runner
+
+
+async def run_coordinator(config: CtlConfig):
+    logger.info("Starting droid remote cluster coordinator...")
+    running_tasks: list[asyncio.Task] = []
+    add_signal_handlers(running_tasks)
+    runner = await start_coordinator(config)
+    if config.ngrok_domain is not None:
+        running_tasks.append(asyncio.create_task(run_ngrok(
+            config.ngrok_domain, config.pid_file_paths.child_pgids, config.coordinator_port,
+        )))
+    else:
+        running_tasks.append(asyncio.create_task(asyncio.Event().wait()))
+    try:
+        await asyncio.wait(running_tasks)
+    finally:
+        await runner.cleanup()
+
+
+def main(config: CtlConfig):
+    pid_file_paths = config.pid_file_paths
+    ensure_no_existing_process_or_exit(
+        pid_file_paths,
+        config.daemon_name,
+        config.treat_kill_permission_error_as_not_running,
+    )
+    init_pid_files(pid_file_paths)
+    try:
+        asyncio.run(run_coordinator(config))
+    except asyncio.CancelledError:
+        pass
+    finally:
+        clear_pid_files(pid_file_paths)
@@ -10,7 +10,7 @@ from .dataclasses_json_conf import configure_dataclasses_json
 from .pid_management import PidFilePaths, read_pid, check_if_process_running
 from .config import ServerConfig, CtlConfig, safe_generate, generate_ctl_config_from_args, populate_ctl_arg_parser, CtlActions
 from .log_setup import setup_logging
-from .health import check_daemon_health_http, DaemonHealthCheckError
+from .health import check_daemon_health_http, get_daemon_readiness, DaemonHealthCheckError
 
 
 logger = logging.getLogger(__name__)
@@ -22,7 +22,7 @@ def status_server_daemon(config: CtlConfig):
         pid,
         config.treat_kill_permission_error_as_not_running,
     )
-    http_healthy = check_daemon_health_http(config.monitoring_base_url)
+    http_healthy = asyncio.run(check_daemon_health_http(config.monitoring_base_url))
     if not process_healthy and not http_healthy:
         logger.info("Server not running")
         return
@@ -34,6 +34,14 @@ def status_server_daemon(config: CtlConfig):
         sys.exit(1)
 
     logger.info("Server running and healthy")
+    try:
+        readiness = asyncio.run(get_daemon_readiness(config.monitoring_base_url, config.http_basic_password))
+    except DaemonHealthCheckError as e:
+        logger.warning(f"Could not get server readiness: {e}")
+        return
+    logger.info(f"Server {'ready' if readiness['ready'] else 'not ready'}:")
+    for name, check in readiness.get("checks", {}).items():
+        logger.info(f"  {name}: {'ok' if check['ok'] else 'FAILING'} ({check['detail']})")
         
 
 def status_watchdog_daemon(config: CtlConfig):
@@ -43,10 +51,10 @@ def status_watchdog_daemon(config: CtlConfig):
         config.treat_kill_permission_error_as_not_running,
     )
     if not process_healthy:
-        logger.info("Watchdog not running")
+        logger.info(f"{config.daemon_name_cap} not running")
         return
     
-    logger.info("Watchdog running")
+    logger.info(f"{config.daemon_name_cap} running")
 
 
 def run_server_foreground(config: ServerConfig):
@@ -59,6 +67,11 @@ def run_watchdog_foreground(config: CtlConfig):
     watchdog_main(config)
 
 
+def run_coordinator_foreground(config: CtlConfig):
+    from .coordinator import main as coordinator_main
+    coordinator_main(config)
+
+
 def main():
     configure_dataclasses_json()
     load_dotenv()
@@ -75,16 +88,22 @@ def main():
     args = parser.parse_args()
     action = args.action
     config = safe_generate(args, generate_ctl_config_from_args)
-    setup_logging(config.ctl_log_file_path, log_file_level=config.ctl_log_file_log_level)
+    setup_logging(
+        config.ctl_log_file_path,
+        log_file_level=config.ctl_log_file_log_level,
+        daemonized=config.daemonized,
+    )
 
     try:
         if action == CtlActions.FOREGROUND.cli_name:
-            if config.watchdog:
+            if config.coordinator:
+                run_coordinator_foreground(config)
+            elif config.watchdog:
                 run_watchdog_foreground(config)
             else:
                 run_server_foreground(config)
         elif action == CtlActions.STATUS.cli_name:
-            if config.watchdog:
+            if config.watchdog or config.coordinator:
                 status_watchdog_daemon(config)
             else:
                 status_server_daemon(config)
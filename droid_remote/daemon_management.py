@@ -1,13 +1,15 @@
 import logging
 import asyncio
+import dataclasses
 from asyncio import subprocess
 import signal
 import sys
 import os
-from .pid_management import read_pid, read_child_pgids
+from .pid_management import read_pid, read_child_pgids, wait_for_process_exit
 from .config import CtlConfig, CtlActions
 
 
+DAEMON_STOP_TIMEOUT = 10
 logger = logging.getLogger(__name__)
 
 
@@ -72,7 +74,7 @@ async def forward_stderr(proc: subprocess.Process):
 
 async def start_daemon(config: CtlConfig):
     python_interpreter = sys.executable
-    config_json = config.to_json()
+    config_json = dataclasses.replace(config, daemonized=True).to_json()
     logger.debug(f"Starting {config.daemon_name} daemon...")
     daemon_proc = await subprocess.create_subprocess_exec(
         python_interpreter, "-m", "droid_remote",
@@ -96,9 +98,24 @@ def stop_daemon(config: CtlConfig):
     send_kill_signal(config, signal.SIGTERM)
 
 
+async def stop_daemon_and_wait(config: CtlConfig, timeout: float = DAEMON_STOP_TIMEOUT):
+    """SIGTERM the daemon and wait for it to exit, SIGKILLing it if it takes
+    longer than `timeout` seconds"""
+    pid = read_pid(config.pid_file_paths.daemon_pid)
+    stop_daemon(config)
+    try:
+        async with asyncio.timeout(timeout):
+            await wait_for_process_exit(pid)
+        return
+    except TimeoutError:
+        logger.warning(f"{config.daemon_name_cap} daemon did not exit within {timeout}s, killing it...")
+    force_stop_daemon(config)
+    await wait_for_process_exit(pid)
+
+
 async def restart_daemon(config: CtlConfig):
     logger.info(f"Restarting {config.daemon_name} daemon...")
-    stop_daemon(config)
+    await stop_daemon_and_wait(config)
     await start_daemon(config)
 
 
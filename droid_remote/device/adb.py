@@ -1,73 +1,282 @@
 import asyncio
+from contextlib import aclosing
 from dataclasses import dataclass
 from functools import cached_property
+import inspect
+import logging
 from lxml import etree
 import re
+import shlex
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional, Sequence
 from datetime import timedelta as Timedelta
 
-from ..subprocess_utils import run_command
+from ..metrics import (
+    ADB_COMMAND_DURATION, UI_DUMP_DURATION, UI_DUMP_PARSE_DURATION, UI_DUMP_SIZE,
+    measure, timed,
+)
+from ..subprocess_utils import CommandException
+from .adb_backend import AdbBackend, AdbBackendKind, create_backend
+from .adb_shell import adb_command
+from .registry import (
+    CachedScreen, Device, DeviceState, UnknownDeviceError, parse_devices, registry, target,
+)
+from .scheduler import Priority, priority, scheduler, single_flight
+from .ui_dump import UiDumpParser
 
 
 # Wireless ADB timeout is 20 minutes
 ADB_KEEPALIVE_INTERVAL = Timedelta(minutes=4)
+SCREEN_CHANGE_TIMEOUT = 5
+SCREEN_POLL_INITIAL_DELAY = 0.05
+SCREEN_POLL_MAX_DELAY = 0.8
+# Dumps take about a second, only reuse one within the same interaction
+SCREEN_CACHE_TTL = 2.0
+# A dump normally takes about a second, but uiautomator can hang on busy screens
+UI_DUMP_TIMEOUT = 20
+TAP_SEQUENCE_INTERVAL = 0.05
+DEVICE_TRACKING_MIN_RETRY_DELAY = 1
+DEVICE_TRACKING_MAX_RETRY_DELAY = 30
+logger = logging.getLogger(__name__)
 
 
-async def run_adb_command(*args: str):
-    return await run_command("adb", *args)
+backend: AdbBackend = create_backend(AdbBackendKind.PROCESS)
 
 
-async def connect(adb_host: str):
-    return await run_adb_command("connect", adb_host)
+def install_backend(new_backend: AdbBackend):
+    global backend
+    backend = new_backend
+    invalidate_all_screen_caches()
 
 
-async def disconnect():
-    return await run_adb_command("disconnect")
+def set_backend(kind: AdbBackendKind, replay_serials: Sequence[str] = ("replay",)):
+    install_backend(create_backend(kind, replay_serials))
 
 
-@dataclass(frozen=True)
-class Device:
-    connection_string: str
-    connection_mode: str
-    identity: dict[str, str]
+def current_device() -> DeviceState:
+    """The device adb calls in this context go to, see `registry.target`"""
+    return registry.current()
+
+
+async def run_adb_shell_script(script: str):
+    command = script.split(maxsplit=1)[0] if len(script) > 0 else ""
+    device = current_device()
+    async with device.scheduler.command():
+        with measure(ADB_COMMAND_DURATION, subcommand="shell", command=command):
+            returncode, output = await backend.shell(script, serial=device.serial)
+    if returncode != 0:
+        # stdout and stderr are merged by both backends
+        raise CommandException([*adb_command(device.serial), "shell", script], returncode, output, output)
+    return output
 
-    @classmethod
-    def from_adb_devices_line(cls, line: str):
-        connection_string, connection_mode, *identity_part_strs = line.split()
-        identity_parts = [part.split(":") for part in identity_part_strs]
-        identity = {key: value for key, value in identity_parts}
-        return cls(connection_string, connection_mode, identity)
 
+async def run_adb_shell_command(*args: str):
+    return await run_adb_shell_script(shlex.join(args))
 
-DEVICE_LIST_FIRST_LINE = "List of devices attached"
 
+async def run_adb_input_script(script: str):
+    """Run a shell script that changes what is on screen"""
+    invalidate_screen_cache()
+    try:
+        return await run_adb_shell_script(script)
+    finally:
+        invalidate_screen_cache()
+
+
+async def run_adb_input_command(*args: str):
+    return await run_adb_input_script(shlex.join(args))
+
+
+@timed(ADB_COMMAND_DURATION, subcommand="connect", command="")
+async def connect(adb_host: str):
+    async with scheduler.command():
+        invalidate_all_screen_caches()
+        return await backend.connect(adb_host)
+
+
+@timed(ADB_COMMAND_DURATION, subcommand="disconnect", command="")
+async def disconnect():
+    async with scheduler.command():
+        invalidate_all_screen_caches()
+        return await backend.disconnect()
+
+
+@single_flight()
+@timed(ADB_COMMAND_DURATION, subcommand="devices", command="")
 async def list_devices():
-    devices_output = await run_adb_command("devices", "-l")
-    first_line, *device_lines = devices_output.splitlines()
-    if first_line != DEVICE_LIST_FIRST_LINE:
-        raise ValueError(f"Unexpected output from 'adb devices': {devices_output}")
-    filtered_device_lines = [line for line in device_lines if len(line) > 0]
-    return [Device.from_adb_devices_line(line) for line in filtered_device_lines]
+    """Attached devices. Also refreshes the registry."""
+    async with scheduler.command():
+        devices = parse_devices(await backend.list_devices())
+    registry.update(devices)
+    return devices
 
 
-async def reboot():
-    return await run_adb_command("reboot")
+async def require_device(serial: str):
+    """The attached device with `serial`, looking again if the registry
+    doesn't know it (yet). Raises UnknownDeviceError."""
+    if serial not in registry:
+        await list_devices()
+    return registry.require(serial)
 
 
-async def tap(coords: tuple[int, int]):
-    x, y = coords
-    return await run_adb_command("shell", "input", "tap", str(x), str(y))
+async def track_devices_forever():
+    """Keep the registry up to date through `adb track-devices`"""
+    delay = DEVICE_TRACKING_MIN_RETRY_DELAY
+    while True:
+        try:
+            async with aclosing(backend.track_devices()) as device_lists:
+                async for devices_output in device_lists:
+                    registry.update(parse_devices(devices_output))
+                    delay = DEVICE_TRACKING_MIN_RETRY_DELAY
+        except Exception as e:
+            logger.warning(f"Tracking adb devices failed, retrying in {delay}s: {e.__class__.__name__}: {e}")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, DEVICE_TRACKING_MAX_RETRY_DELAY)
+
+
+@timed(ADB_COMMAND_DURATION, subcommand="reboot", command="")
+async def reboot():
+    device = current_device()
+    async with device.scheduler.command():
+        device.invalidate_screen_cache()
+        return await backend.reboot(serial=device.serial)
+
+
+async def tap_sequence(
+    coords: Sequence[tuple[float, float]],
+    interval: float = TAP_SEQUENCE_INTERVAL,
+):
+    """Tap all coordinates in order, in a single shell invocation. Stops at
+    the first tap that fails."""
+    taps = [shlex.join(["input", "tap", str(x), str(y)]) for x, y in coords]
+    return await run_adb_input_script(f" && sleep {interval:g} && ".join(taps))
+
+
+async def tap(coords: tuple[float, float]):
+    return await tap_sequence([coords])
+
+
+UI_DUMP_COMMAND = ("uiautomator", "dump", "/dev/tty")
+
+
+async def stream_screen_hierarchy(
+    parser: Optional[UiDumpParser] = None,
+) -> AsyncIterator[etree._Element]:
+    """Yield elements of the screen hierarchy while it is being dumped, as
+    soon as their attributes are known"""
+    if parser is None:
+        parser = UiDumpParser()
+    device = current_device()
+    async with device.scheduler.stream():
+        async with aclosing(backend.stream_exec_out(*UI_DUMP_COMMAND, serial=device.serial)) as chunks:
+            async for chunk in chunks:
+                for element in parser.feed(chunk):
+                    yield element
+
+
+def invalidate_screen_cache():
+    current_device().invalidate_screen_cache()
+
+
+def invalidate_all_screen_caches():
+    for device in registry.all_states():
+        device.invalidate_screen_cache()
+
+
+def get_cached_screen(
+    hierarchy: Optional[etree._Element] = None,
+    max_age: float = SCREEN_CACHE_TTL,
+) -> Optional[CachedScreen]:
+    """The cache entry if it is fresh (and for `hierarchy`, if given)"""
+    screen_cache = current_device().screen_cache
+    if screen_cache is None or screen_cache.age > max_age:
+        return None
+    if hierarchy is not None and screen_cache.hierarchy is not hierarchy:
+        return None
+    return screen_cache
+
+
+async def dump_screen_hierarchy(device: DeviceState) -> tuple[etree._Element, bytes]:
+    generation = device.screen_cache_generation
+    read_at = time.monotonic()
+    parser = UiDumpParser()
+    with measure(UI_DUMP_DURATION):
+        async with asyncio.timeout(UI_DUMP_TIMEOUT):
+            async for _ in stream_screen_hierarchy(parser):
+                pass
+        screen = parser.close()
+    UI_DUMP_SIZE.observe(parser.size)
+    UI_DUMP_PARSE_DURATION.observe(parser.parse_seconds)
+    digest = parser.digest
+    device.last_screen_digest = digest
+    if generation == device.screen_cache_generation:
+        device.screen_cache = CachedScreen(screen, digest, read_at)
+    return screen, digest
+
+
+async def read_screen_hierarchy_with_digest() -> tuple[etree._Element, bytes]:
+    """Always dumps the screen, refreshing the cache. Concurrent callers share
+    a single dump."""
+    device = current_device()
+    return await device.scheduler.single_flight(
+        "read_screen_hierarchy_with_digest",
+        lambda: dump_screen_hierarchy(device),
+    )
 
 
-async def read_screen_hierarchy() -> etree._Element:
-    dump_output = await run_adb_command("exec-out", "uiautomator", "dump", "/dev/tty")
-    hierarchy_xml_end_i = dump_output.rfind("UI hierchary dumped to: ")
-    hierarchy_xml = dump_output[:hierarchy_xml_end_i]
-    return etree.XML(hierarchy_xml.encode())
+async def read_screen_hierarchy(max_age: float = SCREEN_CACHE_TTL) -> etree._Element:
+    """Dump the screen, unless it was dumped less than `max_age` seconds ago
+    and no input events have been sent since"""
+    cached = get_cached_screen(max_age=max_age)
+    if cached is not None:
+        return cached.hierarchy
+    screen, _ = await read_screen_hierarchy_with_digest()
+    return screen
+
+
+async def wait_for_screen_change(
+    predicate: Optional[Callable[[etree._Element], bool | Awaitable[bool]]] = None,
+    timeout: float = SCREEN_CHANGE_TIMEOUT,
+) -> etree._Element:
+    """Poll the screen hierarchy, backing off exponentially, until it differs
+    from the last one read (and satisfies `predicate`, if given). Meant to be
+    called right after an input event. On timeout, returns the latest screen."""
+    previous_digest = current_device().last_screen_digest
+    delay = SCREEN_POLL_INITIAL_DELAY
+    screen: Optional[etree._Element] = None
+    try:
+        async with asyncio.timeout(timeout):
+            while True:
+                await asyncio.sleep(delay)
+                screen, digest = await read_screen_hierarchy_with_digest()
+                if digest != previous_digest:
+                    matches = True if predicate is None else predicate(screen)
+                    if inspect.isawaitable(matches):
+                        matches = await matches
+                    if matches:
+                        return screen
+                delay = min(delay * 2, SCREEN_POLL_MAX_DELAY)
+    except TimeoutError:
+        logger.warning(f"Screen did not change as expected within {timeout} seconds")
+    if screen is None:
+        screen, _ = await read_screen_hierarchy_with_digest()
+    return screen
+
+
+async def find_node_on_screen(
+    predicate: Callable[[etree._Element], bool],
+) -> Optional[etree._Element]:
+    """Return the first node matching `predicate` without waiting for the
+    rest of the dump"""
+    async with aclosing(stream_screen_hierarchy()) as elements:
+        async for element in elements:
+            if predicate(element):
+                return element
+    return None
 
 
 async def launch_app(package_name: str):
-    return await run_adb_command(
-        "shell",
+    return await run_adb_input_command(
         "monkey",
         "-p",
         package_name,
@@ -78,17 +287,18 @@ async def launch_app(package_name: str):
 
 
 async def force_stop_app(package_name: str):
-    return await run_adb_command("shell", "am", "force-stop", package_name)
+    return await run_adb_input_command("am", "force-stop", package_name)
 
 
 async def wake_up():
-    return await run_adb_command("shell", "input", "keyevent", "KEYCODE_WAKEUP")
+    return await run_adb_input_command("input", "keyevent", "KEYCODE_WAKEUP")
 
 
 async def send_periodic_keep_alive():
-    while True:
-        await run_adb_command("shell", "ls")
-        await asyncio.sleep(ADB_KEEPALIVE_INTERVAL.total_seconds())
+    with priority(Priority.BACKGROUND):
+        while True:
+            await run_adb_shell_command("ls")
+            await asyncio.sleep(ADB_KEEPALIVE_INTERVAL.total_seconds())
 
 
 @dataclass(frozen=True)
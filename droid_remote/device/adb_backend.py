@@ -0,0 +1,135 @@
+from enum import Enum
+import shlex
+from typing import AsyncIterator, Optional, Protocol, Sequence
+
+from ..subprocess_utils import run_command, stream_command
+from . import adb_protocol
+from .adb_shell import AdbShellSessionPool, adb_command
+
+
+DEVICE_LIST_FIRST_LINE = "List of devices attached"
+
+
+class AdbBackendKind(Enum):
+    PROCESS = "process"
+    """Exec the `adb` binary (with persistent shell sessions)"""
+    SOCKET = "socket"
+    """Talk to the adb server on port 5037 directly"""
+    REPLAY = "replay"
+    """Replay itsme_adb's fixture dumps instead of using a device, for tests"""
+
+
+class AdbBackend(Protocol):
+    """Device calls go to the device with the given serial, or to the only
+    device if it is None"""
+
+    async def list_devices(self) -> str:
+        """`adb devices -l` output, without the header line"""
+        ...
+
+    def track_devices(self) -> AsyncIterator[str]:
+        """`list_devices` output right away and after every change"""
+        ...
+
+    async def connect(self, adb_host: str) -> str:
+        ...
+
+    async def disconnect(self) -> str:
+        ...
+
+    async def reboot(self, serial: Optional[str] = None) -> str:
+        ...
+
+    async def shell(self, script: str, serial: Optional[str] = None) -> tuple[int, str]:
+        """Exit status and combined stdout/stderr of a shell script"""
+        ...
+
+    def stream_exec_out(self, *args: str, serial: Optional[str] = None) -> AsyncIterator[bytes]:
+        """Raw stdout of a device command, as it arrives"""
+        ...
+
+
+class ProcessAdbBackend:
+    def __init__(self):
+        self.shell_session_pools: dict[Optional[str], AdbShellSessionPool] = {}
+
+    def shell_session_pool(self, serial: Optional[str]):
+        pool = self.shell_session_pools.get(serial)
+        if pool is None:
+            pool = self.shell_session_pools[serial] = AdbShellSessionPool(serial=serial)
+        return pool
+
+    def close_shell_sessions(self):
+        for pool in self.shell_session_pools.values():
+            pool.close()
+
+    async def list_devices(self):
+        devices_output = await run_command("adb", "devices", "-l")
+        first_line, *device_lines = devices_output.splitlines()
+        if first_line != DEVICE_LIST_FIRST_LINE:
+            raise ValueError(f"Unexpected output from 'adb devices': {devices_output}")
+        return "\n".join(device_lines)
+
+    async def track_devices(self):
+        # Same framing as the adb server uses: 4 hex digits of length, then
+        # the device list
+        buffer = b""
+        async for chunk in stream_command("adb", "track-devices", "-l", timeout=None):
+            buffer += chunk
+            while len(buffer) >= 4 and len(buffer) >= 4 + int(buffer[:4], 16):
+                length = int(buffer[:4], 16)
+                yield buffer[4:4 + length].decode(errors="replace")
+                buffer = buffer[4 + length:]
+
+    async def connect(self, adb_host: str):
+        # Sessions opened before (re)connecting may belong to a stale transport
+        self.close_shell_sessions()
+        return await run_command("adb", "connect", adb_host)
+
+    async def disconnect(self):
+        self.close_shell_sessions()
+        return await run_command("adb", "disconnect")
+
+    async def reboot(self, serial: Optional[str] = None):
+        self.shell_session_pool(serial).close()
+        return await run_command(*adb_command(serial), "reboot")
+
+    async def shell(self, script: str, serial: Optional[str] = None):
+        return await self.shell_session_pool(serial).run(script)
+
+    def stream_exec_out(self, *args: str, serial: Optional[str] = None):
+        return stream_command(*adb_command(serial), "exec-out", *args)
+
+
+class SocketAdbBackend:
+    async def list_devices(self):
+        return await adb_protocol.list_devices()
+
+    def track_devices(self):
+        return adb_protocol.track_devices()
+
+    async def connect(self, adb_host: str):
+        return await adb_protocol.connect(adb_host)
+
+    async def disconnect(self):
+        return await adb_protocol.disconnect()
+
+    async def reboot(self, serial: Optional[str] = None):
+        await adb_protocol.reboot(serial)
+        return ""
+
+    async def shell(self, script: str, serial: Optional[str] = None):
+        return await adb_protocol.shell(script, serial)
+
+    def stream_exec_out(self, *args: str, serial: Optional[str] = None):
+        return adb_protocol.stream_exec_out(shlex.join(args), serial)
+
+
+def create_backend(kind: AdbBackendKind, replay_serials: Sequence[str] = ("replay",)) -> AdbBackend:
+    if kind == AdbBackendKind.SOCKET:
+        return SocketAdbBackend()
+    if kind == AdbBackendKind.REPLAY:
+        # itsme_adb.replay builds on this module
+        from itsme_adb.replay import replay_devices
+        return replay_devices(replay_serials)
+    return ProcessAdbBackend()
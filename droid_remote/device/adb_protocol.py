@@ -0,0 +1,209 @@
+"""Minimal asyncio client for the adb host protocol, spoken by the adb server
+on TCP port 5037. See `protocol.txt`, `SERVICES.TXT` and `SYNC.TXT` in the
+adb sources for the wire format."""
+
+import asyncio
+import struct
+from typing import AsyncIterator, Optional
+
+from ..subprocess_utils import CommandException
+
+
+ADB_SERVER_HOST = "127.0.0.1"
+ADB_SERVER_PORT = 5037
+STREAM_CHUNK_SIZE = 64 * 1024
+SYNC_DATA_MAX = 64 * 1024
+
+# Shell protocol (v2) packet ids
+SHELL_ID_STDOUT = 1
+SHELL_ID_STDERR = 2
+SHELL_ID_EXIT = 3
+
+
+class AdbProtocolError(Exception):
+    pass
+
+
+class AdbServerFailure(AdbProtocolError, CommandException):
+    """The adb server answered a request with FAIL. A CommandException like
+    the one the `adb` binary's exit status 1 gives with the process backend,
+    with the message as stderr."""
+
+    def __init__(self, request: str, message: str):
+        CommandException.__init__(self, ["adb", request], 1, message, "")
+        AdbProtocolError.__init__(self, f"adb server refused '{request}': {message}")
+        self.request = request
+        self.message = message
+
+    def __str__(self):
+        return AdbProtocolError.__str__(self)
+
+
+class AdbServerConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host: Optional[str] = None, port: Optional[int] = None):
+        reader, writer = await asyncio.open_connection(host or ADB_SERVER_HOST, port or ADB_SERVER_PORT)
+        return cls(reader, writer)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        self.close()
+
+    def close(self):
+        self.writer.close()
+
+    async def request(self, request: str):
+        """Send a hex-length-prefixed request and wait for OKAY"""
+        payload = request.encode()
+        self.writer.write(f"{len(payload):04x}".encode() + payload)
+        await self.writer.drain()
+        status = await self.reader.readexactly(4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            message = (await self.read_hex_prefixed()).decode(errors="replace")
+            raise AdbServerFailure(request, message)
+        raise AdbProtocolError(f"Unexpected status {status!r} for '{request}'")
+
+    async def read_hex_prefixed(self) -> bytes:
+        length = int(await self.reader.readexactly(4), 16)
+        return await self.reader.readexactly(length)
+
+    async def read_until_close(self) -> bytes:
+        return await self.reader.read()
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        while True:
+            chunk = await self.reader.read(STREAM_CHUNK_SIZE)
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+
+async def host_query(service: str) -> str:
+    """Run a `host:` service that answers with a single length-prefixed string"""
+    async with await AdbServerConnection.open() as conn:
+        await conn.request(service)
+        return (await conn.read_hex_prefixed()).decode()
+
+
+async def list_devices() -> str:
+    """Same format as the output of `adb devices -l`, without the header line"""
+    return await host_query("host:devices-l")
+
+
+async def track_devices() -> AsyncIterator[str]:
+    """Yield the device list (as `list_devices`) right away and again every
+    time it changes"""
+    async with await AdbServerConnection.open() as conn:
+        await conn.request("host:track-devices-l")
+        while True:
+            yield (await conn.read_hex_prefixed()).decode()
+
+
+async def connect(adb_host: str) -> str:
+    return await host_query(f"host:connect:{adb_host}")
+
+
+async def disconnect(adb_host: str = "") -> str:
+    return await host_query(f"host:disconnect:{adb_host}")
+
+
+async def open_device_service(service: str, serial: Optional[str] = None):
+    """Switch a new connection to the transport of the given (or the only)
+    device and open `service` on it. The caller owns the returned connection."""
+    conn = await AdbServerConnection.open()
+    try:
+        transport = "host:transport-any" if serial is None else f"host:transport:{serial}"
+        await conn.request(transport)
+        await conn.request(service)
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+
+async def stream_exec_out(command: str, serial: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Raw, unbuffered stdout of `command`, like `adb exec-out`"""
+    conn = await open_device_service(f"exec:{command}", serial)
+    try:
+        async for chunk in conn.iter_chunks():
+            yield chunk
+    finally:
+        conn.close()
+
+
+async def exec_out(command: str, serial: Optional[str] = None) -> bytes:
+    async with await open_device_service(f"exec:{command}", serial) as conn:
+        return await conn.read_until_close()
+
+
+async def shell(command: str, serial: Optional[str] = None) -> tuple[int, str]:
+    """Run `command` with the v2 shell protocol, which reports the exit status.
+    Returns the status and stdout and stderr in the order they arrived."""
+    async with await open_device_service(f"shell,v2,raw:{command}", serial) as conn:
+        output = bytearray()
+        while True:
+            try:
+                header = await conn.reader.readexactly(5)
+            except asyncio.IncompleteReadError:
+                raise AdbProtocolError(f"Shell closed without exit status: {command}")
+            packet_id, length = struct.unpack("<BI", header)
+            data = await conn.reader.readexactly(length)
+            if packet_id in (SHELL_ID_STDOUT, SHELL_ID_STDERR):
+                output += data
+            elif packet_id == SHELL_ID_EXIT:
+                return data[0], output.decode(errors="replace")
+
+
+async def reboot(serial: Optional[str] = None):
+    async with await open_device_service("reboot:", serial) as conn:
+        await conn.read_until_close()
+
+
+def sync_packet(sync_id: bytes, payload: bytes = b""):
+    return sync_id + struct.pack("<I", len(payload)) + payload
+
+
+async def read_sync_header(conn: AdbServerConnection) -> tuple[bytes, int]:
+    header = await conn.reader.readexactly(8)
+    sync_id, length = header[:4], struct.unpack("<I", header[4:])[0]
+    if sync_id == b"FAIL":
+        message = (await conn.reader.readexactly(length)).decode(errors="replace")
+        raise AdbProtocolError(f"sync failed: {message}")
+    return sync_id, length
+
+
+async def sync_stat(path: str, serial: Optional[str] = None) -> tuple[int, int, int]:
+    """Return mode, size and mtime of a file on the device"""
+    async with await open_device_service("sync:", serial) as conn:
+        conn.writer.write(sync_packet(b"STAT", path.encode()))
+        await conn.writer.drain()
+        response = await conn.reader.readexactly(16)
+        if response[:4] != b"STAT":
+            raise AdbProtocolError(f"Unexpected sync response {response[:4]!r}")
+        mode, size, mtime = struct.unpack("<III", response[4:])
+        conn.writer.write(sync_packet(b"QUIT"))
+        return mode, size, mtime
+
+
+async def sync_pull(path: str, serial: Optional[str] = None) -> bytes:
+    async with await open_device_service("sync:", serial) as conn:
+        conn.writer.write(sync_packet(b"RECV", path.encode()))
+        await conn.writer.drain()
+        content = bytearray()
+        while True:
+            sync_id, length = await read_sync_header(conn)
+            if sync_id == b"DONE":
+                break
+            if sync_id != b"DATA" or length > SYNC_DATA_MAX:
+                raise AdbProtocolError(f"Unexpected sync response {sync_id!r} ({length=})")
+            content += await conn.reader.readexactly(length)
+        conn.writer.write(sync_packet(b"QUIT"))
+        return bytes(content)
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+from asyncio import subprocess
+from secrets import token_hex
+from typing import Optional
+
+from ..subprocess_utils import kill_process_group, reap, spawn
+
+
+SENTINEL_PREFIX = "__droid_remote_done_"
+DEFAULT_POOL_SIZE = 2
+logger = logging.getLogger(__name__)
+# Referenced until they're done, see AdbShellSession.close
+_reapers: set[asyncio.Task] = set()
+
+
+def adb_command(serial: Optional[str] = None):
+    """The `adb` invocation targeting `serial` (or the only device)"""
+    return ("adb",) if serial is None else ("adb", "-s", serial)
+
+
+class AdbShellSessionClosedError(Exception):
+    pass
+
+
+class AdbShellSession:
+    """A long-lived `adb shell` process that runs scripts one at a time.
+
+    The output of every script is followed by a sentinel line with a random
+    token and the exit status, which frames the output of consecutive scripts
+    without having to spawn a new `adb` client and shell for each of them.
+    """
+
+    def __init__(self, proc: subprocess.Process, generation: int = 0):
+        self._proc = proc
+        self._lock = asyncio.Lock()
+        self._closed = False
+        self.generation = generation
+
+    @classmethod
+    async def open(cls, generation: int = 0, serial: Optional[str] = None):
+        proc = await spawn(
+            *adb_command(serial),
+            "shell",
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        logger.debug(f"Opened adb shell session ({proc.pid=})")
+        return cls(proc, generation)
+
+    @property
+    def is_alive(self):
+        # A killed process keeps returncode None until it's reaped
+        return not self._closed and self._proc.returncode is None
+
+    async def run(self, script: str) -> tuple[int, str]:
+        """Run `script` and return its exit status and combined stdout/stderr."""
+        async with self._lock:
+            if not self.is_alive:
+                raise AdbShellSessionClosedError("adb shell session is closed")
+            try:
+                return await self._run(script)
+            except BaseException:
+                # Output of a half-read script would end up in the next one
+                self.close()
+                raise
+
+    async def _run(self, script: str):
+        stdin = self._proc.stdin
+        stdout = self._proc.stdout
+        assert stdin is not None and stdout is not None
+        sentinel = f"{SENTINEL_PREFIX}{token_hex(8)}"
+        # Commands must not read the script stream itself, hence </dev/null
+        stdin.write(
+            f"{{ {script}\n}} </dev/null 2>&1; printf '\\n%s %d\\n' {sentinel} $?\n".encode()
+        )
+        await stdin.drain()
+        lines: list[str] = []
+        while True:
+            line_bytes = await stdout.readline()
+            # EOF
+            if len(line_bytes) == 0:
+                raise AdbShellSessionClosedError(
+                    f"adb shell exited while running script: {''.join(lines)}"
+                )
+            line = line_bytes.decode(errors="replace")
+            if line.startswith(sentinel):
+                break
+            lines.append(line)
+        returncode = int(line.split()[1])
+        # The newline printed in front of the sentinel is not part of the output
+        output = "".join(lines).removesuffix("\n")
+        return returncode, output
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        logger.debug(f"Closing adb shell session ({self._proc.pid=})")
+        kill_process_group(self._proc)
+        # Waited for in the background so no zombie is left behind
+        reaper = asyncio.ensure_future(reap(self._proc))
+        _reapers.add(reaper)
+        reaper.add_done_callback(_reapers.discard)
+
+
+class AdbShellSessionPool:
+    """Keeps up to `size` adb shell sessions to a device open and hands them
+    out to concurrent callers. Sessions that die are replaced on the next
+    call."""
+
+    def __init__(self, size: int = DEFAULT_POOL_SIZE, serial: Optional[str] = None):
+        self.size = size
+        self.serial = serial
+        self._semaphore = asyncio.Semaphore(size)
+        self._idle: list[AdbShellSession] = []
+        # Bumped on close() so sessions that are in use at that moment get
+        # discarded instead of returned to the pool
+        self._generation = 0
+
+    def _take_idle(self) -> Optional[AdbShellSession]:
+        while len(self._idle) > 0:
+            session = self._idle.pop()
+            if session.is_alive:
+                return session
+        return None
+
+    async def run(self, script: str) -> tuple[int, str]:
+        async with self._semaphore:
+            session = self._take_idle()
+            if session is None:
+                session = await AdbShellSession.open(self._generation, self.serial)
+            try:
+                return await session.run(script)
+            finally:
+                if session.generation != self._generation:
+                    session.close()
+                elif session.is_alive:
+                    self._idle.append(session)
+
+    def close(self):
+        self._generation += 1
+        idle = self._idle
+        self._idle = []
+        for session in idle:
+            session.close()
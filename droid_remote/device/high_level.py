@@ -1,6 +1,7 @@
 import logging
 from . import adb, termux, tasker
 from .tasker import CallbackFutures
+from ..jobs import report_progress
 
 
 logger = logging.getLogger(__name__)
@@ -8,6 +9,7 @@ logger = logging.getLogger(__name__)
 
 async def adb_pair_and_connect(tasker_callback_futures: CallbackFutures):
     logger.debug("Enabling wireless adb and pairing...")
+    report_progress("Enabling wireless adb and pairing")
     task_result = await tasker.wireless_adb_enable_and_pair(tasker_callback_futures)
     logging.debug(f"Wireless adb enable and pair result: {task_result}")
     pair_status, pair_details = task_result.split(" ", 1)
@@ -16,6 +18,7 @@ async def adb_pair_and_connect(tasker_callback_futures: CallbackFutures):
         return f"Failed to pair: {pair_status} {pair_details}"
     adb_host = pair_details
     logger.debug(f"Connecting to adb at {adb_host}...")
+    report_progress(f"Connecting to adb at {adb_host}")
     await adb.disconnect()
     connect_result = await adb.connect(adb_host)
     return f"Connected to adb: {connect_result}"
@@ -29,10 +32,13 @@ async def ensure_ready_for_action(tasker_callback_futures: CallbackFutures):
     - Starts TailScale VPN
     """
     logger.debug("Ensuring device is ready for action...")
+    report_progress("Acquiring wake lock")
     await termux.wake_lock()
+    report_progress("Waking up and unlocking")
     await tasker.wake_up_and_unlock(tasker_callback_futures)
     await termux.set_screen_brightness(1)
     await adb_pair_and_connect(tasker_callback_futures)
+    report_progress("Starting Tailscale VPN")
     await termux.start_tailscale_vpnservice()
     logger.debug("Device is ready for action")
     return "Device is ready for action"
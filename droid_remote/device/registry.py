@@ -0,0 +1,184 @@
+"""Devices attached to the adb server, and per-device state.
+
+Which device adb calls go to is taken from the context, like the scheduling
+priority: `target(serial)` makes every adb call within the block (and within
+tasks created in it) go to that device. Outside of any `target` block calls
+go to the only attached device, or, with several attached, to whichever
+device adb itself picks (i.e. none, adb fails).
+
+Each device gets its own scheduler and screen cache, so flows on different
+devices don't wait for each other.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import logging
+import time
+from typing import Any, Optional
+from lxml import etree
+from .scheduler import DeviceScheduler
+
+
+ONLINE_CONNECTION_MODE = "device"
+logger = logging.getLogger(__name__)
+
+
+class UnknownDeviceError(Exception):
+    def __init__(self, serial: str):
+        super().__init__(f"No device with serial '{serial}' is attached")
+        self.serial = serial
+
+
+@dataclass(frozen=True)
+class Device:
+    connection_string: str
+    """The serial: `adb -s <connection_string>`"""
+    connection_mode: str
+    """"device" when online, otherwise e.g. "offline" or "unauthorized" """
+    identity: dict[str, str]
+
+    @classmethod
+    def from_adb_devices_line(cls, line: str):
+        connection_string, connection_mode, *identity_part_strs = line.split()
+        identity_parts = [part.split(":", 1) for part in identity_part_strs if ":" in part]
+        identity = {key: value for key, value in identity_parts}
+        return cls(connection_string, connection_mode, identity)
+
+    @property
+    def serial(self):
+        return self.connection_string
+
+    @property
+    def is_online(self):
+        return self.connection_mode == ONLINE_CONNECTION_MODE
+
+
+def parse_devices(devices_output: str) -> list[Device]:
+    """Parse `adb devices -l` output without its header line"""
+    return [
+        Device.from_adb_devices_line(line)
+        for line in devices_output.splitlines()
+        if len(line.strip()) > 0
+    ]
+
+
+@dataclass
+class CachedScreen:
+    hierarchy: etree._Element
+    digest: bytes
+    read_at: float
+    derived: dict[str, Any] = field(default_factory=dict)
+    """Values computed from the hierarchy by higher layers, e.g. the parsed
+    itsme screen"""
+
+    @property
+    def age(self):
+        return time.monotonic() - self.read_at
+
+
+class DeviceState:
+    def __init__(self, serial: Optional[str]):
+        self.serial = serial
+        """None for "the only device", as adb without `-s`, until the registry
+        knows which one that is"""
+        self.scheduler = DeviceScheduler()
+        self.screen_cache: Optional[CachedScreen] = None
+        # Bumped on every invalidation so a dump that was already running
+        # while an input event was sent doesn't get cached
+        self.screen_cache_generation = 0
+        # Digest of the last hierarchy read, to tell whether the screen has
+        # changed. Unlike the cache, survives input events.
+        self.last_screen_digest: Optional[bytes] = None
+
+    def invalidate_screen_cache(self):
+        self.screen_cache = None
+        self.screen_cache_generation += 1
+
+
+current_serial: ContextVar[Optional[str]] = ContextVar("current_serial", default=None)
+
+
+@contextmanager
+def target(serial: Optional[str]):
+    """Send adb calls made within the block to the device with `serial`"""
+    token = current_serial.set(serial)
+    try:
+        yield
+    finally:
+        current_serial.reset(token)
+
+
+class DeviceRegistry:
+    def __init__(self):
+        self.devices: dict[str, Device] = {}
+        self._states: dict[Optional[str], DeviceState] = {}
+
+    def __contains__(self, serial: str):
+        return serial in self.devices
+
+    def __len__(self):
+        return len(self.devices)
+
+    def update(self, devices: list[Device]):
+        """Replace the known devices with a fresh `adb devices` listing"""
+        previous = self.devices
+        self.devices = {device.serial: device for device in devices}
+        for serial in self.devices.keys() - previous.keys():
+            logger.info(f"Device attached: {serial} ({self.devices[serial].connection_mode})")
+        for serial in previous.keys() - self.devices.keys():
+            logger.info(f"Device detached: {serial}")
+            # A device that comes back may have been rebooted: start afresh,
+            # but keep the state of one that is still in use
+            state = self._states.get(serial)
+            if state is not None and state.scheduler.is_idle:
+                del self._states[serial]
+        for serial in self.devices.keys() & previous.keys():
+            if self.devices[serial].connection_mode != previous[serial].connection_mode:
+                logger.info(f"Device {serial} is now {self.devices[serial].connection_mode}")
+        self._adopt_untargeted_state()
+
+    @property
+    def online(self) -> list[Device]:
+        return [device for device in self.devices.values() if device.is_online]
+
+    @property
+    def default_serial(self) -> Optional[str]:
+        """Serial of the only online device, if there is exactly one"""
+        online = self.online
+        return online[0].serial if len(online) == 1 else None
+
+    def require(self, serial: str):
+        if serial not in self.devices:
+            raise UnknownDeviceError(serial)
+        return self.devices[serial]
+
+    def _adopt_untargeted_state(self):
+        """The state used before the registry knew the only device becomes
+        that device's, so the phone doesn't get a second scheduler and cache
+        once it is known (or targeted by its serial)"""
+        serial = self.default_serial
+        if serial is None or serial in self._states or None not in self._states:
+            return
+        state = self._states.pop(None)
+        state.serial = serial
+        self._states[serial] = state
+
+    def state(self, serial: Optional[str]) -> DeviceState:
+        self._adopt_untargeted_state()
+        if serial is None:
+            serial = self.default_serial
+        state = self._states.get(serial)
+        if state is None:
+            state = self._states[serial] = DeviceState(serial)
+        return state
+
+    def current(self) -> DeviceState:
+        """State of the device calls in this context go to"""
+        return self.state(current_serial.get())
+
+    def all_states(self):
+        return list(self._states.values())
+
+
+registry = DeviceRegistry()
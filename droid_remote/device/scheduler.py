@@ -0,0 +1,183 @@
+"""Serialises everything sent to the device.
+
+Every adb command runs under `DeviceScheduler.command()`, which waits for the
+device to be free. Waiters are served by priority class, then in arrival
+order. Multi-step flows (tap, wait for the next screen, tap again...) take a
+`ui_session()` lease instead: nothing else reaches the device until the flow
+is done, while the adb calls made within it pass straight through.
+
+There is one scheduler per device, see `registry`.
+
+Read-only calls can additionally be deduplicated with `single_flight()`:
+callers that ask for the same thing while it's already being fetched share
+that execution's result.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from functools import wraps
+import heapq
+from itertools import count
+import logging
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional, TypeVar
+from ..metrics import DEVICE_QUEUE_WAIT
+
+
+logger = logging.getLogger(__name__)
+T = TypeVar("T")
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    """Requests someone is waiting for"""
+    BACKGROUND = 1
+    """Keep-alives, health checks..."""
+
+
+current_priority: ContextVar[Priority] = ContextVar("current_priority", default=Priority.INTERACTIVE)
+# Lease held by the current task, if any, so nested calls don't wait for it
+current_lease: ContextVar[Optional[object]] = ContextVar("current_lease", default=None)
+
+
+@contextmanager
+def priority(value: Priority):
+    """Run device calls made within the block with the given priority"""
+    token = current_priority.set(value)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+class DeviceScheduler:
+    def __init__(self):
+        self._holder: Optional[object] = None
+        self._waiters: list[tuple[int, int, asyncio.Future, object]] = []
+        self._seq = count()
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    @property
+    def queue_length(self):
+        return sum(1 for *_, future, _ in self._waiters if not future.done())
+
+    @property
+    def is_idle(self):
+        return self._holder is None and self.queue_length == 0
+
+    def holds_lease(self):
+        lease = current_lease.get()
+        return lease is not None and lease is self._holder
+
+    async def _acquire(self, priority: Priority) -> object:
+        lease = object()
+        if self._holder is None and self.queue_length == 0:
+            self._holder = lease
+            return lease
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future, lease))
+        start = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Granted just before being cancelled: pass it on
+            if future.done() and not future.cancelled():
+                self._release(lease)
+            raise
+        finally:
+            DEVICE_QUEUE_WAIT.labels(priority=priority.name.lower()).observe(
+                time.perf_counter() - start
+            )
+        return lease
+
+    def _release(self, lease: object):
+        assert self._holder is lease
+        self._holder = None
+        while len(self._waiters) > 0:
+            *_, future, next_lease = heapq.heappop(self._waiters)
+            # Cancelled waiters are left in the heap and skipped here
+            if future.done():
+                continue
+            self._holder = next_lease
+            future.set_result(None)
+            return
+
+    @asynccontextmanager
+    async def _leased(self, priority: Optional[Priority]):
+        lease = await self._acquire(priority if priority is not None else current_priority.get())
+        try:
+            yield lease
+        finally:
+            self._release(lease)
+
+    @asynccontextmanager
+    async def _exclusive(self, priority: Optional[Priority]):
+        if self.holds_lease():
+            yield
+            return
+        async with self._leased(priority) as lease:
+            token = current_lease.set(lease)
+            try:
+                yield
+            finally:
+                current_lease.reset(token)
+
+    @asynccontextmanager
+    async def stream(self, priority: Optional[Priority] = None):
+        """Exclusive use of the device while an async generator streams a
+        command's output. Unlike `command`, the lease isn't made current: a
+        generator runs in its consumer's context, which would hold the lease
+        between items. The consumer must not make adb calls meanwhile, unless
+        it is in a UI session."""
+        if self.holds_lease():
+            yield
+            return
+        async with self._leased(priority):
+            yield
+
+    def command(self, priority: Optional[Priority] = None):
+        """Exclusive use of the device for a single command"""
+        return self._exclusive(priority)
+
+    def ui_session(self, priority: Optional[Priority] = None):
+        """Exclusive use of the device for a multi-step flow. Reentrant: adb
+        calls (and nested sessions) within the block don't wait."""
+        return self._exclusive(priority)
+
+    async def single_flight(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run `fn`, unless a call with the same key is already running, in
+        which case wait for and return its result instead"""
+        # Calls within a UI session must not wait for calls queued behind it
+        key = (key, current_lease.get() if self.holds_lease() else None)
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            logger.debug(f"Joining in-flight device call {key[0]}")
+        # One caller giving up must not cancel the call for the others
+        return await asyncio.shield(future)
+
+
+# For calls that don't go to a device (`adb devices`, `adb connect`, local
+# commands); every device has its own, see `registry.DeviceState`
+scheduler = DeviceScheduler()
+
+
+def single_flight(key: Optional[Hashable] = None):
+    """Decorator coalescing concurrent calls of a read-only coroutine function
+    with the same arguments"""
+
+    def decorator(fn: Callable[..., Awaitable[Any]]):
+        base_key = key if key is not None else f"{fn.__module__}.{fn.__qualname__}"
+
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            call_key = (base_key, args, tuple(sorted(kwargs.items())))
+            return await scheduler.single_flight(call_key, lambda: fn(*args, **kwargs))
+        return wrapper
+
+    return decorator
@@ -2,6 +2,7 @@ import json
 import asyncio
 from dataclasses import dataclass
 from ..subprocess_utils import run_command, CommandException
+from .scheduler import single_flight
 
 
 async def wake_lock():
@@ -18,6 +19,7 @@ async def set_screen_brightness(brightness: int):
     return await run_command("termux-brightness", str(brightness))
 
 
+@single_flight()
 async def query_battery_status():
     battery_status_json = await run_command("termux-battery-status")
     return json.loads(battery_status_json)
@@ -111,6 +113,7 @@ def get_idle_info_item(lines: list[str], name: str) -> bool:
     raise ValueError(f"Could not find {name} in idle info")
 
 
+@single_flight()
 async def query_idle_info():
     raw = await run_command("/system/bin/dumpsys", "deviceidle")
     lines = raw.splitlines()
@@ -0,0 +1,65 @@
+import hashlib
+import time
+from lxml import etree
+
+
+# `uiautomator dump /dev/tty` prints this after the closing root tag
+UI_DUMP_TRAILER = b"UI hierchary dumped to"
+
+
+class UiDumpParser:
+    """Incremental parser for `uiautomator dump /dev/tty` output.
+
+    Bytes are fed to lxml as they arrive and the trailer after the hierarchy
+    is cut off at the byte level, so the dump is never held as a whole in
+    memory as text. `feed` returns the elements whose start tag has been
+    parsed since the last call: their attributes are complete, their children
+    not necessarily yet. `digest` identifies the hierarchy's exact bytes,
+    `size` counts them and `parse_seconds` is the time spent in lxml.
+    """
+
+    def __init__(self):
+        self._parser = etree.XMLPullParser(events=("start",))
+        self._hash = hashlib.blake2b(digest_size=16)
+        self.size = 0
+        self.parse_seconds = 0.0
+        # Tail of the previous chunk that could be the start of the trailer
+        self._pending = b""
+        self.is_complete = False
+
+    def feed(self, chunk: bytes) -> list[etree._Element]:
+        if self.is_complete:
+            return []
+        data = self._pending + chunk if len(self._pending) > 0 else chunk
+        trailer_i = data.find(UI_DUMP_TRAILER)
+        if trailer_i != -1:
+            self._feed_xml(data[:trailer_i])
+            self._pending = b""
+            self.is_complete = True
+        else:
+            keep = min(len(data), len(UI_DUMP_TRAILER) - 1)
+            self._feed_xml(data[:len(data) - keep])
+            self._pending = data[len(data) - keep:]
+        return [element for _, element in self._parser.read_events()]
+
+    def close(self) -> etree._Element:
+        if len(self._pending) > 0:
+            # No trailer, e.g. when dumping to a file and pulling it
+            self._feed_xml(self._pending)
+            self._pending = b""
+        start = time.perf_counter()
+        try:
+            return self._parser.close()
+        finally:
+            self.parse_seconds += time.perf_counter() - start
+
+    def _feed_xml(self, xml: bytes):
+        self._hash.update(xml)
+        self.size += len(xml)
+        start = time.perf_counter()
+        self._parser.feed(xml)
+        self.parse_seconds += time.perf_counter() - start
+
+    @property
+    def digest(self) -> bytes:
+        return self._hash.digest()
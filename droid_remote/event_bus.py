@@ -1,38 +1,172 @@
 import asyncio
+from functools import cached_property
 import logging
 from asyncio import Future
-from typing import Any
+from typing import Any, Optional
+
+
+DEFAULT_CAPACITY = 1024
 
 
 class EventBus:
-    """Async event bus
+    """Async event bus backed by a ring buffer of the last `capacity` events
+
+    Every subscriber reads the buffer at its own pace through its own cursor,
+    so emitting costs the same no matter how many subscribers there are, and
+    no events are missed while a subscriber is busy. A subscriber that falls
+    more than `capacity` events behind skips the oldest ones and counts them
+    in `dropped`.
 
     Usage:
     ```
     event_bus = EventBus()
     async for event in event_bus:
       print(event)
+    # Or, starting with the last 100 events, and closing the subscription
+    # when done:
+    with event_bus.subscribe(replay=100) as subscription:
+      async for event in subscription:
+        print(event)
     ```
+
+    Subscribers also say which log records they want (`log_level`). Log
+    records at or above the lowest level any open subscription wants are
+    formatted on the logging thread, see `EventBusLogHandler`.
     """
 
-    def __init__(self) -> None:
-        self._iter_futures: set[Future] = set()
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        self.capacity = capacity
+        self._buffer: list[Any] = [None] * capacity
+        self._next_seq = 0
+        # Shared by all waiting subscribers, replaced after every emit
+        self._waiter: Optional[Future] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscriptions: set["EventBusSubscription"] = set()
+        self.log_level: Optional[int] = None
+        """Lowest level of log records any open subscription wants, None
+        without subscriptions. Read from the logging thread."""
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """Have `emit_threadsafe` hand events over to `loop`"""
+        self._loop = loop
 
     def emit(self, event: Any):
-        for future in self._iter_futures:
-            try:
-                future.set_result(event)
-            except asyncio.InvalidStateError:
-                pass
-        self._iter_futures.clear()
+        self._buffer[self._next_seq % self.capacity] = event
+        self._next_seq += 1
+        waiter = self._waiter
+        if waiter is not None:
+            self._waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def emit_threadsafe(self, event: Any):
+        """`emit` from any thread. Events are emitted directly as long as no
+        event loop is bound, before the server has started."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            self.emit(event)
+            return
+        try:
+            loop.call_soon_threadsafe(self.emit, event)
+        except RuntimeError:
+            # Closed in the meantime
+            self.emit(event)
+
+    def subscribe(self, replay: int = 0, log_level: int = logging.NOTSET) -> "EventBusSubscription":
+        """Subscribe to new events, starting with up to `replay` past ones.
+        `log_level` is the lowest level of log records the subscriber wants
+        until the subscription is closed."""
+        replay = min(replay, self.capacity, self._next_seq)
+        subscription = EventBusSubscription(self, self._next_seq - replay, log_level)
+        self._subscriptions.add(subscription)
+        self._update_log_level()
+        return subscription
+
+    def _unsubscribe(self, subscription: "EventBusSubscription"):
+        self._subscriptions.discard(subscription)
+        self._update_log_level()
+
+    def _update_log_level(self):
+        self.log_level = min((s.log_level for s in self._subscriptions), default=None)
+
+    def __aiter__(self):
+        return self.subscribe()
+
+    async def _wait(self, seq: int):
+        """Wait until the event with sequence number `seq` has been emitted"""
+        while self._next_seq <= seq:
+            if self._waiter is None:
+                self._waiter = asyncio.get_running_loop().create_future()
+            await asyncio.shield(self._waiter)
+
+
+class EventBusSubscription:
+    def __init__(self, event_bus: EventBus, cursor: int, log_level: int = logging.NOTSET) -> None:
+        self._event_bus = event_bus
+        self.cursor = cursor
+        self.log_level = log_level
+        self.dropped = 0
+        """Events overwritten before this subscriber got to them"""
+
+    def close(self):
+        self._event_bus._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    @property
+    def backlog(self):
+        return self._event_bus._next_seq - self.cursor
+
+    async def wait(self):
+        """Wait until there is at least one event to read"""
+        await self._event_bus._wait(self.cursor)
+
+    def take_ready(self, limit: Optional[int] = None) -> list[Any]:
+        """Events that can be read without waiting, oldest first"""
+        bus = self._event_bus
+        self._skip_overwritten()
+        end = bus._next_seq if limit is None else min(bus._next_seq, self.cursor + limit)
+        events = [bus._buffer[seq % bus.capacity] for seq in range(self.cursor, end)]
+        self.cursor = end
+        return events
+
+    def _skip_overwritten(self):
+        oldest = self._event_bus._next_seq - self._event_bus.capacity
+        if self.cursor < oldest:
+            self.dropped += oldest - self.cursor
+            self.cursor = oldest
 
     def __aiter__(self):
         return self
 
     async def __anext__(self):
-        future = Future()
-        self._iter_futures.add(future)
-        return await future
+        await self._event_bus._wait(self.cursor)
+        self._skip_overwritten()
+        event = self._event_bus._buffer[self.cursor % self._event_bus.capacity]
+        self.cursor += 1
+        return event
+
+
+class LogEvent:
+    """A log record on the event bus, formatted at most once for all
+    subscribers. Records a subscriber wants are formatted on the logging
+    thread; others only if read later, e.g. replayed to a new subscriber."""
+
+    def __init__(self, record: logging.LogRecord, handler: logging.Handler) -> None:
+        self.record = record
+        self.level = record.levelno
+        self._handler = handler
+
+    @cached_property
+    def text(self) -> str:
+        return self._handler.format(self.record)
+
+    def __str__(self):
+        return self.text
 
 
 class EventBusLogHandler(logging.Handler):
@@ -43,4 +177,9 @@ class EventBusLogHandler(logging.Handler):
         self.event_bus = event_bus
 
     def emit(self, record):
-        self.event_bus.emit(self.format(record))
+        event = LogEvent(record, self)
+        log_level = self.event_bus.log_level
+        if log_level is not None and record.levelno >= log_level:
+            # Here rather than on the event loop
+            event.text
+        self.event_bus.emit_threadsafe(event)
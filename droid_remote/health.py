@@ -1,8 +1,22 @@
 import logging
-import urllib.request
+import random
+import time
+from typing import Optional
+import aiohttp
+from .metrics import HEALTH_PROBE_DURATION
 from .pid_management import PidFilePaths, read_pid, check_if_process_running
 
 
+# Liveness only: a server whose device or tunnel is down must not be restarted
+HEALTH_CHECK_PATH = "/healthz"
+READINESS_CHECK_PATH = "/healthz/ready"
+HEALTH_PROBE_TIMEOUT = 5
+# Probe interval bounds: quick re-probes to confirm a failure, relaxed ones
+# while the server stays healthy
+HEALTH_PROBE_MIN_INTERVAL = 1
+HEALTH_PROBE_MAX_INTERVAL = 15
+HEALTH_PROBE_BACKOFF_FACTOR = 1.5
+HEALTH_PROBE_JITTER = 0.1
 logger = logging.getLogger(__name__)
 
 
@@ -10,37 +24,129 @@ class DaemonHealthCheckError(Exception):
     pass
 
 
-def check_daemon_health_http(base_url: str):
-    try:
-        url = f"{base_url}/metrics"
-        with urllib.request.urlopen(base_url + "/metrics", timeout=1) as resp:
-            status_range = resp.status // 100
-            if status_range != 2:
-                logger.warning(f"Daemon health check failed: HTTP GET to '{url}' returned status code {resp.status} ({status_range=})")
-                raise DaemonHealthCheckError(
-                    f"/metrics HTTP endpoint returned status code {resp.status}"
-                )
-            return True
-    except urllib.error.URLError as e:
-        if isinstance(e.reason, ConnectionRefusedError):
-            logger.debug("Daemon health check failed: Connection refused")
-            return False
-        logger.warning(f"Unexpected URLError while checking daemon health: {e}")
-        raise DaemonHealthCheckError(e)
-    except Exception as e:
-        logger.warning(f"Unexpected error while checking daemon health: {e.__class__.__name__}: {e}")
-        raise DaemonHealthCheckError(e)
-
-
-def check_if_daemon_healthy(pid_file_paths: PidFilePaths, base_url: str):
+class HealthChecker:
+    """Probes the server over HTTP through a single keep-alive session, so
+    repeated probes of e.g. the public ngrok URL reuse the DNS lookup, TCP
+    connection and TLS session"""
+
+    def __init__(self, base_url: str, http_basic_password: Optional[str] = None):
+        self.base_url = base_url
+        # Only needed for the details of the readiness report
+        self.auth = None if http_basic_password is None else aiohttp.BasicAuth("admin", http_basic_password)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.last_latency: Optional[float] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=1, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=HEALTH_PROBE_TIMEOUT),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def probe(self):
+        """True if the server answers with a 2xx status, False if nothing is
+        listening. Raises DaemonHealthCheckError for anything else."""
+        url = f"{self.base_url}{HEALTH_CHECK_PATH}"
+        start = time.perf_counter()
+        outcome = "healthy"
+        try:
+            async with self._get_session().get(url) as resp:
+                # Read the body so the connection can be reused
+                await resp.read()
+                status_range = resp.status // 100
+                if status_range != 2:
+                    outcome = "bad_status"
+                    logger.warning(f"Daemon health check failed: HTTP GET to '{url}' returned status code {resp.status} ({status_range=})")
+                    raise DaemonHealthCheckError(
+                        f"{HEALTH_CHECK_PATH} HTTP endpoint returned status code {resp.status}"
+                    )
+                return True
+        except aiohttp.ClientConnectorError as e:
+            if isinstance(e.os_error, ConnectionRefusedError):
+                outcome = "refused"
+                logger.debug("Daemon health check failed: Connection refused")
+                return False
+            outcome = "error"
+            logger.warning(f"Unexpected connection error while checking daemon health: {e}")
+            raise DaemonHealthCheckError(e)
+        except TimeoutError as e:
+            outcome = "timeout"
+            logger.warning(f"Daemon health check timed out after {HEALTH_PROBE_TIMEOUT}s")
+            raise DaemonHealthCheckError(e)
+        except DaemonHealthCheckError:
+            raise
+        except Exception as e:
+            outcome = "error"
+            logger.warning(f"Unexpected error while checking daemon health: {e.__class__.__name__}: {e}")
+            raise DaemonHealthCheckError(e)
+        finally:
+            self.last_latency = time.perf_counter() - start
+            HEALTH_PROBE_DURATION.labels(outcome=outcome).observe(self.last_latency)
+
+    async def readiness(self) -> dict:
+        """The server's readiness report, see `readiness.ReadinessMonitor`"""
+        url = f"{self.base_url}{READINESS_CHECK_PATH}"
+        try:
+            async with self._get_session().get(url, auth=self.auth) as resp:
+                return await resp.json()
+        except Exception as e:
+            raise DaemonHealthCheckError(e)
+
+
+class ProbeInterval:
+    """Adaptive, jittered delay between probes: backs off while probes keep
+    succeeding and drops to the minimum after a failure, so that a failure is
+    confirmed quickly rather than acted upon right away"""
+
+    def __init__(
+        self,
+        min_interval: float = HEALTH_PROBE_MIN_INTERVAL,
+        max_interval: float = HEALTH_PROBE_MAX_INTERVAL,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+
+    def next(self, is_healthy: bool):
+        if is_healthy:
+            self.interval = min(self.interval * HEALTH_PROBE_BACKOFF_FACTOR, self.max_interval)
+        else:
+            self.interval = self.min_interval
+        jitter = random.uniform(-HEALTH_PROBE_JITTER, HEALTH_PROBE_JITTER)
+        return self.interval * (1 + jitter)
+
+
+async def check_daemon_health_http(base_url: str):
+    async with HealthChecker(base_url) as checker:
+        return await checker.probe()
+
+
+async def get_daemon_readiness(base_url: str, http_basic_password: Optional[str] = None):
+    async with HealthChecker(base_url, http_basic_password) as checker:
+        return await checker.readiness()
+
+
+async def check_if_daemon_healthy(pid_file_paths: PidFilePaths, checker: HealthChecker):
     pid = read_pid(pid_file_paths.daemon_pid)
     process_healthy = check_if_process_running(pid)
-    http_healthy = check_daemon_health_http(base_url)
+    http_healthy = await checker.probe()
     return process_healthy and http_healthy
 
 
-def safe_check_if_daemon_healthy(pid_file_paths: PidFilePaths, base_url: str):
+async def safe_check_if_daemon_healthy(pid_file_paths: PidFilePaths, checker: HealthChecker):
     try:
-        return check_if_daemon_healthy(pid_file_paths, base_url)
+        return await check_if_daemon_healthy(pid_file_paths, checker)
     except DaemonHealthCheckError:
         return False
@@ -0,0 +1,169 @@
+"""Background jobs for long-running device flows.
+
+Starting a job returns right away; the flow runs in its own task and its
+outcome is kept in a `JobStore` for `JOB_RESULT_TTL` seconds after it
+finishes. Code running inside a job can call `report_progress`, which
+records the message on the job and publishes it on the event bus, i.e. the
+dashboard's `/ws` log stream.
+"""
+
+import asyncio
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import logging
+from secrets import token_hex
+import time
+from typing import Any, Awaitable, Callable, Optional
+from .event_bus import EventBus
+
+
+MAX_JOBS = 100
+JOB_RESULT_TTL = 15 * 60
+logger = logging.getLogger(__name__)
+
+
+class JobStoreFullError(Exception):
+    pass
+
+
+class JobFailedError(Exception):
+    """Raised by a flow to fail its job with a structured `result`, for
+    outcomes that aren't unexpected errors"""
+
+    def __init__(self, message: str, result: dict[str, Any]):
+        super().__init__(message)
+        self.result = result
+
+
+@dataclass
+class JobProgress:
+    at: float
+    """Unix time"""
+    message: str
+
+
+@dataclass
+class Job:
+    id: str
+    name: str
+    created_at: float
+    state: str = "running"
+    """"running", "succeeded" or "failed" """
+    finished_at: Optional[float] = None
+    result: Any = None
+    """What the flow returned: a dict as is, anything else as a string"""
+    error: Optional[str] = None
+    progress: list[JobProgress] = field(default_factory=list)
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    @property
+    def is_finished(self):
+        return self.state != "running"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "state": self.state,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+            "progress": [{"at": p.at, "message": p.message} for p in self.progress],
+        }
+
+
+@dataclass(frozen=True)
+class JobEvent:
+    """Job progress on the event bus"""
+    job_id: str
+    job_name: str
+    message: str
+    level: int = logging.INFO
+
+    @property
+    def text(self):
+        return f"[job {self.job_name} {self.job_id}] {self.message}"
+
+    def __str__(self):
+        return self.text
+
+
+current_job: ContextVar[Optional[Job]] = ContextVar("current_job", default=None)
+current_job_event_bus: ContextVar[Optional[EventBus]] = ContextVar("current_job_event_bus", default=None)
+
+
+def report_progress(message: str):
+    """Record progress of the job the caller runs in, if any"""
+    job = current_job.get()
+    if job is None:
+        return
+    job.progress.append(JobProgress(time.time(), message))
+    event_bus = current_job_event_bus.get()
+    if event_bus is not None:
+        event_bus.emit(JobEvent(job.id, job.name, message))
+
+
+class JobStore:
+    def __init__(
+        self,
+        event_bus: Optional[EventBus] = None,
+        max_jobs: int = MAX_JOBS,
+        ttl: float = JOB_RESULT_TTL,
+    ):
+        self.event_bus = event_bus
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._evict()
+        return self._jobs.get(job_id)
+
+    def _evict(self, make_room: bool = False):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > self.ttl:
+                del self._jobs[job_id]
+        if not make_room:
+            return
+        # Oldest finished jobs go first, running ones are never dropped
+        finished = [job_id for job_id, job in self._jobs.items() if job.is_finished]
+        while len(self._jobs) >= self.max_jobs and len(finished) > 0:
+            del self._jobs[finished.pop(0)]
+
+    def start(self, name: str, fn: Callable[[], Awaitable[Any]]) -> Job:
+        self._evict(make_room=True)
+        if len(self._jobs) >= self.max_jobs:
+            raise JobStoreFullError(f"{len(self._jobs)} jobs are still running")
+        job = Job(token_hex(8), name, time.time())
+        self._jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, fn))
+        return job
+
+    async def _run(self, job: Job, fn: Callable[[], Awaitable[Any]]):
+        current_job.set(job)
+        current_job_event_bus.set(self.event_bus)
+        report_progress("started")
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            job.state = "failed"
+            job.error = "cancelled"
+            raise
+        except JobFailedError as e:
+            logger.info(f"Job {job.name} ({job.id}) failed: {e}")
+            job.state = "failed"
+            job.error = str(e)
+            job.result = e.result
+        except Exception as e:
+            logger.warning(f"Job {job.name} ({job.id}) failed: {e.__class__.__name__}: {e}", exc_info=True)
+            job.state = "failed"
+            job.error = f"{e.__class__.__name__}: {e}"
+        else:
+            job.state = "succeeded"
+            job.result = result if result is None or isinstance(result, dict) else str(result)
+        finally:
+            job.finished_at = time.time()
+        report_progress(job.state)
@@ -1,16 +1,119 @@
+import atexit
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+import os
+from queue import Full, Queue
 import sys
 from pathlib import Path
 from typing import Optional
 from .event_bus import EventBus, EventBusLogHandler
+from .metrics import LOG_RECORDS_DROPPED
+
+
+LOG_QUEUE_SIZE = 10_000
+
+listener: Optional[QueueListener] = None
+
+
+class InProcessQueueHandler(QueueHandler):
+    """Enqueues records as they are. The default `prepare` formats them on the
+    logging thread so they can be pickled, which is exactly the work this
+    handler is meant to move off the event loop.
+
+    The queue is bounded: records that don't fit because the logging thread
+    can't keep up are dropped and counted in `dropped`, and the next record
+    that fits is preceded by a warning saying how many were lost."""
+
+    def __init__(self, queue: Queue) -> None:
+        super().__init__(queue)
+        self.dropped = 0
+        self._unreported = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        # Handler.handle holds the handler lock, the counters need no other
+        try:
+            if self._unreported > 0:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    "name": __name__,
+                    "levelno": logging.WARNING,
+                    "levelname": logging.getLevelName(logging.WARNING),
+                    "msg": "Log queue full, dropped %d record(s)",
+                    "args": (self._unreported,),
+                }))
+                self._unreported = 0
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+            self._unreported += 1
+            LOG_RECORDS_DROPPED.inc()
+
+
+class LogQueueListener(QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room rather than fail on a full queue
+        self.queue.put(self._sentinel)
+
+
+class DaemonStdoutHandler(logging.StreamHandler):
+    """stdout of a daemon started by `start_daemon`, which only reads it up
+    to the first INFO record and then leaves the pipe, and the one of stderr,
+    unread. Once they filled up, writing to them would block the logging
+    thread, and stderr writes any thread. So after that record, stdout is
+    pointed at /dev/null and stderr at `stderr_path`, to keep tracebacks of
+    a crash, faulthandler output and what C extensions print."""
+
+    def __init__(self, stderr_path: Path) -> None:
+        super().__init__(sys.stdout)
+        self.stderr_path = stderr_path
+        self.detached = False
+
+    def emit(self, record):
+        if self.detached:
+            return
+        super().emit(record)
+        if record.levelno == logging.INFO:
+            self.detach()
+
+    def detach(self):
+        self.detached = True
+        self.flush()
+        sys.stderr.flush()
+        for fileno, path, flags in [
+            (sys.stdout.fileno(), os.devnull, os.O_WRONLY),
+            (sys.stderr.fileno(), self.stderr_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND),
+        ]:
+            fd = os.open(path, flags, 0o644)
+            try:
+                os.dup2(fd, fileno)
+            finally:
+                os.close(fd)
+
+
+def stderr_log_path(log_file_path: Path):
+    """Where a daemon's stderr goes, next to its (rotated) log file"""
+    return log_file_path.with_name(f"{log_file_path.stem}.stderr.log")
+
+
+def stop_logging_listener():
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
 
 
 def setup_logging(
     log_file_path: Path,
     event_bus: Optional[EventBus] = None,
-    log_file_level: int = logging.DEBUG
+    log_file_level: int = logging.DEBUG,
+    daemonized: bool = False,
 ):
+    """Log records are only enqueued on the calling thread; a background
+    thread filters them per handler level, formats and writes them."""
+    global listener
+    stop_logging_listener()
     file_handler = TimedRotatingFileHandler(
         log_file_path,
         when="midnight",
@@ -20,10 +123,22 @@ def setup_logging(
     file_handler.setLevel(log_file_level)
     handlers: list[logging.Handler] = [
         file_handler,
-        logging.StreamHandler(sys.stdout),
+        DaemonStdoutHandler(stderr_log_path(log_file_path)) if daemonized else logging.StreamHandler(sys.stdout),
     ]
     if event_bus is not None:
         handlers.append(EventBusLogHandler(event_bus))
-    logging.basicConfig(level=logging.DEBUG, handlers=handlers, force=True)
+    formatter = logging.Formatter(logging.BASIC_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue: Queue = Queue(LOG_QUEUE_SIZE)
+    queue_handler = InProcessQueueHandler(log_queue)
+    # Records no handler wants aren't even enqueued
+    queue_handler.setLevel(min(handler.level for handler in handlers))
+    listener = LogQueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    logging.basicConfig(level=logging.DEBUG, handlers=[queue_handler], force=True)
     logging.getLogger("aiohttp.access").disabled = True
     logging.getLogger("asyncio").disabled = True
+
+
+atexit.register(stop_logging_listener)
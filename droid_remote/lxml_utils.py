@@ -1,9 +1,23 @@
+from functools import lru_cache
 from lxml import etree
 from typing import Optional
 
 
-def elements_xpath(root: etree._Element, xpath: str) -> list[etree._Element]:
-    xpath_res = root.xpath(xpath)
+XPATH_CACHE_SIZE = 128
+
+
+@lru_cache(maxsize=XPATH_CACHE_SIZE)
+def compiled_xpath(xpath: str) -> etree.XPath:
+    return etree.XPath(xpath)
+
+
+def elements_xpath(
+    root: etree._Element, xpath: str, **variables: str
+) -> list[etree._Element]:
+    """Evaluate a (cached, compiled) xpath expression. Pass values through
+    `variables` (`$name` in the expression) instead of interpolating them, so
+    they never need quoting."""
+    xpath_res = compiled_xpath(xpath)(root, **variables)
     if not isinstance(xpath_res, list):
         raise Exception(f"Expected xpath result to be a list, got {str(xpath_res)}")
     return [e for e in xpath_res if isinstance(e, etree._Element)]
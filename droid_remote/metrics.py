@@ -0,0 +1,150 @@
+from contextlib import contextmanager
+from functools import wraps
+import inspect
+import time
+from typing import Callable, TypeVar
+from prometheus_client import Counter, Gauge, Histogram
+
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PARSE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5)
+SIZE_BUCKETS = (4_096, 16_384, 32_768, 65_536, 131_072, 262_144, 524_288, 1_048_576)
+
+ADB_COMMAND_DURATION = Histogram(
+    "droid_remote_adb_command_duration_seconds",
+    "Duration of adb commands by adb subcommand and, for shell, device command",
+    ["subcommand", "command"],
+    buckets=LATENCY_BUCKETS,
+)
+UI_DUMP_DURATION = Histogram(
+    "droid_remote_ui_dump_duration_seconds",
+    "Duration of uiautomator screen dumps, transfer and parsing included",
+    buckets=LATENCY_BUCKETS,
+)
+UI_DUMP_SIZE = Histogram(
+    "droid_remote_ui_dump_size_bytes",
+    "Size of uiautomator screen dumps",
+    buckets=SIZE_BUCKETS,
+)
+UI_DUMP_PARSE_DURATION = Histogram(
+    "droid_remote_ui_dump_parse_duration_seconds",
+    "Time spent parsing uiautomator screen dump XML",
+    buckets=PARSE_BUCKETS,
+)
+ITSME_PARSER_DURATION = Histogram(
+    "droid_remote_itsme_parser_duration_seconds",
+    "Time spent classifying and parsing itsme screens, by parser",
+    ["parser"],
+    buckets=PARSE_BUCKETS,
+)
+ITSME_CONFIRM_STEP_DURATION = Histogram(
+    "droid_remote_itsme_confirm_step_duration_seconds",
+    "Duration of confirm_app_action steps, waiting for the next screen included",
+    ["step"],
+    buckets=LATENCY_BUCKETS,
+)
+ITSME_CONFIRM_DURATION = Histogram(
+    "droid_remote_itsme_confirm_duration_seconds",
+    "End-to-end duration of confirm_app_action",
+    ["outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+TASKER_TASK_DURATION = Histogram(
+    "droid_remote_tasker_task_duration_seconds",
+    "Round-trip time of Tasker tasks, from broadcast to callback",
+    ["task_name", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+
+TASKER_CALLBACKS_PENDING = Gauge(
+    "droid_remote_tasker_callbacks_pending",
+    "Dispatched Tasker tasks waiting for their callback",
+)
+TASKER_DISPATCHES_WAITING = Gauge(
+    "droid_remote_tasker_dispatches_waiting",
+    "Tasker dispatches waiting for room in the callback registry",
+)
+TASKER_CALLBACKS = Counter(
+    "droid_remote_tasker_callbacks",
+    "Tasker callbacks received, by how they matched a dispatched task",
+    ["outcome"],
+)
+TASKER_CALLBACKS_EXPIRED = Counter(
+    "droid_remote_tasker_callbacks_expired",
+    "Tasker tasks whose callback didn't arrive before their deadline",
+)
+TASKER_DISPATCHES_SHED = Counter(
+    "droid_remote_tasker_dispatches_shed",
+    "Tasker dispatches rejected because the callback registry stayed full",
+)
+HEALTH_PROBE_DURATION = Histogram(
+    "droid_remote_health_probe_duration_seconds",
+    "Duration of the watchdog's HTTP health probes of the server, by outcome",
+    ["outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+DEVICE_QUEUE_WAIT = Histogram(
+    "droid_remote_device_queue_wait_seconds",
+    "Time device commands waited for the device scheduler, by priority",
+    ["priority"],
+    buckets=LATENCY_BUCKETS,
+)
+WATCHDOG_RESTARTS = Counter(
+    "droid_remote_watchdog_restarts",
+    "Server restarts by the watchdog, by reason",
+    ["reason"],
+)
+EVENT_LOOP_LAG = Gauge(
+    "droid_remote_event_loop_lag_seconds",
+    "How late the server's event loop last ran a timer callback",
+)
+COORDINATOR_PROXY_DURATION = Histogram(
+    "droid_remote_coordinator_proxy_duration_seconds",
+    "Duration of requests the cluster coordinator forwarded to a node, by node and outcome",
+    ["node", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+LOG_RECORDS_DROPPED = Counter(
+    "droid_remote_log_records_dropped",
+    "Log records dropped because the logging thread couldn't keep up",
+)
+COORDINATOR_FAILOVERS = Counter(
+    "droid_remote_coordinator_failovers",
+    "Times the cluster coordinator moved a device to another node",
+    ["serial"],
+)
+
+
+@contextmanager
+def measure(histogram: Histogram, **labels: str):
+    """Observe the duration of the `with` block"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric = histogram.labels(**labels) if len(labels) > 0 else histogram
+        metric.observe(time.perf_counter() - start)
+
+
+F = TypeVar("F", bound=Callable)
+
+
+def timed(histogram: Histogram, **labels: str) -> Callable[[F], F]:
+    """Decorator observing the duration of each call. Unlike
+    `Histogram.time()`, awaits coroutine functions before stopping the clock."""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with measure(histogram, **labels):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with measure(histogram, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorator
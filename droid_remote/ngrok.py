@@ -17,6 +17,8 @@ NGROK_MULTIPLE_AGENTS_ERROR = "limited to 1 simultaneous ngrok agent session"
 NGROK_TUNNEL_START_MESSAGE = "started tunnel"
 NGROK_TUNNEL_START_TIMEOUT = 10
 logger = logging.getLogger(__name__)
+# "stopped", "starting", "up" or "exited", for readiness checks
+tunnel_state = "stopped"
 
 
 @dataclass_json
@@ -42,12 +44,22 @@ async def wait_until_ngrok_tunnel_starts(proc: subprocess.Process):
             return
 
 
-async def run_ngrok(domain: str, child_pgids_file_path: Path):
+async def run_ngrok(domain: str, child_pgids_file_path: Path, port: int = 8080):
+    global tunnel_state
+    tunnel_state = "starting"
+    try:
+        return await _run_ngrok(domain, child_pgids_file_path, port)
+    finally:
+        tunnel_state = "exited"
+
+
+async def _run_ngrok(domain: str, child_pgids_file_path: Path, port: int):
+    global tunnel_state
     logger.info(f"Starting ngrok for domain {domain}...")
     ngrok_command = [
         "http",
         f"--domain={domain}",
-        "8080",
+        str(port),
         "--log=stdout",
         "--log-format=json",
     ]
@@ -83,6 +95,7 @@ async def run_ngrok(domain: str, child_pgids_file_path: Path):
         )
         raise
     logger.info("ngrok started a tunnel.")
+    tunnel_state = "up"
     try:
         return_code = await ngrok_process.wait()
     except asyncio.CancelledError:
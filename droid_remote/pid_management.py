@@ -1,3 +1,4 @@
+import asyncio
 from dataclasses import dataclass
 import os
 import sys
@@ -58,6 +59,33 @@ def check_if_process_running(
     return True
 
 
+# Only used where pidfds aren't available (Linux < 5.3, seccomp filters)
+PROCESS_EXIT_POLL_INTERVAL = 0.5
+
+
+async def wait_for_process_exit(pid: Optional[int]):
+    """Return as soon as process `pid` has exited. Uses a pidfd, which becomes
+    readable when the process exits, falling back to polling."""
+    if pid is None:
+        return
+    try:
+        pidfd = os.pidfd_open(pid)
+    except ProcessLookupError:
+        return
+    except (AttributeError, OSError):
+        while check_if_process_running(pid, True):
+            await asyncio.sleep(PROCESS_EXIT_POLL_INTERVAL)
+        return
+    loop = asyncio.get_running_loop()
+    exited = loop.create_future()
+    loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+
+
 def check_if_process_group_running(
     pgid: int,
     treat_kill_permission_error_as_not_running: bool = False,
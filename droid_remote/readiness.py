@@ -0,0 +1,150 @@
+"""Readiness checks behind `/healthz/ready`.
+
+Checks that need I/O run on a background schedule; requests are answered from
+their cached results, which carry the time they were taken. Results older
+than `READINESS_STALE_AFTER` count as failed.
+"""
+
+import asyncio
+from dataclasses import dataclass
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+from . import ngrok
+from .device import adb
+from .device.scheduler import Priority, priority
+from .metrics import EVENT_LOOP_LAG
+from .tasker import CallbackRegistry
+from .tasker.channel import channel
+from .tasker.server import HTTP_PORT as TASKER_HTTP_PORT
+
+
+READINESS_CHECK_INTERVAL = 15
+READINESS_CHECK_TIMEOUT = 5
+READINESS_STALE_AFTER = 3 * READINESS_CHECK_INTERVAL
+LOOP_LAG_INTERVAL = 0.5
+LOOP_LAG_MAX = 1.0
+logger = logging.getLogger(__name__)
+
+# Raises when the check fails, otherwise returns a short description
+Check = Callable[[], Awaitable[str]]
+
+
+@dataclass
+class CheckResult:
+    ok: bool
+    detail: str
+    checked_at: float
+    """Unix time"""
+    duration: float
+
+    @property
+    def age(self):
+        return time.time() - self.checked_at
+
+    def to_report(self):
+        stale = self.age > READINESS_STALE_AFTER
+        return {
+            "ok": self.ok and not stale,
+            "detail": f"stale: {self.detail}" if stale else self.detail,
+            "checked_at": self.checked_at,
+            "age": round(self.age, 3),
+            "duration": round(self.duration, 3),
+        }
+
+
+async def check_adb():
+    # Behind anything a user is waiting for
+    with priority(Priority.BACKGROUND):
+        devices = await adb.list_devices()
+    online = [device.serial for device in devices if device.is_online]
+    if len(online) == 0:
+        raise Exception("no device online")
+    return f"{len(online)} device(s) online: {', '.join(online)}"
+
+
+def create_tasker_check(callback_registry: CallbackRegistry, port: int = TASKER_HTTP_PORT) -> Check:
+    async def check_tasker():
+        _, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.close()
+        channel_state = "connected" if channel.is_connected else "not connected"
+        return f"callback server listening, channel {channel_state}, {len(callback_registry)} callback(s) pending"
+
+    return check_tasker
+
+
+async def check_ngrok():
+    if ngrok.tunnel_state != "up":
+        raise Exception(f"tunnel {ngrok.tunnel_state}")
+    return "tunnel up"
+
+
+class ReadinessMonitor:
+    def __init__(self, checks: dict[str, Check]):
+        self.checks = checks
+        self.results: dict[str, CheckResult] = {}
+        self.loop_lag = 0.0
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self):
+        self._tasks = [
+            asyncio.create_task(self._check_forever()),
+            asyncio.create_task(self._measure_loop_lag_forever()),
+        ]
+
+    async def _run_check(self, name: str, check: Check):
+        checked_at = time.time()
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(READINESS_CHECK_TIMEOUT):
+                detail = await check()
+            ok = True
+        except Exception as e:
+            detail = f"{e.__class__.__name__}: {e}"
+            ok = False
+        result = CheckResult(ok, detail, checked_at, time.perf_counter() - start)
+        previous = self.results.get(name)
+        if previous is not None and previous.ok != ok:
+            log = logger.info if ok else logger.warning
+            log(f"Readiness check '{name}' {'recovered' if ok else 'failed'}: {detail}")
+        self.results[name] = result
+
+    async def _check_forever(self):
+        while True:
+            await asyncio.gather(*(
+                self._run_check(name, check) for name, check in self.checks.items()
+            ))
+            await asyncio.sleep(READINESS_CHECK_INTERVAL)
+
+    async def _measure_loop_lag_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.loop_lag = max(0.0, loop.time() - expected)
+            EVENT_LOOP_LAG.set(self.loop_lag)
+
+    def report(self) -> tuple[bool, dict]:
+        checks = {name: result.to_report() for name, result in self.results.items()}
+        for name in self.checks:
+            if name not in checks:
+                checks[name] = {"ok": False, "detail": "not checked yet"}
+        checks["event_loop"] = {
+            "ok": self.loop_lag <= LOOP_LAG_MAX,
+            "detail": f"lag {self.loop_lag * 1000:.1f}ms",
+        }
+        return all(check["ok"] for check in checks.values()), checks
+
+
+def create_readiness_monitor(
+    callback_registry: CallbackRegistry,
+    ngrok_domain: Optional[str],
+    tasker_port: int = TASKER_HTTP_PORT,
+):
+    checks: dict[str, Check] = {
+        "adb": check_adb,
+        "tasker": create_tasker_check(callback_registry, tasker_port),
+    }
+    if ngrok_domain is not None:
+        checks["ngrok"] = check_ngrok
+    return ReadinessMonitor(checks)
@@ -11,11 +11,14 @@ from dotenv import load_dotenv
 from .event_bus import EventBus
 from .ngrok import run_ngrok
 from .webapp import start_webapp
-from .tasker import start_tasker_server_for_futures
+from .readiness import create_readiness_monitor
+from .cluster import send_heartbeats_forever
+from .tasker import CallbackRegistry, start_tasker_server_for_futures
 from .config import populate_server_arg_parser, safe_generate, generate_server_config_from_args, ServerConfig
 from .pid_management import clear_pid_files, ensure_no_existing_process_or_exit, init_pid_files
 from .env_util import fix_env_login_variables
-from .device import high_level
+from .device import adb, high_level
+from .device.adb_backend import AdbBackendKind
 from .dataclasses_json_conf import configure_dataclasses_json
 from .log_setup import setup_logging
 from .signal_handling import add_signal_handlers
@@ -25,19 +28,26 @@ logger = logging.getLogger(__name__)
 
 
 async def run_server(event_bus: EventBus, config: ServerConfig):
+    event_bus.bind_loop(asyncio.get_running_loop())
     logger.info("Starting droid remote server...")
     fix_env_login_variables()
+    adb.set_backend(AdbBackendKind(config.adb_backend), config.adb_replay_serials)
     running_tasks: list[Task] = []
+    running_tasks.append(asyncio.create_task(adb.track_devices_forever()))
     add_signal_handlers(running_tasks)
     ngrok_domain = config.ngrok_domain
     if ngrok_domain is not None:
         ngrok_task = asyncio.create_task(
-            run_ngrok(ngrok_domain, config.child_pgids_file_path)
+            run_ngrok(ngrok_domain, config.child_pgids_file_path, config.http_port)
         )
         running_tasks.append(ngrok_task)
-    tasker_callback_futures: dict[str, Future] = {}
-    await start_webapp(event_bus, config, tasker_callback_futures)
-    await start_tasker_server_for_futures(tasker_callback_futures)
+    tasker_callback_futures = CallbackRegistry()
+    readiness = create_readiness_monitor(tasker_callback_futures, ngrok_domain, config.tasker_http_port)
+    await start_webapp(event_bus, config, tasker_callback_futures, readiness)
+    await start_tasker_server_for_futures(tasker_callback_futures, config.tasker_http_port, config.tasker_channel_token)
+    readiness.start()
+    if config.coordinator_url is not None:
+        running_tasks.append(asyncio.create_task(send_heartbeats_forever(config, readiness)))
     if config.ensure_ready_for_action:
         await high_level.ensure_ready_for_action(tasker_callback_futures)
     logger.info("All tasks started.")
@@ -65,7 +75,7 @@ def main(config: Optional[ServerConfig] = None):
     prometheus_process_info.info({ "start_time": str(start_time) })
 
     event_bus = EventBus()
-    setup_logging(config.log_file_path, event_bus, config.log_file_log_level)
+    setup_logging(config.log_file_path, event_bus, config.log_file_log_level, config.daemonized)
     try:
         asyncio.run(run_server(event_bus, config))
     except asyncio.CancelledError:
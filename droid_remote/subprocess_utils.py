@@ -1,5 +1,15 @@
+import asyncio
 from asyncio import subprocess
+from contextlib import suppress
 from dataclasses import dataclass
+import os
+import signal
+from typing import AsyncIterator, Optional
+
+
+COMMAND_TIMEOUT = 60
+MAX_OUTPUT = 16 * 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
 
 
 @dataclass
@@ -16,15 +26,215 @@ class CommandException(Exception):
         self.stdout = stdout
 
 
-async def run_command(*command: str) -> str:
-    proc = await subprocess.create_subprocess_exec(
+class CommandTimeoutError(CommandException):
+    """The command didn't finish in time and was killed. `stdout` and `stderr`
+    hold whatever it printed before that."""
+
+    def __init__(self, command: list[str], timeout: float, stderr: str = "", stdout: str = ""):
+        super().__init__(command, -signal.SIGKILL, stderr, stdout)
+        self.timeout = timeout
+
+    def __str__(self):
+        return f"Command timed out after {self.timeout:g}s: {self.command}"
+
+
+class CommandOutputLimitError(CommandException):
+    """The command printed more than allowed and was killed"""
+
+    def __init__(self, command: list[str], max_output: int, stderr: str = "", stdout: str = ""):
+        super().__init__(command, -signal.SIGKILL, stderr, stdout)
+        self.max_output = max_output
+
+    def __str__(self):
+        return f"Command printed more than {self.max_output} bytes: {self.command}"
+
+
+@dataclass
+class CommandResult:
+    command: list[str]
+    returncode: int
+    stdout: bytes
+    stderr: bytes
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    @property
+    def stdout_text(self):
+        return self.stdout.decode(errors="replace")
+
+    @property
+    def stderr_text(self):
+        return self.stderr.decode(errors="replace")
+
+    def check(self):
+        """Raise CommandException if the command failed"""
+        if not self.ok:
+            raise CommandException(self.command, self.returncode, self.stderr_text, self.stdout_text)
+        return self
+
+
+async def spawn(*command: str, **kwargs) -> subprocess.Process:
+    """Start `command` in its own process group, so that it can be killed
+    along with everything it started (e.g. the shell and `adb` children of a
+    wrapper script)"""
+    return await subprocess.create_subprocess_exec(
         *command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+        stdout=kwargs.pop("stdout", subprocess.PIPE),
+        stderr=kwargs.pop("stderr", subprocess.PIPE),
+        start_new_session=True,
+        **kwargs,
     )
-    ret = await proc.wait()
-    stdout, stderr = [s.decode() for s in await proc.communicate()]
-    if ret != 0:
-        raise CommandException(list(command), ret, stderr, stdout)
 
-    return stdout
+
+def kill_process_group(proc: subprocess.Process):
+    if proc.returncode is not None:
+        return
+    # The group is gone already if the child exited but wasn't reaped yet
+    with suppress(ProcessLookupError, PermissionError):
+        os.killpg(proc.pid, signal.SIGKILL)
+    with suppress(ProcessLookupError):
+        proc.kill()
+
+
+async def reap(proc: subprocess.Process):
+    """Kill `proc`'s process group and wait for it, even when the calling task
+    is being cancelled"""
+    kill_process_group(proc)
+    with suppress(asyncio.CancelledError):
+        await asyncio.shield(proc.wait())
+
+
+def discard(task: asyncio.Future):
+    """Cancel `task`, retrieving its exception if it already failed"""
+    if task.done():
+        if not task.cancelled():
+            task.exception()
+    else:
+        task.cancel()
+
+
+async def read_bounded(
+    stream: asyncio.StreamReader,
+    max_output: int,
+    output: Optional[bytearray] = None,
+) -> bytes:
+    """Read `stream` until EOF. Chunks are appended to `output` as they
+    arrive, so it holds what was read so far if reading is interrupted."""
+    if output is None:
+        output = bytearray()
+    while True:
+        chunk = await stream.read(STREAM_CHUNK_SIZE)
+        if len(chunk) == 0:
+            return bytes(output)
+        output += chunk
+        if len(output) > max_output:
+            raise OverflowError(f"More than {max_output} bytes")
+
+
+async def execute(
+    *command: str,
+    timeout: Optional[float] = COMMAND_TIMEOUT,
+    max_output: int = MAX_OUTPUT,
+    stdin: Optional[bytes] = None,
+) -> CommandResult:
+    """Run `command` to completion and return its exit status and output.
+
+    stdout and stderr are read while the command runs, so it can't stall on a
+    full pipe. The command and its process group are killed when it runs
+    longer than `timeout` seconds, prints more than `max_output` bytes on
+    either stream, or when the calling task is cancelled.
+    """
+    proc = await spawn(
+        *command,
+        stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
+    )
+    assert proc.stdout is not None and proc.stderr is not None
+    stdout_buffer = bytearray()
+    stderr_buffer = bytearray()
+    stdout_task = asyncio.ensure_future(read_bounded(proc.stdout, max_output, stdout_buffer))
+    stderr_task = asyncio.ensure_future(read_bounded(proc.stderr, max_output, stderr_buffer))
+
+    def partial_output():
+        return [
+            bytes(buffer[:max_output]).decode(errors="replace")
+            for buffer in (stderr_buffer, stdout_buffer)
+        ]
+
+    try:
+        async with asyncio.timeout(timeout):
+            if stdin is not None:
+                assert proc.stdin is not None
+                proc.stdin.write(stdin)
+                await proc.stdin.drain()
+                proc.stdin.close()
+            stdout, stderr = await asyncio.gather(stdout_task, stderr_task)
+            returncode = await proc.wait()
+    except TimeoutError:
+        raise CommandTimeoutError(list(command), timeout or 0, *partial_output())
+    except OverflowError:
+        raise CommandOutputLimitError(list(command), max_output, *partial_output())
+    finally:
+        for task in (stdout_task, stderr_task):
+            discard(task)
+        if proc.returncode is None:
+            await reap(proc)
+
+    return CommandResult(list(command), returncode, stdout, stderr)
+
+
+async def run_command(*command: str, timeout: Optional[float] = COMMAND_TIMEOUT) -> str:
+    """stdout of `command`. Raises CommandException if it fails, or one of its
+    subclasses if it times out or prints too much."""
+    result = await execute(*command, timeout=timeout)
+    return result.check().stdout_text
+
+
+async def stream_command(
+    *command: str,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    timeout: Optional[float] = COMMAND_TIMEOUT,
+    max_output: int = MAX_OUTPUT,
+) -> AsyncIterator[bytes]:
+    """Yield stdout chunks as they arrive. Raises CommandException once the
+    output ends if the command failed. `timeout` applies to the whole stream,
+    time spent by the consumer included. The command's process group is
+    killed if the consumer stops early or is cancelled."""
+    proc = await spawn(*command, stdin=subprocess.DEVNULL)
+    assert proc.stdout is not None and proc.stderr is not None
+    stderr_buffer = bytearray()
+    stderr_task = asyncio.ensure_future(read_bounded(proc.stderr, max_output, stderr_buffer))
+
+    def kill_on_stderr_overflow(task: asyncio.Future):
+        # stderr isn't drained anymore: the command would block writing to it
+        # and never close stdout
+        if not task.cancelled() and isinstance(task.exception(), OverflowError):
+            kill_process_group(proc)
+    stderr_task.add_done_callback(kill_on_stderr_overflow)
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    size = 0
+    try:
+        while True:
+            async with asyncio.timeout_at(deadline):
+                chunk = await proc.stdout.read(chunk_size)
+            if len(chunk) == 0:
+                break
+            size += len(chunk)
+            if size > max_output:
+                raise CommandOutputLimitError(list(command), max_output)
+            yield chunk
+        async with asyncio.timeout_at(deadline):
+            stderr = (await stderr_task).decode(errors="replace")
+            ret = await proc.wait()
+    except TimeoutError:
+        raise CommandTimeoutError(list(command), timeout or 0, bytes(stderr_buffer).decode(errors="replace"))
+    except OverflowError:
+        raise CommandOutputLimitError(list(command), max_output, bytes(stderr_buffer[:max_output]).decode(errors="replace"))
+    finally:
+        discard(stderr_task)
+        if proc.returncode is None:
+            await reap(proc)
+    if ret != 0:
+        raise CommandException(list(command), ret, stderr, "")
@@ -1,10 +1,12 @@
 # ruff: noqa: F401
 
-from .model import CallbackFutures
+from .registry import CallbackRegistry, CallbackFutures
 from .task import execute_tasker_task
 from .exceptions import (
     UnknownTaskException,
     TaskExecutionException,
     TaskTimeoutException,
+    TaskBroadcastException,
+    TaskerOverloadedException,
 )
 from .server import start_tasker_server, start_tasker_server_for_futures
@@ -0,0 +1,124 @@
+"""Long-lived WebSocket between Droid Remote and Tasker.
+
+Tasker (or a helper it starts) connects to `ws://127.0.0.1:2981/channel` with
+an `Authorization: Bearer <token>` header (see `--tasker-channel-token`) and
+keeps the connection open. Without a configured token, connections are
+refused. Frames are JSON objects:
+
+- `{"type": "execute", "tasks": [TaskInvocation, ...]}`, sent to Tasker.
+  Invocations dispatched in the same event loop iteration share a frame.
+  That only happens for concurrent dispatches, e.g. from parallel requests:
+  the tasks of a flow like `ensure_ready_for_action` wait for each other's
+  results and go out in a frame each.
+- `{"type": "callback", "callbacks": [TaskCallbackData, ...]}`, sent by Tasker
+  once tasks complete, correlated by their `correlationId`.
+
+While no client is connected, tasks are dispatched with `am broadcast` and
+results come back through the `/task-callback` HTTP endpoint as before. No
+client ships with Droid Remote: the channel is only used once something on
+the device (e.g. a Tasker WebSocket plugin or a Termux helper relaying to
+Tasker) speaks this protocol.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+from typing import Callable, Optional
+from aiohttp import WSMsgType
+from aiohttp import web as aio_web
+from .model import TaskCallbackData, TaskInvocation
+
+
+HEARTBEAT_INTERVAL = 20
+logger = logging.getLogger(__name__)
+
+
+class TaskerChannel:
+    def __init__(self):
+        self._ws: Optional[aio_web.WebSocketResponse] = None
+        self._pending: list[TaskInvocation] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_connected(self):
+        return self._ws is not None and not self._ws.closed
+
+    async def send(self, invocation: TaskInvocation):
+        """Queue `invocation` for the next frame and wait until it is sent.
+        Raises ConnectionError if there's no client or sending fails."""
+        if not self.is_connected:
+            raise ConnectionError("No Tasker channel connected")
+        self._pending.append(invocation)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+        # Shielded: cancelling one sender must not drop the others' frame
+        await asyncio.shield(self._flush_task)
+
+    async def _flush(self):
+        # Let the other dispatches of this loop iteration join the batch
+        await asyncio.sleep(0)
+        tasks = self._pending
+        self._pending = []
+        self._flush_task = None
+        ws = self._ws
+        if ws is None or ws.closed:
+            raise ConnectionError("Tasker channel closed before sending")
+        frame = {"type": "execute", "tasks": [task.to_dict() for task in tasks]}
+        await ws.send_str(json.dumps(frame))
+        logger.debug(f"Sent {len(tasks)} task(s) over the Tasker channel")
+
+    def create_handler(
+        self,
+        handle_task_callback: Callable[[TaskCallbackData], None],
+        token: Optional[str],
+    ):
+        async def handler(request: aio_web.Request):
+            # Whoever holds the channel gets every dispatch and can answer
+            # for Tasker, so it may only be taken over with the token
+            if not is_authorized(request, token):
+                logger.warning(f"Refused unauthorized Tasker channel connection from {request.remote}")
+                raise aio_web.HTTPUnauthorized()
+            ws = aio_web.WebSocketResponse(heartbeat=HEARTBEAT_INTERVAL)
+            await ws.prepare(request)
+            if self.is_connected:
+                logger.info("New Tasker channel connection, closing the previous one")
+                assert self._ws is not None
+                await self._ws.close()
+            self._ws = ws
+            logger.info("Tasker channel connected")
+            try:
+                async for msg in ws:
+                    if msg.type != WSMsgType.TEXT:
+                        continue
+                    try:
+                        callbacks = parse_callback_frame(msg.data)
+                    except Exception:
+                        logger.exception(f"Invalid Tasker channel frame: {msg.data}")
+                        continue
+                    for callback_data in callbacks:
+                        handle_task_callback(callback_data)
+            finally:
+                if self._ws is ws:
+                    self._ws = None
+                logger.info("Tasker channel disconnected")
+            return ws
+
+        return handler
+
+
+def is_authorized(request: aio_web.Request, token: Optional[str]):
+    if token is None:
+        return False
+    authorization = request.headers.get("Authorization", "")
+    return hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode())
+
+
+def parse_callback_frame(data: str) -> list[TaskCallbackData]:
+    frame = json.loads(data)
+    if frame.get("type") != "callback":
+        raise ValueError(f"Unexpected frame type: {frame.get('type')}")
+    return [TaskCallbackData.from_dict(callback) for callback in frame["callbacks"]]
+
+
+channel = TaskerChannel()
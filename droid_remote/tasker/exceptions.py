@@ -17,3 +17,16 @@ class TaskTimeoutException(Exception):
     correlation_id: str
     task_name: str
     timeout: float
+
+
+@dataclass
+class TaskBroadcastException(Exception):
+    task_name: str
+    return_code: int
+    stderr: str
+
+
+@dataclass
+class TaskerOverloadedException(Exception):
+    task_name: str
+    pending_count: int
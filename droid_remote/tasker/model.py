@@ -12,4 +12,11 @@ class TaskCallbackData(DataClassJsonMixin):
 
 
 CallbackFuture = Future[str]
-CallbackFutures = dict[str, CallbackFuture]
+
+
+@dataclass_json(letter_case=LetterCase.CAMEL)
+@dataclass(frozen=True)
+class TaskInvocation(DataClassJsonMixin):
+    correlation_id: str
+    task_name: str
+    param2: str
@@ -0,0 +1,160 @@
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+import logging
+from secrets import token_hex
+from typing import Optional
+from ..metrics import (
+    TASKER_CALLBACKS, TASKER_CALLBACKS_EXPIRED, TASKER_CALLBACKS_PENDING,
+    TASKER_DISPATCHES_SHED, TASKER_DISPATCHES_WAITING,
+)
+from .exceptions import TaskerOverloadedException, TaskTimeoutException
+from .model import CallbackFuture
+
+
+DEFAULT_CAPACITY = 16
+SWEEP_INTERVAL = 1.0
+# Ids of finished entries remembered to tell late and duplicate callbacks
+# apart from ones that were never dispatched
+FINISHED_HISTORY_SIZE = 256
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingCallback:
+    correlation_id: str
+    task_name: str
+    future: CallbackFuture
+    timeout: float
+    deadline: float
+    """Event loop time"""
+
+
+class CallbackRegistry:
+    """Futures of dispatched Tasker tasks by correlation id.
+
+    At most `capacity` tasks can wait for their callback at once; further
+    dispatches wait for room until their own deadline and are then shed.
+    A background sweeper fails entries whose deadline passed, so nothing
+    lingers when a waiter goes away.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._pending: dict[str, PendingCallback] = {}
+        self._finished: OrderedDict[str, str] = OrderedDict()
+        self._room = asyncio.Condition()
+        self._sweeper: Optional[asyncio.Task] = None
+        # The loop only keeps weak references to tasks
+        self._notify_tasks: set[asyncio.Task] = set()
+        self.late_count = 0
+        self.orphaned_count = 0
+        self.duplicate_count = 0
+        self.expired_count = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, correlation_id: str):
+        return correlation_id in self._pending
+
+    async def register(self, task_name: str, timeout: float) -> PendingCallback:
+        """Create an entry for a new dispatch, waiting for room if the
+        registry is full. Raises TaskerOverloadedException if there is still
+        no room once `timeout` seconds have passed; time spent waiting counts
+        towards the entry's deadline."""
+        deadline = asyncio.get_running_loop().time() + timeout
+        if len(self._pending) >= self.capacity:
+            TASKER_DISPATCHES_WAITING.inc()
+            try:
+                async with asyncio.timeout_at(deadline):
+                    async with self._room:
+                        await self._room.wait_for(lambda: len(self._pending) < self.capacity)
+            except TimeoutError:
+                TASKER_DISPATCHES_SHED.inc()
+                raise TaskerOverloadedException(task_name, len(self._pending))
+            finally:
+                TASKER_DISPATCHES_WAITING.dec()
+        correlation_id = token_hex(8)
+        entry = PendingCallback(
+            correlation_id,
+            task_name,
+            asyncio.get_running_loop().create_future(),
+            timeout,
+            deadline,
+        )
+        self._pending[correlation_id] = entry
+        TASKER_CALLBACKS_PENDING.set(len(self._pending))
+        self._ensure_sweeper()
+        return entry
+
+    def take(self, correlation_id: str) -> Optional[PendingCallback]:
+        """Remove and return the entry a callback is for, or None (after
+        accounting for it) if it's late, a duplicate or unknown"""
+        entry = self._pending.get(correlation_id)
+        if entry is not None:
+            self._finish(correlation_id, "completed")
+            TASKER_CALLBACKS.labels(outcome="matched").inc()
+            return entry
+        msg_prefix = f"Callback for Tasker task with {correlation_id=}:"
+        state = self._finished.get(correlation_id)
+        if state == "expired":
+            self.late_count += 1
+            TASKER_CALLBACKS.labels(outcome="late").inc()
+            logger.warning(f"{msg_prefix} arrived after its deadline")
+        elif state == "completed":
+            self.duplicate_count += 1
+            TASKER_CALLBACKS.labels(outcome="duplicate").inc()
+            logger.warning(f"{msg_prefix} duplicate")
+        else:
+            self.orphaned_count += 1
+            TASKER_CALLBACKS.labels(outcome="orphaned").inc()
+            logger.warning(f"{msg_prefix} no callback future found")
+        return None
+
+    def discard(self, correlation_id: str):
+        """Drop an entry whose waiter gave up (timed out or was cancelled)"""
+        if correlation_id in self._pending:
+            self.expired_count += 1
+            TASKER_CALLBACKS_EXPIRED.inc()
+            self._finish(correlation_id, "expired")
+
+    def _finish(self, correlation_id: str, state: str):
+        del self._pending[correlation_id]
+        self._finished[correlation_id] = state
+        while len(self._finished) > FINISHED_HISTORY_SIZE:
+            self._finished.popitem(last=False)
+        TASKER_CALLBACKS_PENDING.set(len(self._pending))
+        notify_task = asyncio.get_running_loop().create_task(self._notify_room())
+        self._notify_tasks.add(notify_task)
+        notify_task.add_done_callback(self._notify_tasks.discard)
+
+    async def _notify_room(self):
+        async with self._room:
+            self._room.notify_all()
+
+    def _ensure_sweeper(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_forever())
+
+    async def _sweep_forever(self):
+        loop = asyncio.get_running_loop()
+        while len(self._pending) > 0:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            now = loop.time()
+            for entry in list(self._pending.values()):
+                if entry.deadline > now:
+                    continue
+                logger.debug(f"Tasker task {entry.task_name} ({entry.correlation_id}) expired")
+                self.expired_count += 1
+                TASKER_CALLBACKS_EXPIRED.inc()
+                if not entry.future.done():
+                    entry.future.set_exception(
+                        TaskTimeoutException(entry.correlation_id, entry.task_name, entry.timeout)
+                    )
+                    # Nobody may be waiting on it anymore
+                    entry.future.exception()
+                self._finish(entry.correlation_id, "expired")
+
+
+CallbackFutures = CallbackRegistry
@@ -1,12 +1,16 @@
 import asyncio
 import logging
-from typing import Callable
+from typing import Callable, Optional
 from aiohttp import web as aio_web
+from .channel import channel
 from .exceptions import UnknownTaskException, TaskExecutionException
-from .model import CallbackFutures, TaskCallbackData
+from .model import TaskCallbackData
+from .registry import CallbackFutures
 
 
 HTTP_PORT = 2981  # https://xkcd.com/221/
+# Tasker runs on the same device
+HTTP_HOST = "127.0.0.1"
 logger = logging.getLogger(__name__)
 
 
@@ -32,12 +36,10 @@ def create_futures_task_callback_handler(
     def handler(callback_data: TaskCallbackData):
         logger.debug(f"Received task callback: {callback_data}")
         correlation_id = callback_data.correlation_id
-        msg_prefix = f"Callback for Tasker task with {correlation_id=}:"
-        try:
-            callback_future = callback_futures[correlation_id]
-        except KeyError:
-            logger.warn(f"{msg_prefix} no callback future found")
+        entry = callback_futures.take(correlation_id)
+        if entry is None:
             return
+        callback_future = entry.future
         return_code = callback_data.return_code
         result = callback_data.result
         msg_prefix = f"Tasker task with {correlation_id=}:"
@@ -50,31 +52,35 @@ def create_futures_task_callback_handler(
             callback_future.set_exception(TaskExecutionException(return_code, result))
         else:
             callback_future.set_result(result)
-        try:
-            del callback_futures[correlation_id]
-        except KeyError:
-            pass
 
     return handler
 
 
 async def start_tasker_server(
     handle_task_callback: Callable[[TaskCallbackData], None],
+    port: int = HTTP_PORT,
+    channel_token: Optional[str] = None,
 ):
     app = aio_web.Application()
     task_callback_handler = create_aio_task_callback_handler(handle_task_callback)
-    app.add_routes([aio_web.post("/task-callback", task_callback_handler)])
+    app.add_routes([
+        aio_web.get("/channel", channel.create_handler(handle_task_callback, channel_token)),
+        # Fallback for when Tasker isn't connected to the channel
+        aio_web.post("/task-callback", task_callback_handler),
+    ])
     runner = aio_web.AppRunner(app)
     await runner.setup()
-    site = aio_web.TCPSite(runner, port=HTTP_PORT)
+    site = aio_web.TCPSite(runner, HTTP_HOST, port)
     await site.start()
 
 
 async def start_tasker_server_for_futures(
     callback_futures: CallbackFutures,
+    port: int = HTTP_PORT,
+    channel_token: Optional[str] = None,
 ):
     handle_task_callback = create_futures_task_callback_handler(callback_futures)
-    await start_tasker_server(handle_task_callback)
+    await start_tasker_server(handle_task_callback, port, channel_token)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,17 @@
 import asyncio
 import logging
-from secrets import token_hex
-import subprocess
+import time
 from typing import Optional
-from .exceptions import TaskTimeoutException
-from .model import CallbackFuture, CallbackFutures
+from ..metrics import TASKER_TASK_DURATION
+from ..subprocess_utils import CommandException, run_command
+from .channel import channel
+from .exceptions import TaskBroadcastException, TaskTimeoutException
+from .model import TaskInvocation
+from .registry import CallbackFutures
 
 
+TASKER_EXECUTE_TASK_ACTION = "net.dinglisch.android.taskerm.EXECUTE_TASK"
+TASK_TIMEOUT = 10
 logger = logging.getLogger(__name__)
 
 
@@ -14,17 +19,29 @@ async def execute_tasker_task(
     callback_futures: CallbackFutures,
     task_name,
     param2: Optional[str] = None,
-    timeout=5,
+    timeout: float = TASK_TIMEOUT,
 ):
     logger.debug(f"Executing tasker task {task_name} with param2={param2}")
-    await asyncio.sleep(1)
-    correlation_id = token_hex(8)
-    broadcast_result = subprocess.run(
-        [
+    start = time.perf_counter()
+    outcome = "success"
+    try:
+        return await _execute_tasker_task(callback_futures, task_name, param2, timeout)
+    except BaseException as e:
+        outcome = e.__class__.__name__
+        raise
+    finally:
+        TASKER_TASK_DURATION.labels(task_name=task_name, outcome=outcome).observe(
+            time.perf_counter() - start
+        )
+
+
+async def broadcast_tasker_task(task_name: str, correlation_id: str, param2: Optional[str]):
+    try:
+        await run_command(
             "am",
             "broadcast",
             "-a",
-            "net.dinglisch.android.taskerm.EXECUTE_TASK",
+            TASKER_EXECUTE_TASK_ACTION,
             "-e",
             "task_name",
             task_name,
@@ -34,32 +51,47 @@ async def execute_tasker_task(
             "-e",
             "task_par2_a",
             param2 or "",
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    if broadcast_result.returncode != 0:
-        raise Exception(
-            f'Broadcasting tasker task failed: returncode={broadcast_result.returncode} stderr={broadcast_result.stderr.decode("utf-8")}'
         )
+    except CommandException as e:
+        raise TaskBroadcastException(task_name, e.returncode, e.stderr)
     logger.debug(
         f"Broadcasted tasker task {task_name} with correlation_id={correlation_id}"
     )
-    callback_future: CallbackFuture = asyncio.Future()
-    callback_futures[correlation_id] = callback_future
+
+
+async def dispatch_tasker_task(task_name: str, correlation_id: str, param2: Optional[str]):
+    """Send the task over the Tasker channel, or broadcast it if no channel is
+    connected (or sending over it fails)"""
+    if channel.is_connected:
+        try:
+            await channel.send(TaskInvocation(correlation_id, task_name, param2 or ""))
+            return
+        except (ConnectionError, RuntimeError) as e:
+            logger.warning(f"Sending tasker task {task_name} over the channel failed ({e}), broadcasting instead")
+    await broadcast_tasker_task(task_name, correlation_id, param2)
+
+
+async def _execute_tasker_task(
+    callback_futures: CallbackFutures,
+    task_name,
+    param2: Optional[str],
+    timeout,
+):
+    # Registered before dispatching: Tasker can call back before `am` exits
+    entry = await callback_futures.register(task_name, timeout)
+    correlation_id = entry.correlation_id
     try:
-        async with asyncio.timeout(10):
+        # The deadline covers dispatching too, `am` alone can take seconds
+        async with asyncio.timeout_at(entry.deadline):
+            await dispatch_tasker_task(task_name, correlation_id, param2)
             logger.debug(f"Waiting for tasker task {task_name} to complete")
-            result = await callback_future
+            result = await entry.future
             logger.debug(f"Tasker task '{task_name}' completed with result '{result}'")
             return result
     except TimeoutError:
         raise TaskTimeoutException(correlation_id, task_name, timeout)
     finally:
-        try:
-            del callback_futures[correlation_id]
-        except KeyError:
-            pass
+        callback_futures.discard(correlation_id)
 
 
 async def cli_test():
@@ -1,64 +1,130 @@
 import asyncio
+from collections import deque
 import dataclasses
 import logging
-from typing import Optional
-from .pid_management import PidFilePaths, clear_pid_files, ensure_no_existing_process_or_exit, init_pid_files
+import time
+import prometheus_client
+from .metrics import WATCHDOG_RESTARTS
+from .pid_management import (
+    clear_pid_files, ensure_no_existing_process_or_exit, init_pid_files, read_pid,
+    wait_for_process_exit,
+)
 from .config import CtlConfig
-from .health import safe_check_if_daemon_healthy
+from .health import HealthChecker, ProbeInterval, safe_check_if_daemon_healthy
 from .signal_handling import add_signal_handlers
-from .daemon_management import restart_daemon
+from .daemon_management import ExitedBeforeFirstLogLineError, restart_daemon
+from .cluster import report_node_unhealthy
 
 
-HEALTH_CHECK_TIMEOUT = 5
-HEALTH_CHECK_REPEAT_UNHEALTHY_TIMEOUT = 30
+# Consecutive failed probes before restarting, so that a single slow
+# handshake doesn't trigger a restart
+UNHEALTHY_PROBES_BEFORE_RESTART = 2
+RESTART_BACKOFF_BASE = 1
+RESTART_BACKOFF_MAX = 60
+# More restarts than this within the window trip the crash-loop breaker,
+# which holds off restarting for the cooldown
+CRASH_LOOP_MAX_RESTARTS = 5
+CRASH_LOOP_WINDOW = 300
+CRASH_LOOP_COOLDOWN = 300
 logger = logging.getLogger(__name__)
 
 
-async def restart_if_unhealthy(
-    base_url: str,
-    config: CtlConfig,
-    pid_file_paths: PidFilePaths,
-    was_healthy: Optional[bool],
-):
-    is_healthy = safe_check_if_daemon_healthy(pid_file_paths, base_url)
-    if not is_healthy:
-        if was_healthy is False:
-            logger.warning("Server is still not healthy. Restarting again...")
-        elif was_healthy:
-            logger.warning("Server has become unhealthy. Restarting...")
-        else:
-            logger.warning("Server is unhealthy. Restarting...")
+class RestartPolicy:
+    """The first restart is immediate, consecutive ones back off exponentially
+    until the server has been seen healthy again"""
+
+    def __init__(self):
+        self.consecutive_restarts = 0
+        self._restart_times: deque[float] = deque()
+
+    def next_delay(self):
+        now = time.monotonic()
+        while len(self._restart_times) > 0 and now - self._restart_times[0] > CRASH_LOOP_WINDOW:
+            self._restart_times.popleft()
+        if len(self._restart_times) >= CRASH_LOOP_MAX_RESTARTS:
+            logger.error(
+                f"Server restarted {len(self._restart_times)} times within {CRASH_LOOP_WINDOW}s, "
+                f"crash loop suspected. Holding off for {CRASH_LOOP_COOLDOWN}s..."
+            )
+            self._restart_times.clear()
+            return CRASH_LOOP_COOLDOWN
+        if self.consecutive_restarts == 0:
+            return 0
+        return min(RESTART_BACKOFF_BASE * 2 ** (self.consecutive_restarts - 1), RESTART_BACKOFF_MAX)
+
+    def record_restart(self):
+        self.consecutive_restarts += 1
+        self._restart_times.append(time.monotonic())
+
+    def record_healthy(self):
+        self.consecutive_restarts = 0
+
+
+async def restart_with_backoff(config: CtlConfig, policy: RestartPolicy, reason: str):
+    # Let the cluster coordinator fail over while we're restarting
+    await report_node_unhealthy(config, reason)
+    delay = policy.next_delay()
+    if delay > 0:
+        logger.info(f"Waiting {delay:g}s before restarting...")
+        await asyncio.sleep(delay)
+    policy.record_restart()
+    WATCHDOG_RESTARTS.labels(reason=reason).inc()
+    try:
         await restart_daemon(config)
-    elif was_healthy is False:
-        logger.info("Server has healed back to perfect health.")
-    return is_healthy
+    except ExitedBeforeFirstLogLineError:
+        logger.error("Server exited before printing its first log line.")
 
 
 async def watch_forever(config: CtlConfig):
+    """Restart the server as soon as its process exits, or when it stops
+    answering health probes (hangs)"""
     # We are the watchdog, indicate that what we are controlling is the server
     server_config = dataclasses.replace(config, watchdog=False)
     server_pid_file_paths = server_config.pid_file_paths
-    is_healthy: Optional[bool] = None
-    while True:
-        was_healthy = is_healthy
-        is_healthy = await restart_if_unhealthy(
-            config.monitoring_base_url, server_config, server_pid_file_paths, was_healthy
-        )
-        if was_healthy is None:
-            if is_healthy:
-                logger.info("Server was already healthy, continuing to monitor...")
-            else:
-                logger.info("Continuing to monitor...")
-        restart_loop = is_healthy is False and was_healthy is False
-        await asyncio.sleep(
-            HEALTH_CHECK_REPEAT_UNHEALTHY_TIMEOUT
-            if restart_loop
-            else HEALTH_CHECK_TIMEOUT
-        )
+    policy = RestartPolicy()
+    probe_interval = ProbeInterval()
+    failed_probes = 0
+    async with HealthChecker(config.monitoring_base_url) as checker:
+        if await safe_check_if_daemon_healthy(server_pid_file_paths, checker):
+            logger.info("Server was already healthy, continuing to monitor...")
+        else:
+            logger.warning("Server is unhealthy. Restarting...")
+            await restart_with_backoff(server_config, policy, "unhealthy")
+            logger.info("Continuing to monitor...")
+        while True:
+            pid = read_pid(server_pid_file_paths.daemon_pid)
+            exit_task = asyncio.create_task(wait_for_process_exit(pid))
+            try:
+                done, _ = await asyncio.wait(
+                    {exit_task}, timeout=probe_interval.next(failed_probes == 0)
+                )
+            finally:
+                exit_task.cancel()
+            if exit_task in done:
+                logger.warning(f"Server process exited ({pid=}). Restarting...")
+                failed_probes = 0
+                await restart_with_backoff(server_config, policy, "exited")
+                continue
+            if await safe_check_if_daemon_healthy(server_pid_file_paths, checker):
+                if failed_probes > 0 or policy.consecutive_restarts > 0:
+                    logger.info("Server has healed back to perfect health.")
+                failed_probes = 0
+                policy.record_healthy()
+                continue
+            failed_probes += 1
+            if failed_probes < UNHEALTHY_PROBES_BEFORE_RESTART:
+                logger.info(f"Server health probe failed ({failed_probes}/{UNHEALTHY_PROBES_BEFORE_RESTART}), probing again...")
+                continue
+            logger.warning("Server is not responding. Restarting...")
+            failed_probes = 0
+            await restart_with_backoff(server_config, policy, "unresponsive")
 
 
 async def run_watchdog(config: CtlConfig):
     logger.info("Starting droid remote watchdog...")
+    if config.watchdog_metrics_port is not None:
+        prometheus_client.start_http_server(config.watchdog_metrics_port)
+        logger.info(f"Serving watchdog metrics on port {config.watchdog_metrics_port}")
     watch_forever_task = asyncio.create_task(watch_forever(config))
     add_signal_handlers([watch_forever_task])
     await watch_forever_task
@@ -1,6 +1,6 @@
 import logging
 from pathlib import Path
-import inspect
+from typing import Optional
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 from aiohttp.web import (
     Response,
@@ -8,19 +8,23 @@ from aiohttp.web import (
     Application,
     AppRunner,
     TCPSite,
-    WebSocketResponse,
 )
 from aiohttp import web
 from aiohttp_basicauth import BasicAuthMiddleware
 import prometheus_client
-from .itsme.known_actions import read_itsme_known_actions
+from .itsme import known_actions
 from .itsme.routes import create_routes as create_itsme_routes
 from .aio_util import prefix_all, wrap_all
 from ..event_bus import EventBus
 from .exception_handling import with_exception_handling
 from .general_routes import create_routes as create_general_routes
+from .job_routes import create_routes as create_job_routes
+from .device_routes import create_routes as create_device_routes
+from .log_stream import handle_ws
 from ..tasker import CallbackFutures
 from ..config import ServerConfig
+from ..jobs import JobStore
+from ..readiness import ReadinessMonitor
 
 
 logger = logging.getLogger(__name__)
@@ -30,29 +34,35 @@ async def handle_root(jinja_env: Environment):
     return Response(
         body=jinja_env.get_template("daemon.html").render(
             {
-                "itsme_known_actions": read_itsme_known_actions(),
+                "itsme_known_actions": known_actions.store.snapshot(),
             }
         ),
         content_type="text/html",
     )
 
 
-async def handle_ws(event_bus: EventBus, request: Request):
-    ws = WebSocketResponse()
-    await ws.prepare(request)
-    async for event in event_bus:
-        try:
-            await ws.send_str(
-                inspect.cleandoc(
-                    f""""
-                        <pre id="log" hx-swap-oob="beforeend">
-                        {event}
-                        </pre>
-                    """
-                )
-            )
-        except ConnectionResetError:
-            break
+def handle_liveness(_: Request):
+    """Answered without doing any work: if this responds, the loop does"""
+    return Response(text="OK")
+
+
+async def handle_readiness(readiness: ReadinessMonitor, auth: Optional[BasicAuthMiddleware], request: Request):
+    """Open for probes, but only the status and the names of failing checks
+    without credentials: the details name devices and their state"""
+    ready, checks = readiness.report()
+    status = 200 if ready else 503
+    if auth is not None and not await auth.authenticate(request):
+        failing = [name for name, check in checks.items() if not check["ok"]]
+        return web.json_response({"ready": ready, "failing": failing}, status=status)
+    return web.json_response({"ready": ready, "checks": checks}, status=status)
+
+
+async def handle_known_actions(request: Request):
+    """Autocomplete: known apps starting with `?prefix=`, with their actions"""
+    apps = known_actions.store.complete(request.query.get("prefix", ""))
+    return web.json_response([
+        {"app": app, "actions": known_actions.store.actions(app)} for app in apps
+    ])
 
 
 def handle_metrics(_: Request):
@@ -63,8 +73,10 @@ async def start_webapp(
     event_bus: EventBus,
     config: ServerConfig,
     tasker_callback_futures: CallbackFutures,
+    readiness: ReadinessMonitor,
 ):
     logger.info("Creating and starting webapp...")
+    known_actions.store.load(config.known_actions_file_path)
     template_dir = Path(__file__).parent / "templates"
     jinja_env = Environment(
         loader=FileSystemLoader(template_dir), autoescape=select_autoescape()
@@ -73,15 +85,24 @@ async def start_webapp(
 
     itsme_pin = config.itsme_pin
     app_routes = [
-        *prefix_all(create_itsme_routes(itsme_pin), "/itsme/"),
-        *prefix_all(create_general_routes(tasker_callback_futures), "/"),
+        *prefix_all(create_itsme_routes(itsme_pin), "itsme/"),
+        *create_general_routes(tasker_callback_futures),
+    ]
+    job_store = JobStore(event_bus)
+    # Go to the only attached device at /..., to a given one at /devices/<serial>/...
+    device_scoped_routes = [
+        *prefix_all(create_job_routes(job_store, itsme_pin, tasker_callback_futures), "jobs/"),
+        *wrap_all(app_routes, with_exception_handling),
     ]
     secure_routes = [
         web.get("/", lambda _: handle_root(jinja_env)),
         web.get("/ws", lambda request: handle_ws(event_bus, request)),
-        *wrap_all(app_routes, with_exception_handling),
+        web.get("/itsme/known-actions", handle_known_actions),
+        *prefix_all(device_scoped_routes, "/"),
+        *create_device_routes(device_scoped_routes),
     ]
     http_basic_password = config.http_basic_password
+    auth: Optional[BasicAuthMiddleware] = None
     if http_basic_password is not None:
         auth = BasicAuthMiddleware(
             username="admin", password=http_basic_password, force=False
@@ -91,6 +112,8 @@ async def start_webapp(
         authenticated_routes = secure_routes
     routes = [
         web.get("/metrics", handle_metrics),
+        web.get("/healthz", handle_liveness),
+        web.get("/healthz/ready", lambda request: handle_readiness(readiness, auth, request)),
         web.static("/static", static_path),
         *authenticated_routes,
     ]
@@ -99,7 +122,7 @@ async def start_webapp(
     app.add_routes(routes)
     runner = AppRunner(app)
     await runner.setup()
-    site = TCPSite(runner, "localhost", 8080)
+    site = TCPSite(runner, config.http_host, config.http_port)
     await site.start()
     logger.info("Webapp started")
     return site
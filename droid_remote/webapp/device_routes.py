@@ -0,0 +1,45 @@
+from typing import Callable
+from aiohttp import web
+from aiohttp.web import Request, RouteDef, get
+from ..device import adb
+from ..device.registry import UnknownDeviceError
+from .aio_util import prefix_all, wrap_all
+
+
+DEVICE_PREFIX = "/devices/{serial}/"
+
+
+def with_device_target(handler: Callable):
+    """Send the handler's adb calls to the device named in the path"""
+
+    async def targeted_handler(request: Request):
+        serial = request.match_info["serial"]
+        try:
+            await adb.require_device(serial)
+        except UnknownDeviceError as e:
+            raise web.HTTPNotFound(text=str(e))
+        with adb.target(serial):
+            return await handler(request)
+
+    return targeted_handler
+
+
+async def handle_list_devices(_: Request):
+    devices = await adb.list_devices()
+    return web.json_response([
+        {
+            "serial": device.serial,
+            "state": device.connection_mode,
+            "identity": device.identity,
+        }
+        for device in devices
+    ])
+
+
+def create_routes(device_scoped_routes: list[RouteDef]):
+    """`GET /devices`, and the given routes under `/devices/<serial>/`, going
+    to that device"""
+    return [
+        get("/devices", handle_list_devices),
+        *wrap_all(prefix_all(device_scoped_routes, DEVICE_PREFIX), with_device_target),
+    ]
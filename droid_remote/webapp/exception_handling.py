@@ -3,7 +3,7 @@ import logging
 import sys
 from typing import Callable
 from html import escape as html_escape
-from aiohttp.web import Request, Response
+from aiohttp.web import HTTPException, Request, Response, StreamResponse
 from .aio_util import call_with_request_kwargs
 from itsme_adb.driver import WrongScreenError
 from ..tasker import TaskTimeoutException
@@ -17,6 +17,8 @@ def with_exception_handling(async_fn: Callable):
     async def handler(request: Request):
         try:
             response = await call_with_request_kwargs(async_fn, request)
+        except HTTPException:
+            raise
         except TaskTimeoutException as e:
             logger.warning(f"Tasker task timed out: {e}")
             return Response(text=f"Tasker task timed out: {e}")
@@ -62,6 +64,8 @@ def with_exception_handling(async_fn: Callable):
                 status=500,
             )
 
+        if isinstance(response, StreamResponse):
+            return response
         return Response(text=str(response))
 
     return handler
@@ -35,10 +35,12 @@ async def read_screen():
     return f"<pre>{html.escape(screen_xml)}</pre>"
 
 
-adb_keep_alive_task: Optional[asyncio.Task] = None
+# Per device serial
+adb_keep_alive_tasks: dict[Optional[str], asyncio.Task] = {}
 
 
 async def get_adb_keep_alive():
+    adb_keep_alive_task = adb_keep_alive_tasks.get(adb.current_device().serial)
     if adb_keep_alive_task is not None:
         try:
             adb_keep_alive_task.result()
@@ -53,10 +55,14 @@ async def get_adb_keep_alive():
 
 
 async def start_adb_keep_alive():
-    global adb_keep_alive_task
+    serial = adb.current_device().serial
+    adb_keep_alive_task = adb_keep_alive_tasks.get(serial)
     if adb_keep_alive_task is not None and not adb_keep_alive_task.done():
         return "ADB keep-alive is already running."
-    adb_keep_alive_task = asyncio.create_task(adb.send_periodic_keep_alive())
+    # Pinned to the device, even if others get attached later
+    with adb.target(serial):
+        adb_keep_alive_task = asyncio.create_task(adb.send_periodic_keep_alive())
+    adb_keep_alive_tasks[serial] = adb_keep_alive_task
     def done_callback(task: asyncio.Task):
         try:
             task.result()
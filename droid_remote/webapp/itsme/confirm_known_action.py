@@ -5,8 +5,10 @@ from itsme_adb import driver
 
 
 async def handle_confirm_known_action(itsme_pin: str, request: Request):
-    app = request.query["app"]
-    action = request.query["action"]
+    return await confirm_known_action(itsme_pin, request.query["app"], request.query["action"])
+
+
+async def confirm_known_action(itsme_pin: str, app: str, action: str):
     retry_button = itsme_button(
         "confirm-known-action",
         f"Retry confirm known action '{app}: {action}'",
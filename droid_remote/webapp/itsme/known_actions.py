@@ -1,10 +1,19 @@
+import asyncio
+import atexit
+from bisect import bisect_left, insort
 import logging
+import os
 from pathlib import Path
 from dataclasses import dataclass
+from tempfile import NamedTemporaryFile
+from typing import Optional
 from dataclasses_json import dataclass_json, LetterCase, DataClassJsonMixin
 
 
-ITSME_KNOWN_ACTIONS_PATH = Path(__file__).parent / "itsme_known_actions.json"
+# Shipped with the package, seeds the store on first use
+BUNDLED_KNOWN_ACTIONS_PATH = Path(__file__).parent / "itsme_known_actions.json"
+# Changes are written at most this often
+KNOWN_ACTIONS_FLUSH_DELAY = 1.0
 logger = logging.getLogger(__name__)
 
 
@@ -14,27 +23,143 @@ class KnownItsmeActions(DataClassJsonMixin):
     app_actions: dict[str, set[str]]
 
 
-def read_itsme_known_actions() -> KnownItsmeActions:
+def read_known_actions_file(path: Path) -> Optional[KnownItsmeActions]:
     try:
-        with open(ITSME_KNOWN_ACTIONS_PATH, "r") as f:
-            json = f.read()
-            if len(json) > 0:
-                return KnownItsmeActions.from_json(json)
+        content = path.read_text()
     except FileNotFoundError:
-        pass
+        return None
+    if len(content) == 0:
+        return None
+    return KnownItsmeActions.from_json(content)
 
-    return KnownItsmeActions(app_actions={})
 
+def write_atomically(path: Path, content: str):
+    """Readers see either the old or the new content, never a partial write"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with NamedTemporaryFile("w", dir=path.parent, prefix=f".{path.name}.", delete=False) as f:
+        try:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, path)
 
-def save_itsme_action(app: str, action: str):
-    logger.info(f"Saving itsme action: {app} {action}")
 
-    known_apps = read_itsme_known_actions()
+class KnownActionsStore:
+    """Known itsme actions by app, kept in memory. Changes are written to
+    `path` in the background, batched over `KNOWN_ACTIONS_FLUSH_DELAY`."""
+
+    def __init__(self):
+        self.path: Optional[Path] = None
+        self.app_actions: dict[str, set[str]] = {}
+        # (casefolded app name, app name), sorted, for prefix lookups
+        self._index: list[tuple[str, str]] = []
+        self._version = 0
+        self._flushed_version = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def load(self, path: Path):
+        """Read the store from `path`, or from the bundled file if there is
+        none yet"""
+        known = read_known_actions_file(path)
+        if known is None:
+            logger.info(f"No known itsme actions at {path}, starting from the bundled ones")
+            known = read_known_actions_file(BUNDLED_KNOWN_ACTIONS_PATH)
+        self.path = path
+        self.app_actions = {} if known is None else {app: set(actions) for app, actions in known.app_actions.items()}
+        self._index = sorted((app.casefold(), app) for app in self.app_actions)
+        self._version = self._flushed_version = 0
+
+    def add(self, app: str, action: str):
+        """Returns whether the action was new"""
+        actions = self.app_actions.get(app)
+        if actions is None:
+            actions = self.app_actions[app] = set()
+            insort(self._index, (app.casefold(), app))
+        elif action in actions:
+            return False
+        logger.info(f"Saving itsme action: {app} {action}")
+        actions.add(action)
+        self._version += 1
+        self._schedule_flush()
+        return True
+
+    def actions(self, app: str) -> list[str]:
+        return sorted(self.app_actions.get(app, ()))
+
+    def complete(self, prefix: str, limit: int = 20) -> list[str]:
+        """Apps whose name starts with `prefix`, case-insensitively"""
+        key = prefix.casefold()
+        apps = []
+        for folded, app in self._index[bisect_left(self._index, (key,)):]:
+            if not folded.startswith(key) or len(apps) >= limit:
+                break
+            apps.append(app)
+        return apps
+
+    def snapshot(self):
+        # Sorted lists rather than sets, so the file doesn't change order
+        return KnownItsmeActions(app_actions={
+            app: self.actions(app) for _, app in self._index
+        })
+
+    def _serialize(self):
+        return self.snapshot().to_json(indent=2)
+
+    @property
+    def is_dirty(self):
+        return self._version != self._flushed_version
 
-    if app not in known_apps.app_actions:
-        known_apps.app_actions[app] = set()
+    def _schedule_flush(self):
+        if self.path is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_sync()
+            return
+        # A running flush schedules the next one itself, once it has written
+        flush_task = self._flush_task
+        flush_running = (
+            flush_task is not None
+            and not flush_task.done()
+            and flush_task is not asyncio.current_task()
+        )
+        if self._flush_handle is None and not flush_running:
+            self._flush_handle = loop.call_later(KNOWN_ACTIONS_FLUSH_DELAY, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        if self.path is None or not self.is_dirty:
+            return
+        version = self._version
+        try:
+            await asyncio.to_thread(write_atomically, self.path, self._serialize())
+            self._flushed_version = version
+        except Exception as e:
+            # Retried with the next change
+            logger.error(f"Could not save known itsme actions to {self.path}: {e}")
+            return
+        if self.is_dirty:
+            self._schedule_flush()
+
+    def flush_sync(self):
+        if self.path is not None and self.is_dirty:
+            write_atomically(self.path, self._serialize())
+            self._flushed_version = self._version
+
+
+store = KnownActionsStore()
+
+
+def save_itsme_action(app: str, action: str):
+    store.add(app, action)
 
-    known_apps.app_actions[app].add(action)
 
-    with open(ITSME_KNOWN_ACTIONS_PATH, "w") as f:
-        f.write(known_apps.to_json())
+atexit.register(store.flush_sync)
@@ -1,35 +1,71 @@
-from typing import Callable
+from typing import Callable, Optional
 import inspect
-import asyncio
 from aiohttp.web import Request, post
 
 from itsme_adb import driver
+from ...device import adb
 from .html import screen_to_html
 from ..aio_util import call_with_request_kwargs, get_bool_form_value
 
 
+def next_screen_after(screen: Optional[driver.Screen]):
+    return lambda: driver.wait_for_next_screen(screen)
+
+
 async def handle_parse_action(itsme_pin: str, action: Callable, request: Request):
-    result = await call_with_request_kwargs(action, request)
     form_data = await request.post()
-    auto_tap_card = get_bool_form_value(form_data, "auto-tap-card")
-    auto_enter_pin = get_bool_form_value(form_data, "auto-enter-pin")
-    auto_dismiss_expired = get_bool_form_value(form_data, "auto-dismiss-expired")
+    # The screen and the automatic steps that follow it form one UI session
+    async with adb.current_device().scheduler.ui_session():
+        return await parse_and_act(
+            itsme_pin,
+            action,
+            request,
+            auto_tap_card=get_bool_form_value(form_data, "auto-tap-card"),
+            auto_enter_pin=get_bool_form_value(form_data, "auto-enter-pin"),
+            auto_dismiss_expired=get_bool_form_value(form_data, "auto-dismiss-expired"),
+        )
+
+
+async def parse_and_act(
+    itsme_pin: str,
+    action: Callable,
+    request: Request,
+    auto_tap_card: bool,
+    auto_enter_pin: bool,
+    auto_dismiss_expired: bool,
+):
+    try:
+        result = await call_with_request_kwargs(action, request)
+    except driver.ScreenDidNotChangeError as e:
+        # Acting on it again would repeat the tap (or the PIN)
+        return inspect.cleandoc(
+            f"""
+        <p>Screen did not change:</p>
+        {screen_to_html(e.screen)}
+      """
+        )
+    next_action = None
     if isinstance(result, driver.PendingActionsHomeScreen) and auto_tap_card:
         await result.tap_card()
-        await asyncio.sleep(1)
-        return await handle_parse_action(itsme_pin, action, request)
-    if isinstance(result, driver.PinpadScreen) and auto_enter_pin:
+        next_action = next_screen_after(result)
+    elif isinstance(result, driver.PinpadScreen) and auto_enter_pin:
         await result.enter_pin(itsme_pin)
-        await asyncio.sleep(1)
-        return await handle_parse_action(itsme_pin, action, request)
-    if isinstance(result, driver.ActionExpiredScreen) and auto_dismiss_expired:
+        next_action = next_screen_after(result)
+    elif isinstance(result, driver.ActionExpiredScreen) and auto_dismiss_expired:
         await result.ok()
-        await asyncio.sleep(1)
-        return await handle_parse_action(itsme_pin, action, request)
-    if isinstance(result, driver.PlayRatingScreen):
+        next_action = next_screen_after(result)
+    elif isinstance(result, driver.PlayRatingScreen):
         await result.not_now()
-        await asyncio.sleep(1)
-        return await handle_parse_action(itsme_pin, action, request)
+        next_action = next_screen_after(result)
+    if next_action is not None:
+        return await parse_and_act(
+            itsme_pin,
+            next_action,
+            request,
+            auto_tap_card,
+            auto_enter_pin,
+            auto_dismiss_expired,
+        )
 
     return inspect.cleandoc(
         f"""
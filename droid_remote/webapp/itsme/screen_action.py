@@ -1,20 +1,25 @@
-import asyncio
 from typing import Callable
 from aiohttp.web import Request, post
 
 from itsme_adb import driver
-from .parse_screen import handle_parse_action
+from ...device import adb
+from .parse_screen import handle_parse_action, next_screen_after
 from ..aio_util import call_with_request_kwargs
 
 
 async def handle_itsme_screen_action(itsme_pin: str, action: Callable, request: Request):
-    result = await call_with_request_kwargs(action, request)
-    if result is not None:
-        return f"<p>Result from action: {str(result)}</p>"
-
-    # Wait for the screen to change
-    await asyncio.sleep(1)
-    return await handle_parse_action(itsme_pin, driver.parse_any_screen, request)
+    # The action and reading the screen it leads to form one UI session
+    async with adb.current_device().scheduler.ui_session():
+        # The action parses the same (cached) screen again
+        try:
+            previous = await driver.parse_any_screen()
+        except driver.WrongScreenError:
+            previous = None
+        result = await call_with_request_kwargs(action, request)
+        if result is not None:
+            return f"<p>Result from action: {str(result)}</p>"
+
+        return await handle_parse_action(itsme_pin, next_screen_after(previous), request)
 
 
 async def poka_yoke_tap_image(request: Request):
@@ -0,0 +1,96 @@
+import json
+import logging
+from typing import Any, Awaitable, Callable
+from aiohttp import web
+from aiohttp.web import HTTPBadRequest, Request, get, post
+from itsme_adb import driver
+from ..device import high_level
+from ..jobs import JobFailedError, JobStore, JobStoreFullError
+from ..tasker import CallbackFutures
+from .aio_util import wrap_all
+from .exception_handling import with_exception_handling
+
+
+logger = logging.getLogger(__name__)
+
+# Reads what it needs from the request and returns the flow to run as a job
+JobFactory = Callable[[Request], Callable[[], Awaitable[Any]]]
+
+
+def required_query_value(request: Request, name: str) -> str:
+    value = request.query.get(name, "").strip()
+    if len(value) == 0:
+        raise HTTPBadRequest(
+            text=json.dumps({"error": f"Missing query parameter '{name}'"}),
+            content_type="application/json",
+        )
+    return value
+
+
+async def confirm_known_action_job(itsme_pin: str, app: str, action: str) -> dict[str, Any]:
+    """Like the `confirm-known-action` page, but fails the job unless the
+    action was confirmed, with the reason as the result"""
+    try:
+        message = await driver.confirm_app_action(itsme_pin, app, action)
+    except driver.ConfirmAppActionInteractionRequired as e:
+        raise JobFailedError(f"Interaction required: {e.reason}", {
+            "outcome": "interaction-required",
+            "reason": e.reason,
+            "screen": e.screen.__class__.__name__,
+        })
+    except driver.NoPendingActionsException:
+        raise JobFailedError("No pending actions", {"outcome": "no-pending-actions"})
+    except driver.UnexpectedPendingActionException as e:
+        raise JobFailedError("Unexpected pending action", {
+            "outcome": "unexpected-pending-action",
+            "pending": {"app": e.wrong_basic_info.app, "action": e.wrong_basic_info.action},
+            "expected": {"app": app, "action": action},
+        })
+    return {"outcome": "confirmed", "message": message}
+
+
+async def handle_start_job(job_store: JobStore, name: str, factory: JobFactory, request: Request):
+    fn = factory(request)
+    try:
+        job = job_store.start(name, fn)
+    except JobStoreFullError as e:
+        return web.json_response({"error": str(e)}, status=503)
+    # Next to the POST route, so it keeps any /devices/<serial> prefix
+    url = f"{request.path.rsplit('/', 1)[0]}/{job.id}"
+    logger.info(f"Started job {name} ({job.id})")
+    return web.json_response(
+        {"id": job.id, "url": url},
+        status=202,
+        headers={"Location": url},
+    )
+
+
+async def handle_get_job(job_store: JobStore, request: Request):
+    job = job_store.get(request.match_info["job_id"])
+    if job is None:
+        return web.json_response({"error": "Unknown or expired job"}, status=404)
+    return web.json_response(job.to_dict())
+
+
+def create_routes(job_store: JobStore, itsme_pin: str, tasker_callback_futures: CallbackFutures):
+    """`POST /jobs/<name>` starts a flow and answers with its job id right
+    away, `GET /jobs/<id>` returns its progress and, once done, its result"""
+    factories: dict[str, JobFactory] = {
+        "confirm-known-action": lambda request: (
+            lambda app=required_query_value(request, "app"), action=required_query_value(request, "action"):
+                confirm_known_action_job(itsme_pin, app, action)
+        ),
+        "ensure-ready-for-action": lambda _: (
+            lambda: high_level.ensure_ready_for_action(tasker_callback_futures)
+        ),
+        "adb-connect": lambda _: (
+            lambda: high_level.adb_pair_and_connect(tasker_callback_futures)
+        ),
+    }
+    return wrap_all([
+        *(
+            post(name, lambda request, name=name, factory=factory: handle_start_job(job_store, name, factory, request))
+            for name, factory in factories.items()
+        ),
+        get("{job_id}", lambda request: handle_get_job(job_store, request)),
+    ], with_exception_handling)
@@ -0,0 +1,82 @@
+import asyncio
+import html
+import logging
+from aiohttp import WSCloseCode
+from aiohttp.web import HTTPBadRequest, Request, WebSocketResponse
+from ..event_bus import EventBus, LogEvent
+
+
+# Log lines shown to a dashboard right after it connects
+WS_LOG_REPLAY = 200
+# Events are collected for this long after the first one, unless the batch
+# fills up before
+WS_BATCH_INTERVAL = 0.1
+WS_BATCH_MAX_EVENTS = 250
+# A client that can't take a batch within this time is disconnected
+WS_SEND_TIMEOUT = 5
+logger = logging.getLogger(__name__)
+
+
+def parse_level(request: Request) -> int:
+    name = request.query.get("level", "DEBUG").upper()
+    level = logging.getLevelName(name)
+    if not isinstance(level, int):
+        raise HTTPBadRequest(text=f"Unknown log level: {name}")
+    return level
+
+
+def render_batch(lines: list[str]) -> str:
+    """One HTMX out-of-band fragment appending all lines to the log"""
+    text = "\n".join(html.escape(line) for line in lines)
+    return f'<pre id="log" hx-swap-oob="beforeend">{text}\n</pre>'
+
+
+async def read_until_closed(ws: WebSocketResponse):
+    """Clients send nothing, but reading is how a close from their side (or a
+    dropped connection) is noticed"""
+    async for _ in ws:
+        pass
+
+
+async def handle_ws(event_bus: EventBus, request: Request):
+    """Stream the log to a dashboard in batches. `?level=INFO` hides (and
+    skips formatting) records below INFO."""
+    min_level = parse_level(request)
+    ws = WebSocketResponse(compress=True)
+    await ws.prepare(request)
+    receive_task = asyncio.create_task(read_until_closed(ws))
+    try:
+        with event_bus.subscribe(replay=WS_LOG_REPLAY, log_level=min_level) as subscription:
+            dropped = 0
+            while not ws.closed:
+                # Wait for at least one event, then let a batch build up
+                wait_task = asyncio.ensure_future(subscription.wait())
+                await asyncio.wait((wait_task, receive_task), return_when=asyncio.FIRST_COMPLETED)
+                if receive_task.done():
+                    wait_task.cancel()
+                    break
+                if subscription.backlog < WS_BATCH_MAX_EVENTS:
+                    await asyncio.sleep(WS_BATCH_INTERVAL)
+                events = subscription.take_ready(limit=WS_BATCH_MAX_EVENTS)
+                lines = [
+                    event.text if isinstance(event, LogEvent) else str(event)
+                    for event in events
+                    if not isinstance(event, LogEvent) or event.level >= min_level
+                ]
+                if subscription.dropped != dropped:
+                    lines.insert(0, f"[{subscription.dropped - dropped} log lines skipped]")
+                    dropped = subscription.dropped
+                if len(lines) == 0:
+                    continue
+                try:
+                    async with asyncio.timeout(WS_SEND_TIMEOUT):
+                        await ws.send_str(render_batch(lines))
+                except ConnectionResetError:
+                    break
+                except TimeoutError:
+                    logger.info("Disconnecting log WebSocket client that can't keep up")
+                    await ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=b"Too slow")
+                    break
+    finally:
+        receive_task.cancel()
+    return ws
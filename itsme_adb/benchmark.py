@@ -0,0 +1,221 @@
+"""Time the itsme driver offline, against the dumps in the fixture store.
+
+  python -m itsme_adb.benchmark [--iterations N] [--fixtures-dir DIR] [--compare-index]
+
+--compare-index times screen classification with the ScreenIndex against
+scanning the tree for every lookup and trying every parser in turn, which is
+how screens were classified before the index.
+"""
+
+import argparse
+import asyncio
+from dataclasses import dataclass
+import statistics
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from lxml import etree
+
+from droid_remote.device import adb
+from droid_remote.device.registry import parse_devices, registry
+from droid_remote.device.ui_dump import UiDumpParser
+from droid_remote.lxml_utils import elements_xpath
+from . import driver
+from .replay import (
+  FIXTURES_DIR, MultiDeviceReplayAdbBackend, ReplayAdbBackend, fixture_names, load_fixture, replaying,
+)
+
+
+CONFIRM_FLOW = ["home_pending", "action", "pinpad", "action_confirmed", "home_no_pending"]
+CONFIRM_FLOW_APP = "KBC"
+CONFIRM_FLOW_ACTION = "Log in"
+FIXTURE_PARSERS = {
+  "home_pending": driver.parse_home_screen,
+  "home_no_pending": driver.parse_home_screen,
+  "action": driver.parse_action_screen,
+  "poka_yoke": driver.parse_post_confirm_screen,
+  "pinpad": driver.parse_post_confirm_screen,
+  "action_expired": driver.parse_action_expired_screen,
+  "play_rating": driver.parse_play_rating_screen,
+  "action_confirmed": driver.parse_action_confirmed_screen,
+}
+
+
+@dataclass
+class Timing():
+  name: str
+  samples: list[float]
+
+  def __str__(self):
+    return (
+      f"{self.name:<55} min {min(self.samples) * 1000:9.3f} ms"
+      f"   median {statistics.median(self.samples) * 1000:9.3f} ms"
+    )
+
+
+async def time_async(name: str, fn: Callable[[], Awaitable], iterations: int):
+  samples = []
+  for _ in range(iterations):
+    start = time.perf_counter()
+    await fn()
+    samples.append(time.perf_counter() - start)
+  return Timing(name, samples)
+
+
+class ScanningScreenIndex(driver.ScreenIndex):
+  """Answers every lookup with an XPath scan over the whole tree instead of
+  from lookup tables"""
+
+  @classmethod
+  def from_hierarchy(cls, root: etree._Element):
+    nodes = elements_xpath(root, "//node")
+    text_nodes = elements_xpath(root, driver.TEXT_NODES_XPATH)
+    return cls(root, nodes, text_nodes, {}, {})
+
+  def with_text(self, text: str):
+    return elements_xpath(self.root, "//node[@text=$text]", text=text)
+
+  def has_text(self, text: str):
+    return len(self.with_text(text)) > 0
+
+  def with_text_prefix(self, prefix: str):
+    return elements_xpath(self.root, "//node[starts-with(@text, $prefix)]", prefix=prefix)
+
+  def with_resource_id(self, resource_id: str):
+    return elements_xpath(self.root, "//node[@resource-id=$resource_id]", resource_id=resource_id)
+
+  def with_resource_id_prefix(self, prefix: str):
+    return elements_xpath(self.root, "//node[starts-with(@resource-id, $prefix)]", prefix=prefix)
+
+
+async def parse_any_screen_without_index(hierarchy: etree._Element):
+  """Try every parser in turn, each scanning the tree on its own"""
+  for parser in driver.SCREEN_PARSERS:
+    try:
+      return await parser(index=ScanningScreenIndex.from_hierarchy(hierarchy))
+    except driver.WrongScreenError:
+      pass
+  raise driver.WrongScreenError("Unknown screen", hierarchy)
+
+
+def parse_dump(dump: bytes):
+  parser = UiDumpParser()
+  parser.feed(dump)
+  return parser.close()
+
+
+async def benchmark_parsers(fixtures_dir: Path, iterations: int):
+  timings = []
+  for name in fixture_names(fixtures_dir):
+    dump = load_fixture(name, fixtures_dir)
+    hierarchy = etree.fromstring(dump)
+
+    async def parse_dump_only(dump=dump):
+      parse_dump(dump)
+    timings.append(await time_async(f"dump parsing [{name}]", parse_dump_only, iterations))
+    timings.append(await time_async(
+      f"parse_any_screen [{name}]",
+      lambda hierarchy=hierarchy: driver.parse_any_screen(hierarchy),
+      iterations,
+    ))
+    parser = FIXTURE_PARSERS.get(name)
+    if parser is not None:
+      timings.append(await time_async(
+        f"{parser.__name__} [{name}]",
+        lambda parser=parser, hierarchy=hierarchy: parser(hierarchy),
+        iterations,
+      ))
+  return timings
+
+
+async def compare_index(fixtures_dir: Path, iterations: int):
+  lines = []
+  for name in fixture_names(fixtures_dir):
+    hierarchy = etree.fromstring(load_fixture(name, fixtures_dir))
+    with_index = await time_async(
+      f"parse_any_screen [{name}]",
+      lambda hierarchy=hierarchy: driver.parse_any_screen(hierarchy),
+      iterations,
+    )
+    without_index = await time_async(
+      f"without index [{name}]",
+      lambda hierarchy=hierarchy: parse_any_screen_without_index(hierarchy),
+      iterations,
+    )
+    speedup = statistics.median(without_index.samples) / statistics.median(with_index.samples)
+    lines += [str(without_index), str(with_index), f"  speedup with the index: {speedup:.1f}x"]
+  return lines
+
+
+async def benchmark_confirm_flow(fixtures_dir: Path, iterations: int):
+  samples = []
+  replay_backend = None
+  for _ in range(iterations):
+    replay_backend = ReplayAdbBackend.from_fixtures(CONFIRM_FLOW, fixtures_dir)
+    with replaying(replay_backend):
+      start = time.perf_counter()
+      await driver.confirm_app_action("0000", CONFIRM_FLOW_APP, CONFIRM_FLOW_ACTION)
+      samples.append(time.perf_counter() - start)
+  assert replay_backend is not None
+  return Timing("confirm_app_action (replayed)", samples), replay_backend
+
+
+async def benchmark_confirm_flow_on_devices(fixtures_dir: Path, device_count: int, iterations: int):
+  """The confirm flow on `device_count` replayed devices at once. Each device
+  has its own scheduler, so this should take about as long as on one."""
+  samples = []
+  for _ in range(iterations):
+    replay_backend = MultiDeviceReplayAdbBackend({
+      f"replay-{i}": ReplayAdbBackend.from_fixtures(CONFIRM_FLOW, fixtures_dir)
+      for i in range(device_count)
+    })
+
+    async def confirm_on(serial: str):
+      with adb.target(serial):
+        await driver.confirm_app_action("0000", CONFIRM_FLOW_APP, CONFIRM_FLOW_ACTION)
+
+    with replaying(replay_backend):
+      registry.update(parse_devices(await replay_backend.list_devices()))
+      try:
+        start = time.perf_counter()
+        await asyncio.gather(*(confirm_on(serial) for serial in replay_backend.devices))
+        samples.append(time.perf_counter() - start)
+      finally:
+        registry.update([])
+  return Timing(f"confirm_app_action on {device_count} devices (replayed)", samples)
+
+
+async def run_benchmarks(fixtures_dir: Path, iterations: int, compare: bool):
+  if compare:
+    for line in await compare_index(fixtures_dir, iterations):
+      print(line)
+    return
+  for timing in await benchmark_parsers(fixtures_dir, iterations):
+    print(timing)
+  confirm_timing, replay_backend = await benchmark_confirm_flow(fixtures_dir, max(1, iterations // 100))
+  print(confirm_timing)
+  print(
+    f"  last run: {replay_backend.dump_count} screen dumps,"
+    f" {len(replay_backend.scripts)} input scripts, {len(replay_backend.taps)} taps"
+  )
+  flow_iterations = max(1, iterations // 100)
+  one_device = await benchmark_confirm_flow_on_devices(fixtures_dir, 1, flow_iterations)
+  two_devices = await benchmark_confirm_flow_on_devices(fixtures_dir, 2, flow_iterations)
+  print(one_device)
+  print(two_devices)
+  ratio = statistics.median(two_devices.samples) / statistics.median(one_device.samples)
+  print(f"  two devices take {ratio:.2f}x as long as one")
+
+
+def main():
+  parser = argparse.ArgumentParser(prog="python -m itsme_adb.benchmark", description=__doc__)
+  parser.add_argument("--iterations", type=int, default=200)
+  parser.add_argument("--fixtures-dir", type=Path, default=FIXTURES_DIR)
+  parser.add_argument("--compare-index", action="store_true", help="Compare screen classification with and without ScreenIndex")
+  args = parser.parse_args()
+  asyncio.run(run_benchmarks(args.fixtures_dir, args.iterations, args.compare_index))
+
+
+if __name__ == "__main__":
+  main()
@@ -1,16 +1,32 @@
-import asyncio
+from collections import defaultdict
 from enum import Enum
 from functools import cached_property
 import logging
+import time
 from typing import Optional
 from dataclasses import dataclass, field
 from lxml import etree
 
 from droid_remote.lxml_utils import attrib_or_error, element_to_string, elements_xpath
 from droid_remote.device import adb
+from droid_remote.jobs import report_progress
+from droid_remote.metrics import ITSME_CONFIRM_DURATION, ITSME_CONFIRM_STEP_DURATION, ITSME_PARSER_DURATION, measure
 
 
 ITSME_PACKAGE_NAME = "be.bmid.itsme"
+NO_PENDING_ACTIONS = "No pending actions"
+TAP_THE_CARD_TO_OPEN = "Tap the card to open"
+SHARED_ID_DATA = "Shared ID data"
+POKA_YOKE_INSTRUCTION = "Check and tap the icon to continue."
+PIN_ENTRY_INSTRUCTION = "Confirm with your itsme code"
+ACTION_HAS_EXPIRED = "Action has expired"
+PLAY_RATING_DISCLAIMER_PREFIX = "Reviews are public and include your account and device info."
+NOT_NOW = "Not now"
+# Keys for adb's screen cache
+SCREEN_INDEX_CACHE_KEY = "itsme_screen_index"
+PARSED_SCREEN_CACHE_KEY = "itsme_screen"
+TEXT_NODES_XPATH = ".//node[@text!='']"
+BUTTON_LABEL_XPATH = "//node[node[@class='android.widget.Button']]/node[@text=$text]"
 logger = logging.getLogger(__name__)
 
 
@@ -35,6 +51,72 @@ def one_or_none(iterable):
   raise ValueError("More than one element")
 
 
+@dataclass
+class ScreenIndex():
+  """Lookup tables over a screen hierarchy, built in a single pass so parsers
+  don't each have to scan the whole tree for every text they look for."""
+
+  root: etree._Element
+  nodes: list[etree._Element]
+  text_nodes: list[etree._Element]
+  """Nodes with a non-empty text, in document order"""
+  nodes_by_text: dict[str, list[etree._Element]]
+  nodes_by_resource_id: dict[str, list[etree._Element]]
+
+  @classmethod
+  def from_hierarchy(cls, root: etree._Element):
+    nodes = []
+    text_nodes = []
+    nodes_by_text = defaultdict(list)
+    nodes_by_resource_id = defaultdict(list)
+    for node in root.iter("node"):
+      nodes.append(node)
+      text = node.get("text")
+      if text:
+        text_nodes.append(node)
+        nodes_by_text[text].append(node)
+      resource_id = node.get("resource-id")
+      if resource_id:
+        nodes_by_resource_id[resource_id].append(node)
+    return cls(root, nodes, text_nodes, dict(nodes_by_text), dict(nodes_by_resource_id))
+
+  def with_text(self, text: str) -> list[etree._Element]:
+    return self.nodes_by_text.get(text, [])
+
+  def has_text(self, text: str):
+    return text in self.nodes_by_text
+
+  def with_text_prefix(self, prefix: str) -> list[etree._Element]:
+    return [node for node in self.text_nodes if node.get("text", "").startswith(prefix)]
+
+  def with_resource_id(self, resource_id: str) -> list[etree._Element]:
+    return self.nodes_by_resource_id.get(resource_id, [])
+
+  def with_resource_id_prefix(self, prefix: str) -> list[etree._Element]:
+    return [
+      node for resource_id, nodes in self.nodes_by_resource_id.items()
+      if resource_id.startswith(prefix)
+      for node in nodes
+    ]
+
+
+async def get_screen_index(
+  screen: Optional[etree._Element] = None,
+  index: Optional[ScreenIndex] = None,
+):
+  if index is not None:
+    return index
+  if screen is None:
+    screen = await adb.read_screen_hierarchy()
+  cached = adb.get_cached_screen(screen)
+  if cached is not None and SCREEN_INDEX_CACHE_KEY in cached.derived:
+    return cached.derived[SCREEN_INDEX_CACHE_KEY]
+  index = ScreenIndex.from_hierarchy(screen)
+  if cached is not None:
+    cached.derived[SCREEN_INDEX_CACHE_KEY] = index
+  return index
+
+
 async def launch():
   await adb.launch_app(ITSME_PACKAGE_NAME)
 
@@ -51,7 +133,7 @@ class ActionBasicInfo():
 
 
 def parse_basic_info(container: etree._Element):
-  card_texts = elements_xpath(container, ".//node[@text!='']")
+  card_texts = elements_xpath(container, TEXT_NODES_XPATH)
   action, app, time = [attrib_or_error(text, "text") for text in card_texts]
   return ActionBasicInfo(action, app, time)
 
@@ -71,15 +153,18 @@ class PendingActionsHomeScreen():
     return await adb.tap(self.card_center)
 
 
-async def parse_home_screen(screen: Optional[etree._Element] = None):
-  if screen is None:
-    screen = await adb.read_screen_hierarchy()
-  no_pending_actions_node = one_or_none(elements_xpath(screen, "//node[@text='No pending actions']"))
-  tap_the_card_text = one_or_none(elements_xpath(screen, "//node[@text='Tap the card to open']"))
+async def parse_home_screen(
+  screen: Optional[etree._Element] = None,
+  index: Optional[ScreenIndex] = None,
+):
+  index = await get_screen_index(screen, index)
+  screen = index.root
+  no_pending_actions_node = one_or_none(index.with_text(NO_PENDING_ACTIONS))
+  tap_the_card_text = one_or_none(index.with_text(TAP_THE_CARD_TO_OPEN))
   if no_pending_actions_node is None and tap_the_card_text is None:
-    raise WrongScreenError("Neither 'No pending actions' nor 'Tap the card to open' found", screen)
+    raise WrongScreenError(f"Neither '{NO_PENDING_ACTIONS}' nor '{TAP_THE_CARD_TO_OPEN}' found", screen)
   if no_pending_actions_node is not None and tap_the_card_text is not None:
-    raise WrongScreenError("Both 'No pending actions' and 'Tap the card to open' found", screen)
+    raise WrongScreenError(f"Both '{NO_PENDING_ACTIONS}' and '{TAP_THE_CARD_TO_OPEN}' found", screen)
   
   if no_pending_actions_node is not None:
     return NoPendingActionsHomeScreen()
@@ -127,46 +212,46 @@ class ActionScreen():
     return await adb.tap(self.reject_button_center)
 
 
-SHARED_ID_DATA = "Shared ID data"
-
+async def parse_action_screen(
+  screen: Optional[etree._Element] = None,
+  index: Optional[ScreenIndex] = None,
+):
+  index = await get_screen_index(screen, index)
+  screen = index.root
 
-async def parse_action_screen(screen: Optional[etree._Element] = None):
-  if screen is None:
-    screen = await adb.read_screen_hierarchy()
-  
-  shared_id_data = one_or_none(elements_xpath(screen, f"//node[@text='{SHARED_ID_DATA}']"))
+  shared_id_data = one_or_none(index.with_text(SHARED_ID_DATA))
   if shared_id_data is None:
     raise WrongScreenError(f"'{SHARED_ID_DATA}' not found", screen)
   
-  shared_data_texts = shared_id_data.getparent().xpath(".//node[@text!='']")
+  shared_data_texts = elements_xpath(shared_id_data.getparent(), TEXT_NODES_XPATH)
   shared_data = [text.attrib["text"] for text in shared_data_texts]
   shared_data = [shared_data for shared_data in shared_data if shared_data != SHARED_ID_DATA]
 
-  first_text = first(elements_xpath(screen, "//node[@text!='']"))
+  first_text = first(index.text_nodes)
   basic_info_card = first_text.getparent()
   basic_info = parse_basic_info(basic_info_card)
 
   # Optionally provided by the requester app
-  extra_info_e = one_or_none(elements_xpath(screen, "//node[@text='Info']"))
+  extra_info_e = one_or_none(index.with_text("Info"))
   if extra_info_e is not None:
-    extra_info_text_es = extra_info_e.getnext().xpath(".//node[@text!='']")
+    extra_info_text_es = elements_xpath(extra_info_e.getnext(), TEXT_NODES_XPATH)
     extra_info = [text.attrib["text"] for text in extra_info_text_es]
   else:
     extra_info = []
 
-  details_e = one_or_none(elements_xpath(screen, "//node[@text='Details']"))
+  details_e = one_or_none(index.with_text("Details"))
   if details_e is not None:
-    details_text_es = details_e.getnext().xpath(".//node[@text!='']")
+    details_text_es = elements_xpath(details_e.getnext(), TEXT_NODES_XPATH)
     details = [text.attrib["text"] for text in details_text_es]
   else:
     details = []
 
-  confirm_button = one_or_none(elements_xpath(screen, "//node[node[@class='android.widget.Button']]/node[@text='Confirm']"))
+  confirm_button = one_or_none(elements_xpath(screen, BUTTON_LABEL_XPATH, text="Confirm"))
   if confirm_button is None:
     raise WrongScreenError("'Confirm' button not found", screen)
   confirm_button_center = adb.element_to_bounds(confirm_button).center
 
-  reject_button = one_or_none(elements_xpath(screen, "//node[node[@class='android.widget.Button']]/node[@text='Reject']"))
+  reject_button = one_or_none(elements_xpath(screen, BUTTON_LABEL_XPATH, text="Reject"))
   if reject_button is None:
     raise WrongScreenError("'Reject' button not found", screen)
   reject_button_center = adb.element_to_bounds(reject_button).center
@@ -218,6 +303,7 @@ PINPAD_LAYOUT = [
 # Size of the gaps as a ratio of the symbol width. Stays the same regardless of
 # the device screen size.
 PINPAD_GAP_RATIO = 0.5
+PINPAD_TAP_INTERVAL = 0.05
 
 
 @dataclass
@@ -253,28 +339,30 @@ class PinpadScreen():
 
   async def enter_pin(self, pin: str):
     symbols = pin + ">"
-    for symbol in symbols:
-      await self.tap_symbol(symbol)
-      await asyncio.sleep(0.05)
+    symbol_centers = [self.get_symbol_center(symbol) for symbol in symbols]
+    return await adb.tap_sequence(symbol_centers, PINPAD_TAP_INTERVAL)
 
   async def tap_symbol(self, symbol: str):
     symbol_center = self.get_symbol_center(symbol)
     return await adb.tap(symbol_center)
 
 
-async def parse_post_confirm_screen(screen: Optional[etree._Element] = None):
-  if screen is None:
-    screen = await adb.read_screen_hierarchy()
-  poka_yoke_text = one_or_none(elements_xpath(screen, "//node[@text='Check and tap the icon to continue.']"))
-  pin_entry_text = one_or_none(elements_xpath(screen, "//node[@text='Confirm with your itsme code']"))
+async def parse_post_confirm_screen(
+  screen: Optional[etree._Element] = None,
+  index: Optional[ScreenIndex] = None,
+):
+  index = await get_screen_index(screen, index)
+  screen = index.root
+  poka_yoke_text = one_or_none(index.with_text(POKA_YOKE_INSTRUCTION))
+  pin_entry_text = one_or_none(index.with_text(PIN_ENTRY_INSTRUCTION))
   if poka_yoke_text is None and pin_entry_text is None:
-    raise WrongScreenError("Neither 'Check and tap the icon to continue.' nor 'Confirm with your itsme code' found", screen)
+    raise WrongScreenError(f"Neither '{POKA_YOKE_INSTRUCTION}' nor '{PIN_ENTRY_INSTRUCTION}' found", screen)
   if poka_yoke_text is not None and pin_entry_text is not None:
-    raise WrongScreenError("Both 'Check and tap the icon to continue.' and 'Confirm with your itsme code' found", screen)
+    raise WrongScreenError(f"Both '{POKA_YOKE_INSTRUCTION}' and '{PIN_ENTRY_INSTRUCTION}' found", screen)
   
   if poka_yoke_text is not None:
     # resource id like "image_23"
-    image_nodes = elements_xpath(screen, "//node[starts-with(@resource-id, 'image_')]")
+    image_nodes = index.with_resource_id_prefix("image_")
     images = [
       PokaYokeImage(
         int(attrib_or_error(image, "resource-id").removeprefix("image_")),
@@ -284,7 +372,7 @@ async def parse_post_confirm_screen(screen: Optional[etree._Element] = None):
     ]
     return PokaYokeScreen(images)
   
-  pinpad_node = one_or_none(elements_xpath(screen, "//node[@resource-id='pinpad']"))
+  pinpad_node = one_or_none(index.with_resource_id("pinpad"))
   if pinpad_node is None:
     raise WrongScreenError("pinpad not found", screen)
   # The image pinpad has a fixed aspect ratio of 3:4
@@ -325,13 +413,16 @@ class ActionExpiredScreen():
     return await adb.tap(self.ok_button_center)
 
 
-async def parse_action_expired_screen(screen: Optional[etree._Element] = None):
-  if screen is None:
-    screen = await adb.read_screen_hierarchy()
-  action_expired_text = one_or_none(elements_xpath(screen, "//node[@text='Action has expired']"))
-  ok_button = one_or_none(elements_xpath(screen, "//node[@text='OK']"))
+async def parse_action_expired_screen(
+  screen: Optional[etree._Element] = None,
+  index: Optional[ScreenIndex] = None,
+):
+  index = await get_screen_index(screen, index)
+  screen = index.root
+  action_expired_text = one_or_none(index.with_text(ACTION_HAS_EXPIRED))
+  ok_button = one_or_none(index.with_text("OK"))
   if action_expired_text is None or ok_button is None:
-    raise WrongScreenError("'Action has expired' or 'OK' button not found", screen)
+    raise WrongScreenError(f"'{ACTION_HAS_EXPIRED}' or 'OK' button not found", screen)
   
   return ActionExpiredScreen(adb.element_to_bounds(ok_button).center)
 
@@ -349,13 +440,16 @@ class PlayRatingScreen():
     return await adb.tap(self.not_now_button_center)
 
 
-async def parse_play_rating_screen(screen: Optional[etree._Element] = None):
-  if screen is None:
-    screen = await adb.read_screen_hierarchy()
-  disclaimer_text = one_or_none(elements_xpath(screen, "//node[starts-with(@text, 'Reviews are public and include your account and device info.')]"))
-  not_now_button = one_or_none(elements_xpath(screen, "//node[@text='Not now']"))
+async def parse_play_rating_screen(
+  screen: Optional[etree._Element] = None,
+  index: Optional[ScreenIndex] = None,
+):
+  index = await get_screen_index(screen, index)
+  screen = index.root
+  disclaimer_text = one_or_none(index.with_text_prefix(PLAY_RATING_DISCLAIMER_PREFIX))
+  not_now_button = one_or_none(index.with_text(NOT_NOW))
   if disclaimer_text is None or not_now_button is None:
-    raise WrongScreenError("Disclaimer or 'Not now' button not found", screen)
+    raise WrongScreenError(f"Disclaimer or '{NOT_NOW}' button not found", screen)
 
   return PlayRatingScreen(adb.element_to_bounds(not_now_button).center)
 
@@ -370,14 +464,16 @@ class ActionConfirmedScreen():
   pass
 
 
-async def parse_action_confirmed_screen(screen: Optional[etree._Element] = None):
+async def parse_action_confirmed_screen(
+  screen: Optional[etree._Element] = None,
+  index: Optional[ScreenIndex] = None,
+):
   # The screen after confirming an action is a sole checkmark on a green background
-  if screen is None:
-    screen = await adb.read_screen_hierarchy()
-  texts = elements_xpath(screen, "//node[@text!='']")
-  if len(texts) != 0:
+  index = await get_screen_index(screen, index)
+  screen = index.root
+  if len(index.text_nodes) != 0:
     raise WrongScreenError("The action confirmed screen has no text", screen)
-  nodes = elements_xpath(screen, "//node")
+  nodes = index.nodes
   surface_areas = [adb.element_to_bounds(node).surface_area for node in nodes]
   smallest_surface_area = min(surface_areas)
   activity_surface_area = max(surface_areas)
@@ -389,29 +485,111 @@ async def parse_action_confirmed_screen(screen: Optional[etree._Element] = None)
 Screen = NoPendingActionsHomeScreen | PendingActionsHomeScreen | ActionScreen | PokaYokeScreen | PinpadScreen | ActionExpiredScreen | PlayRatingScreen | ActionConfirmedScreen
 
 
-async def parse_any_screen(screen: Optional[etree._Element] = None) -> Screen:
-  if screen is None:
+SCREEN_PARSERS = [
+  parse_home_screen, parse_action_screen, parse_post_confirm_screen,
+  parse_action_expired_screen, parse_play_rating_screen,
+  parse_action_confirmed_screen
+]
+
+
+def classify_screen(index: ScreenIndex):
+  """Parsers whose screen's marker texts are present, in the order of
+  SCREEN_PARSERS. Usually zero or one."""
+  candidates = []
+  if index.has_text(NO_PENDING_ACTIONS) or index.has_text(TAP_THE_CARD_TO_OPEN):
+    candidates.append(parse_home_screen)
+  if index.has_text(SHARED_ID_DATA):
+    candidates.append(parse_action_screen)
+  if index.has_text(POKA_YOKE_INSTRUCTION) or index.has_text(PIN_ENTRY_INSTRUCTION):
+    candidates.append(parse_post_confirm_screen)
+  if index.has_text(ACTION_HAS_EXPIRED) and index.has_text("OK"):
+    candidates.append(parse_action_expired_screen)
+  if index.has_text(NOT_NOW) and len(index.with_text_prefix(PLAY_RATING_DISCLAIMER_PREFIX)) > 0:
+    candidates.append(parse_play_rating_screen)
+  if len(index.text_nodes) == 0 and len(index.nodes) > 0:
+    candidates.append(parse_action_confirmed_screen)
+  return candidates
+
+
+async def parse_any_screen(
+  screen: Optional[etree._Element] = None,
+  index: Optional[ScreenIndex] = None,
+) -> Screen:
+  if screen is None and index is None:
     screen = await adb.read_screen_hierarchy()
-  parsers = [
-    parse_home_screen, parse_action_screen, parse_post_confirm_screen,
-    parse_action_expired_screen, parse_play_rating_screen,
-    parse_action_confirmed_screen
-  ]
+  with measure(ITSME_PARSER_DURATION, parser=classify_screen.__name__):
+    index = await get_screen_index(screen, index)
+    screen = index.root
+    cached = adb.get_cached_screen(screen)
+    if cached is not None and PARSED_SCREEN_CACHE_KEY in cached.derived:
+      return cached.derived[PARSED_SCREEN_CACHE_KEY]
+    parsers = classify_screen(index)
   parsers_tried = {}
   for parser in parsers:
     try:
-      return await parser(screen)
+      with measure(ITSME_PARSER_DURATION, parser=parser.__name__):
+        parsed = await parser(index=index)
+      if cached is not None:
+        cached.derived[PARSED_SCREEN_CACHE_KEY] = parsed
+      return parsed
     except WrongScreenError as e:
       parsers_tried[parser.__name__] = e
       pass
-  top_level_node = first(elements_xpath(screen, "/hierarchy/node"))
-  top_level_package = top_level_node.attrib["package"]
+  top_level_node = first(index.nodes)
+  top_level_package = top_level_node.attrib["package"] if top_level_node is not None else None
   if top_level_package == ITSME_PACKAGE_NAME:
-    raise WrongScreenError(f"Unknown screen (none of {[parser.__name__ for parser in parsers]} matched)", screen, parsers_tried)
+    raise WrongScreenError(f"Unknown screen (none of {[parser.__name__ for parser in SCREEN_PARSERS]} matched)", screen, parsers_tried)
 
   raise WrongScreenError(f"Unknown screen (no parsers matched). Top level package: {top_level_package} (expected {ITSME_PACKAGE_NAME})", screen)
 
 
+# Screens that an input event can turn into an equal one of the same type,
+# so that only their dump tells them apart. None of the flows tap one yet.
+SCREENS_CHANGING_IN_PLACE: tuple[type, ...] = ()
+
+
+@dataclass
+class ScreenDidNotChangeError(Exception):
+  screen: Screen
+
+
+def is_next_screen(previous: Optional[Screen], screen: Screen):
+  """Whether `screen` is another screen than `previous`. A dump that merely
+  differs in a few bytes, e.g. a pressed button or a running animation, is
+  still the same screen."""
+  if previous is None or type(screen) is not type(previous) or screen != previous:
+    return True
+  return isinstance(screen, SCREENS_CHANGING_IN_PLACE)
+
+
+async def wait_for_next_screen(
+  previous: Optional[Screen] = None,
+  timeout: float = adb.SCREEN_CHANGE_TIMEOUT,
+) -> Screen:
+  """Wait until the screen has changed into one that can be parsed, e.g.
+  after tapping a button on `previous`, and return it. Raises
+  ScreenDidNotChangeError if it's still `previous` after `timeout`."""
+  parsed: Optional[tuple[etree._Element, Screen]] = None
+
+  async def is_next(hierarchy: etree._Element):
+    nonlocal parsed
+    try:
+      parsed = (hierarchy, await parse_any_screen(hierarchy))
+    except WrongScreenError:
+      # Probably still transitioning
+      return False
+    return is_next_screen(previous, parsed[1])
+
+  hierarchy = await adb.wait_for_screen_change(is_next, timeout)
+  if parsed is not None and parsed[0] is hierarchy:
+    screen = parsed[1]
+  else:
+    screen = await parse_any_screen(hierarchy)
+  if not is_next_screen(previous, screen):
+    raise ScreenDidNotChangeError(screen)
+  return screen
+
+
 class ConfirmStep(Enum):
   TAP_CARD = 1
   CONFIRM = 2
@@ -442,8 +620,10 @@ async def confirm_app_action_step(
   app_name: str,
   action: str,
   last_completed_step: ConfirmStep,
+  screen: Optional[Screen] = None,
 ) -> ConfirmStep:
-  screen = await parse_any_screen()
+  if screen is None:
+    screen = await parse_any_screen()
   if isinstance(screen, NoPendingActionsHomeScreen):
     logger.debug("No pending actions")
     if last_completed_step.value < ConfirmStep.PIN.value:
@@ -474,12 +654,33 @@ async def confirm_app_action_step(
   raise Exception(f"Unknown screen type: {type(screen)}")
 
 
-async def confirm_app_action(pin: str, app_name: str, action: str, max_tries: int = 3) -> str:
+async def confirm_app_action_steps(pin: str, app_name: str, action: str, max_tries: int) -> str:
   for _ in range(max_tries):
     last_completed_step = ConfirmStep.TAP_CARD
+    screen = await parse_any_screen()
     while True:
-      last_completed_step = await confirm_app_action_step(pin, app_name, action, last_completed_step)
+      report_progress(f"Screen: {type(screen).__name__}")
+      step_start = time.perf_counter()
+      last_completed_step = await confirm_app_action_step(pin, app_name, action, last_completed_step, screen)
+      report_progress(f"Step: {last_completed_step.name}")
+      if last_completed_step != ConfirmStep.DONE:
+        screen = await wait_for_next_screen(screen)
+      ITSME_CONFIRM_STEP_DURATION.labels(step=last_completed_step.name).observe(time.perf_counter() - step_start)
       if last_completed_step == ConfirmStep.DONE:
         return f"Confirmed app action {app_name}: {action}"
   
   raise Exception(f"Failed to confirm action after {max_tries} tries")
+
+
+async def confirm_app_action(pin: str, app_name: str, action: str, max_tries: int = 3) -> str:
+  start = time.perf_counter()
+  outcome = "confirmed"
+  try:
+    # Keep other requests from tapping or dumping in between our steps
+    async with adb.current_device().scheduler.ui_session():
+      return await confirm_app_action_steps(pin, app_name, action, max_tries)
+  except BaseException as e:
+    outcome = e.__class__.__name__
+    raise
+  finally:
+    ITSME_CONFIRM_DURATION.labels(outcome=outcome).observe(time.perf_counter() - start)
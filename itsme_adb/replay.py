@@ -0,0 +1,196 @@
+"""Record screen dumps from a device and replay them without one.
+
+Record (press enter for every screen to capture):
+  python -m itsme_adb.replay record <directory>
+"""
+
+import asyncio
+from contextlib import contextmanager
+import re
+import sys
+from pathlib import Path
+from typing import AsyncIterator, Optional, Sequence
+
+from droid_remote.device import adb
+from droid_remote.device.adb_backend import AdbBackend
+from droid_remote.device.ui_dump import UI_DUMP_TRAILER
+
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+# A pending action, confirmed when driven through it
+REPLAY_DEVICE_FIXTURES = ["home_pending", "action", "pinpad", "action_confirmed", "home_no_pending"]
+TAP_PATTERN = re.compile(r"input tap (\S+) (\S+)")
+
+
+def fixture_names(fixtures_dir: Path = FIXTURES_DIR):
+  return sorted(path.stem for path in fixtures_dir.glob("*.xml"))
+
+
+def load_fixture(name: str, fixtures_dir: Path = FIXTURES_DIR) -> bytes:
+  return (fixtures_dir / f"{name}.xml").read_bytes()
+
+
+class ReplayAdbBackend:
+  """Serves the given dumps in order, moving on to the next one after every
+  input script (tap, key event, app launch...). The last dump is repeated
+  once the sequence is exhausted. Input scripts and taps are recorded."""
+
+  def __init__(self, dumps: list[bytes]):
+    if len(dumps) == 0:
+      raise ValueError("Need at least one dump to replay")
+    self.dumps = dumps
+    self.position = 0
+    self.scripts: list[str] = []
+    self.taps: list[tuple[float, float]] = []
+    self.dump_count = 0
+
+  @classmethod
+  def from_fixtures(cls, names: list[str], fixtures_dir: Path = FIXTURES_DIR):
+    return cls([load_fixture(name, fixtures_dir) for name in names])
+
+  async def list_devices(self):
+    return "replay\tdevice product:replay model:replay device:replay"
+
+  async def track_devices(self) -> AsyncIterator[str]:
+    yield await self.list_devices()
+    await asyncio.Future()
+
+  async def connect(self, adb_host: str):
+    return f"connected to {adb_host}"
+
+  async def disconnect(self):
+    return "disconnected everything"
+
+  async def reboot(self, serial: Optional[str] = None):
+    return ""
+
+  async def shell(self, script: str, serial: Optional[str] = None):
+    self.scripts.append(script)
+    taps = [(float(x), float(y)) for x, y in TAP_PATTERN.findall(script)]
+    self.taps.extend(taps)
+    if len(taps) > 0 or script.startswith(("input ", "monkey ", "am ")):
+      self.position = min(self.position + 1, len(self.dumps) - 1)
+    return 0, ""
+
+  async def stream_exec_out(self, *args: str, serial: Optional[str] = None) -> AsyncIterator[bytes]:
+    if args != adb.UI_DUMP_COMMAND:
+      raise ValueError(f"Replay backend can only dump the screen, not run {args}")
+    self.dump_count += 1
+    dump = self.dumps[self.position]
+    yield dump
+    if UI_DUMP_TRAILER not in dump:
+      yield UI_DUMP_TRAILER + b": /dev/tty\n"
+
+
+class MultiDeviceReplayAdbBackend:
+  """One ReplayAdbBackend per serial, each a device of its own"""
+
+  def __init__(self, devices: dict[str, ReplayAdbBackend]):
+    self.devices = devices
+
+  def device(self, serial: Optional[str]) -> ReplayAdbBackend:
+    if serial is not None:
+      return self.devices[serial]
+    # Like adb without -s
+    if len(self.devices) != 1:
+      raise ValueError("Calls to several replayed devices need a serial")
+    return next(iter(self.devices.values()))
+
+  async def list_devices(self):
+    return "\n".join(f"{serial}\tdevice product:replay model:replay device:replay" for serial in self.devices)
+
+  async def track_devices(self) -> AsyncIterator[str]:
+    yield await self.list_devices()
+    await asyncio.Future()
+
+  async def connect(self, adb_host: str):
+    return f"connected to {adb_host}"
+
+  async def disconnect(self):
+    return "disconnected everything"
+
+  async def reboot(self, serial: Optional[str] = None):
+    return await self.device(serial).reboot(serial)
+
+  async def shell(self, script: str, serial: Optional[str] = None):
+    return await self.device(serial).shell(script, serial)
+
+  def stream_exec_out(self, *args: str, serial: Optional[str] = None) -> AsyncIterator[bytes]:
+    return self.device(serial).stream_exec_out(*args, serial=serial)
+
+
+def replay_devices(serials: Sequence[str], names: list[str] = REPLAY_DEVICE_FIXTURES):
+  """The "replay" adb backend of the server: each device replays `names`"""
+  return MultiDeviceReplayAdbBackend({serial: ReplayAdbBackend.from_fixtures(names) for serial in serials})
+
+
+@contextmanager
+def replaying(replay_backend: AdbBackend):
+  """Route all adb calls to `replay_backend` for the duration of the block"""
+  previous_backend = adb.backend
+  adb.install_backend(replay_backend)
+  try:
+    yield replay_backend
+  finally:
+    adb.install_backend(previous_backend)
+
+
+class RecordingAdbBackend:
+  """Passes everything through to `inner` and saves every screen dump into
+  `directory`, numbered in the order they were taken."""
+
+  def __init__(self, inner: AdbBackend, directory: Path):
+    self.inner = inner
+    self.directory = directory
+    self.directory.mkdir(parents=True, exist_ok=True)
+    self.count = len(list(directory.glob("*.xml")))
+
+  async def list_devices(self):
+    return await self.inner.list_devices()
+
+  def track_devices(self):
+    return self.inner.track_devices()
+
+  async def connect(self, adb_host: str):
+    return await self.inner.connect(adb_host)
+
+  async def disconnect(self):
+    return await self.inner.disconnect()
+
+  async def reboot(self, serial: Optional[str] = None):
+    return await self.inner.reboot(serial)
+
+  async def shell(self, script: str, serial: Optional[str] = None):
+    return await self.inner.shell(script, serial)
+
+  async def stream_exec_out(self, *args: str, serial: Optional[str] = None) -> AsyncIterator[bytes]:
+    chunks: list[bytes] = []
+    async for chunk in self.inner.stream_exec_out(*args, serial=serial):
+      chunks.append(chunk)
+      yield chunk
+    if args == adb.UI_DUMP_COMMAND:
+      dump = b"".join(chunks)
+      trailer_i = dump.find(UI_DUMP_TRAILER)
+      if trailer_i != -1:
+        dump = dump[:trailer_i]
+      self.count += 1
+      path = self.directory / f"{self.count:03}.xml"
+      path.write_bytes(dump)
+
+
+async def record_interactively(directory: Path):
+  recorder = RecordingAdbBackend(adb.backend, directory)
+  with replaying(recorder):
+    while True:
+      line = await asyncio.to_thread(input, "Press enter to capture the screen (q to quit): ")
+      if line.strip() == "q":
+        return
+      await adb.read_screen_hierarchy_with_digest()
+      print(f"Saved {directory / f'{recorder.count:03}.xml'}")
+
+
+if __name__ == "__main__":
+  if len(sys.argv) != 3 or sys.argv[1] != "record":
+    print(__doc__, file=sys.stderr)
+    sys.exit(1)
+  asyncio.run(record_interactively(Path(sys.argv[2])))
@@ -0,0 +1,96 @@
+"""A fake adb server speaking just enough of the host protocol for the socket
+backend: `host:` queries, device transports, `exec:`, v2 `shell:` and
+`host:track-devices-l`."""
+
+import asyncio
+from contextlib import asynccontextmanager
+import struct
+from typing import Callable
+
+from droid_remote.device import adb_protocol
+
+
+# Device command -> stdout, stderr, exit status
+ShellHandler = Callable[[str], tuple[bytes, bytes, int]]
+
+
+def hex_prefixed(payload: bytes):
+    return f"{len(payload):04x}".encode() + payload
+
+
+class FakeAdbServer:
+    def __init__(self, devices: list[str], shell_handler: ShellHandler):
+        self.devices = devices
+        self.shell_handler = shell_handler
+        self.requests: list[str] = []
+        """Every request received, in order"""
+        self._trackers: list[asyncio.StreamWriter] = []
+
+    def device_list(self):
+        return "".join(f"{serial}\tdevice\n" for serial in self.devices).encode()
+
+    async def set_devices(self, devices: list[str]):
+        self.devices = devices
+        for writer in self._trackers:
+            writer.write(hex_prefixed(self.device_list()))
+            await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        serial = None
+        try:
+            while True:
+                length = int(await reader.readexactly(4), 16)
+                request = (await reader.readexactly(length)).decode()
+                self.requests.append(request)
+                if request == "host:devices-l":
+                    writer.write(b"OKAY" + hex_prefixed(self.device_list()))
+                elif request == "host:track-devices-l":
+                    writer.write(b"OKAY" + hex_prefixed(self.device_list()))
+                    self._trackers.append(writer)
+                elif request == "host:transport-any" and len(self.devices) == 1:
+                    serial = self.devices[0]
+                    writer.write(b"OKAY")
+                    continue
+                elif request.startswith("host:transport:") and request.removeprefix("host:transport:") in self.devices:
+                    serial = request.removeprefix("host:transport:")
+                    writer.write(b"OKAY")
+                    continue
+                elif request.startswith("host:transport"):
+                    writer.write(b"FAIL" + hex_prefixed(b"device not found"))
+                elif serial is not None and request.startswith("exec:"):
+                    stdout, _, _ = self.shell_handler(request.removeprefix("exec:"))
+                    writer.write(b"OKAY")
+                    # In pieces, like a dump arriving over USB
+                    for i in range(0, len(stdout), 7):
+                        writer.write(stdout[i:i + 7])
+                        await writer.drain()
+                elif serial is not None and request.startswith("shell,v2,raw:"):
+                    stdout, stderr, status = self.shell_handler(request.removeprefix("shell,v2,raw:"))
+                    writer.write(b"OKAY")
+                    writer.write(struct.pack("<BI", adb_protocol.SHELL_ID_STDOUT, len(stdout)) + stdout)
+                    writer.write(struct.pack("<BI", adb_protocol.SHELL_ID_STDERR, len(stderr)) + stderr)
+                    writer.write(struct.pack("<BI", adb_protocol.SHELL_ID_EXIT, 1) + bytes([status]))
+                else:
+                    writer.write(b"FAIL" + hex_prefixed(f"unknown service {request}".encode()))
+                await writer.drain()
+                if writer not in self._trackers:
+                    break
+                # Trackers stay open until the client goes away
+                await reader.read()
+                break
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            if writer in self._trackers:
+                self._trackers.remove(writer)
+            writer.close()
+
+
+@asynccontextmanager
+async def fake_adb_server(monkeypatch, devices: list[str], shell_handler: ShellHandler):
+    """Start a fake server on a free port and point adb_protocol at it"""
+    fake = FakeAdbServer(devices, shell_handler)
+    server = await asyncio.start_server(fake.handle, "127.0.0.1", 0)
+    monkeypatch.setattr(adb_protocol, "ADB_SERVER_PORT", server.sockets[0].getsockname()[1])
+    async with server:
+        yield fake
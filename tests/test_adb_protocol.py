@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from droid_remote.device import adb_protocol
+from droid_remote.device.adb_backend import SocketAdbBackend
+from droid_remote.device.adb_protocol import AdbServerFailure
+from droid_remote.device.registry import parse_devices
+from droid_remote.subprocess_utils import CommandException
+from .fake_adb_server import fake_adb_server
+
+
+def echo_shell(command: str):
+    if command == "fail":
+        return b"", b"oops\n", 3
+    return command.encode(), b"", 0
+
+
+def test_host_query(monkeypatch):
+    async def main():
+        async with fake_adb_server(monkeypatch, ["A", "B"], echo_shell) as fake:
+            devices = parse_devices(await SocketAdbBackend().list_devices())
+            assert [device.serial for device in devices] == ["A", "B"]
+            assert fake.requests == ["host:devices-l"]
+    asyncio.run(main())
+
+
+def test_failure_is_a_command_exception(monkeypatch):
+    async def main():
+        async with fake_adb_server(monkeypatch, ["A"], echo_shell):
+            with pytest.raises(CommandException) as info:
+                await SocketAdbBackend().shell("true", serial="Z")
+            assert isinstance(info.value, AdbServerFailure)
+            assert info.value.returncode == 1
+            assert info.value.stderr == "device not found"
+            with pytest.raises(AdbServerFailure, match="unknown service"):
+                await adb_protocol.host_query("host:bogus")
+    asyncio.run(main())
+
+
+def test_shell_v2_framing(monkeypatch):
+    async def main():
+        async with fake_adb_server(monkeypatch, ["A", "B"], echo_shell) as fake:
+            backend = SocketAdbBackend()
+            assert await backend.shell("echo hi", serial="B") == (0, "echo hi")
+            assert await backend.shell("fail", serial="B") == (3, "oops\n")
+            assert fake.requests[:2] == ["host:transport:B", "shell,v2,raw:echo hi"]
+    asyncio.run(main())
+
+
+def test_exec_out_streams_until_close(monkeypatch):
+    async def main():
+        async with fake_adb_server(monkeypatch, ["A"], echo_shell) as fake:
+            chunks = [
+                chunk async for chunk in SocketAdbBackend().stream_exec_out("uiautomator", "dump", "/dev/tty")
+            ]
+            assert b"".join(chunks) == b"uiautomator dump /dev/tty"
+            assert fake.requests == ["host:transport-any", "exec:uiautomator dump /dev/tty"]
+    asyncio.run(main())
+
+
+def test_track_devices(monkeypatch):
+    async def main():
+        async with fake_adb_server(monkeypatch, ["A"], echo_shell) as fake:
+            updates = SocketAdbBackend().track_devices()
+            assert [d.serial for d in parse_devices(await anext(updates))] == ["A"]
+            await fake.set_devices(["A", "B"])
+            assert [d.serial for d in parse_devices(await anext(updates))] == ["A", "B"]
+            await fake.set_devices([])
+            assert parse_devices(await anext(updates)) == []
+            await updates.aclose()
+    asyncio.run(main())
@@ -0,0 +1,50 @@
+import asyncio
+from asyncio import subprocess
+
+import pytest
+
+from droid_remote.device import adb_shell
+from droid_remote.device.adb_shell import AdbShellSession, AdbShellSessionPool
+from droid_remote.subprocess_utils import spawn
+
+
+async def open_sh_session(generation: int = 0, serial=None):
+    """A session over a local `sh` instead of `adb shell`"""
+    proc = await spawn("sh", stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return AdbShellSession(proc, generation)
+
+
+@pytest.fixture
+def sh_sessions(monkeypatch):
+    monkeypatch.setattr(AdbShellSession, "open", staticmethod(open_sh_session))
+
+
+def test_run_frames_output_and_status():
+    async def main():
+        session = await open_sh_session()
+        assert await session.run("echo a; echo b >&2; false") == (1, "a\nb\n")
+        assert await session.run("printf x") == (0, "x")
+        session.close()
+        await asyncio.gather(*adb_shell._reapers)
+    asyncio.run(main())
+
+
+def test_cancelled_session_is_closed_and_reaped(sh_sessions):
+    async def main():
+        pool = AdbShellSessionPool(size=1)
+        assert await pool.run("echo $$") is not None
+        [session] = pool._idle
+        task = asyncio.ensure_future(pool.run("sleep 10"))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # Not handed out again although its process wasn't reaped yet
+        assert not session.is_alive
+        assert pool._idle == []
+        assert await pool.run("echo ok") == (0, "ok\n")
+        await asyncio.gather(*adb_shell._reapers)
+        assert session._proc.returncode is not None
+        pool.close()
+        await asyncio.gather(*adb_shell._reapers)
+    asyncio.run(main())
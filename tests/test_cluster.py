@@ -0,0 +1,185 @@
+"""A coordinator and two nodes on the replay adb backend, as processes"""
+
+import asyncio
+import os
+from pathlib import Path
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import aiohttp
+import pytest
+
+from droid_remote.cluster import Heartbeat
+from droid_remote.coordinator import NodeRegistry
+
+
+STARTUP_TIMEOUT = 30
+REPO_DIR = Path(__file__).parent.parent
+
+
+def heartbeat(node_id: str, devices: list[str]):
+    return Heartbeat(node_id, f"http://{node_id}", devices, True)
+
+
+def test_owner_keeps_the_device_until_unhealthy():
+    nodes = NodeRegistry()
+    nodes.heartbeat(heartbeat("a", ["X"]))
+    nodes.heartbeat(heartbeat("b", ["X"]))
+    assert nodes.owner("X").node_id == "a"
+    nodes.mark_unhealthy("a", "test")
+    assert nodes.owner("X").node_id == "b"
+    # Back, but the device stays with b
+    nodes.heartbeat(heartbeat("a", ["X"]))
+    assert nodes.owner("X").node_id == "b"
+    nodes.mark_unhealthy("b", "test")
+    assert nodes.owner("X").node_id == "a"
+
+
+def test_owner_that_lost_the_device_is_replaced():
+    nodes = NodeRegistry()
+    nodes.heartbeat(heartbeat("a", ["X"]))
+    nodes.heartbeat(heartbeat("b", ["X"]))
+    assert nodes.owner("X").node_id == "a"
+    nodes.heartbeat(heartbeat("a", []))
+    assert nodes.owner("X").node_id == "b"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Cluster:
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.coordinator_port = free_port()
+        self.url = f"http://127.0.0.1:{self.coordinator_port}"
+        self.processes: dict[str, subprocess.Popen] = {}
+
+    def spawn(self, name: str, *args: str):
+        log_dir = self.directory / name
+        log_dir.mkdir(exist_ok=True)
+        self.processes[name] = subprocess.Popen(
+            [
+                sys.executable, "-m", "droid_remote", "foreground",
+                "--itsme-pin", "1234",
+                "--pid-file", str(log_dir / "server.pid"),
+                "--child-pgids-file", str(log_dir / "child_pgids.txt"),
+                "--log-file", str(log_dir / "server.log"),
+                "--ctl-log-file", str(log_dir / "ctl.log"),
+                "--known-actions-file", str(log_dir / "known_actions.json"),
+                *args,
+            ],
+            cwd=self.directory,
+            env={**os.environ, "PYTHONPATH": str(REPO_DIR)},
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+    def start_coordinator(self):
+        self.spawn(
+            "coordinator",
+            "--coordinator",
+            "--coordinator-host", "127.0.0.1",
+            "--coordinator-port", str(self.coordinator_port),
+            "--coordinator-pid-file", str(self.directory / "coordinator.pid"),
+        )
+
+    def start_node(self, name: str, serials: list[str]):
+        self.spawn(
+            name,
+            "--coordinator-url", self.url,
+            "--node-id", name,
+            "--http-host", "127.0.0.1",
+            "--http-port", str(free_port()),
+            "--tasker-http-port", str(free_port()),
+            "--adb-backend", "replay",
+            "--adb-replay-serials", ",".join(serials),
+        )
+
+    def kill(self, name: str):
+        proc = self.processes.pop(name)
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+
+    def stop(self):
+        for name in list(self.processes):
+            self.kill(name)
+
+
+@pytest.fixture
+def cluster(tmp_path):
+    cluster = Cluster(tmp_path)
+    try:
+        yield cluster
+    finally:
+        cluster.stop()
+
+
+async def wait_for(session: aiohttp.ClientSession, url: str, predicate):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        try:
+            async with session.get(url) as resp:
+                if resp.status == 200:
+                    body = await resp.json()
+                    if predicate(body):
+                        return body
+        except aiohttp.ClientConnectionError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{url} didn't get there in time")
+        await asyncio.sleep(0.2)
+
+
+def owners(devices: dict):
+    return {serial: device["owner"] for serial, device in devices.items()}
+
+
+def test_routing_metrics_and_failover(cluster):
+    cluster.start_coordinator()
+    cluster.start_node("a", ["shared", "only-a"])
+
+    async def main():
+        async with aiohttp.ClientSession() as session:
+            # a registers first, so it's the first owner of the shared device
+            await wait_for(
+                session, f"{cluster.url}/cluster/nodes",
+                lambda nodes: sorted(nodes.get("a", {}).get("devices", [])) == ["only-a", "shared"],
+            )
+            cluster.start_node("b", ["shared", "only-b"])
+            devices = await wait_for(
+                session, f"{cluster.url}/devices",
+                lambda devices: len(devices) == 3 and all(owner is not None for owner in owners(devices).values()),
+            )
+            assert owners(devices) == {"only-a": "a", "only-b": "b", "shared": "a"}
+
+            # Nodes answer 404 for devices they don't have
+            for serial in ["only-a", "only-b", "shared"]:
+                async with session.post(f"{cluster.url}/devices/{serial}/itsme/parse-screen/any") as resp:
+                    assert resp.status == 200
+                    assert "Pending action" in await resp.text()
+
+            async with session.get(f"{cluster.url}/metrics") as resp:
+                metrics = await resp.text()
+            for node in ["coordinator", "a", "b"]:
+                assert f'cluster_node="{node}"' in metrics
+
+            cluster.kill("a")
+            async with session.post(f"{cluster.url}/devices/shared/itsme/parse-screen/any") as resp:
+                assert resp.status == 200
+            async with session.get(f"{cluster.url}/devices") as resp:
+                assert owners(await resp.json())["shared"] == "b"
+
+            cluster.start_node("a", ["shared", "only-a"])
+            await wait_for(session, f"{cluster.url}/cluster/nodes", lambda nodes: nodes["a"]["healthy"])
+            async with session.get(f"{cluster.url}/devices") as resp:
+                assert owners(await resp.json()) == {"only-a": "a", "only-b": "b", "shared": "b"}
+
+    asyncio.run(main())
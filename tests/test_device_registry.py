@@ -0,0 +1,23 @@
+from droid_remote.device.registry import DeviceRegistry, parse_devices, target
+
+
+def test_untargeted_state_becomes_the_only_devices():
+    registry = DeviceRegistry()
+    # Before the registry is filled
+    early = registry.current()
+    assert early.serial is None
+    registry.update(parse_devices("A\tdevice model:a"))
+    assert early.serial == "A"
+    assert registry.current() is early
+    with target("A"):
+        assert registry.current() is early
+    assert registry.state("A") is early
+
+
+def test_several_devices_keep_their_own_state():
+    registry = DeviceRegistry()
+    registry.update(parse_devices("A\tdevice\nB\tdevice"))
+    untargeted = registry.current()
+    assert untargeted.serial is None
+    assert registry.state("A") is not registry.state("B")
+    assert registry.state("A") is not untargeted
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+
+from droid_remote.event_bus import EventBus
+
+
+def test_ring_buffer_wraps_around():
+    event_bus = EventBus(capacity=4)
+    subscription = event_bus.subscribe()
+    for i in range(3):
+        event_bus.emit(i)
+    assert subscription.take_ready() == [0, 1, 2]
+    # Past the end of the buffer, overwriting slots already read
+    for i in range(3, 7):
+        event_bus.emit(i)
+    assert subscription.take_ready() == [3, 4, 5, 6]
+    assert subscription.dropped == 0
+
+
+def test_replay_is_limited_to_the_buffer():
+    event_bus = EventBus(capacity=4)
+    for i in range(10):
+        event_bus.emit(i)
+    assert event_bus.subscribe(replay=2).take_ready() == [8, 9]
+    assert event_bus.subscribe(replay=100).take_ready() == [6, 7, 8, 9]
+
+
+def test_slow_subscriber_skips_and_counts_dropped_events():
+    event_bus = EventBus(capacity=4)
+    slow = event_bus.subscribe()
+    fast = event_bus.subscribe()
+    for i in range(10):
+        event_bus.emit(i)
+        assert fast.take_ready() == [i]
+    assert slow.backlog == 10
+    assert slow.take_ready(limit=2) == [6, 7]
+    assert slow.dropped == 6
+    assert fast.dropped == 0
+
+    event_bus.emit(10)
+
+    async def read_one():
+        return await anext(slow)
+    assert asyncio.run(read_one()) == 8
+    assert slow.dropped == 6
+
+
+def test_log_level_follows_open_subscriptions():
+    event_bus = EventBus()
+    assert event_bus.log_level is None
+    with event_bus.subscribe(log_level=logging.INFO):
+        with event_bus.subscribe(log_level=logging.WARNING):
+            assert event_bus.log_level == logging.INFO
+        assert event_bus.log_level == logging.INFO
+    assert event_bus.log_level is None
+
+
+def test_waiting_subscriber_wakes_on_emit():
+    event_bus = EventBus()
+    subscription = event_bus.subscribe()
+
+    async def main():
+        waiting = asyncio.create_task(subscription.wait())
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        event_bus.emit("event")
+        async with asyncio.timeout(1):
+            await waiting
+        return subscription.take_ready()
+    assert asyncio.run(main()) == ["event"]
@@ -0,0 +1,19 @@
+from droid_remote import health
+from droid_remote.health import ProbeInterval
+
+
+def test_probe_interval_backs_off_while_healthy(monkeypatch):
+    monkeypatch.setattr(health.random, "uniform", lambda a, b: 0)
+    interval = ProbeInterval(min_interval=1, max_interval=5)
+    assert [interval.next(True) for _ in range(5)] == [1.5, 2.25, 3.375, 5, 5]
+    # A failure is confirmed quickly
+    assert interval.next(False) == 1
+    assert interval.next(True) == 1.5
+
+
+def test_probe_interval_jitter_stays_within_bounds():
+    interval = ProbeInterval(min_interval=1, max_interval=1)
+    jitter = health.HEALTH_PROBE_JITTER
+    delays = [interval.next(True) for _ in range(200)]
+    assert all(1 - jitter <= delay <= 1 + jitter for delay in delays)
+    assert len(set(delays)) > 1
@@ -0,0 +1,155 @@
+import asyncio
+from typing import AsyncIterator, Optional
+
+import pytest
+
+from droid_remote.device.ui_dump import UI_DUMP_TRAILER
+from itsme_adb import driver
+from itsme_adb.replay import ReplayAdbBackend, replaying
+
+
+CONFIRM_FLOW = ["home_pending", "action", "pinpad", "action_confirmed", "home_no_pending"]
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(driver.adb, "SCREEN_POLL_INITIAL_DELAY", 0.001)
+    monkeypatch.setattr(driver.adb, "SCREEN_POLL_MAX_DELAY", 0.001)
+
+
+class PressedStateReplayAdbBackend(ReplayAdbBackend):
+    """Like ReplayAdbBackend, but the first dump after an input event is the
+    screen that was tapped, with a button in its pressed (focused) state"""
+
+    def __init__(self, dumps: list[bytes]):
+        super().__init__(dumps)
+        self.pressed: Optional[bytes] = None
+
+    async def shell(self, script: str, serial: Optional[str] = None):
+        tapped = self.dumps[self.position]
+        result = await super().shell(script, serial)
+        if self.dumps[self.position] is not tapped:
+            self.pressed = tapped.replace(b'focused="false"', b'focused="true"', 1)
+        return result
+
+    async def stream_exec_out(self, *args: str, serial: Optional[str] = None) -> AsyncIterator[bytes]:
+        if self.pressed is None:
+            async for chunk in super().stream_exec_out(*args, serial=serial):
+                yield chunk
+            return
+        self.dump_count += 1
+        dump, self.pressed = self.pressed, None
+        yield dump + UI_DUMP_TRAILER + b": /dev/tty\n"
+
+
+def test_confirm_does_not_retap_a_pressed_screen():
+    backend = PressedStateReplayAdbBackend.from_fixtures(CONFIRM_FLOW)
+    with replaying(backend):
+        outcome = asyncio.run(driver.confirm_app_action("0000", "KBC", "Log in"))
+    assert outcome == "Confirmed app action KBC: Log in"
+    # Tap card, confirm, then the PIN with its enter key, each exactly once
+    assert len(backend.scripts) == 3
+    assert len(backend.taps) == 1 + 1 + 5
+
+
+def test_unchanged_screen_raises():
+    backend = ReplayAdbBackend.from_fixtures(["action"])
+
+    async def main():
+        action_screen = await driver.parse_any_screen()
+        await action_screen.confirm()
+        await driver.wait_for_next_screen(action_screen, timeout=0.1)
+
+    with replaying(backend):
+        with pytest.raises(driver.ScreenDidNotChangeError) as info:
+            asyncio.run(main())
+    assert isinstance(info.value.screen, driver.ActionScreen)
+
+
+EXPECTED_SCREENS = {
+    "home_pending": driver.PendingActionsHomeScreen,
+    "home_no_pending": driver.NoPendingActionsHomeScreen,
+    "action": driver.ActionScreen,
+    "poka_yoke": driver.PokaYokeScreen,
+    "pinpad": driver.PinpadScreen,
+    "action_expired": driver.ActionExpiredScreen,
+    "play_rating": driver.PlayRatingScreen,
+    "action_confirmed": driver.ActionConfirmedScreen,
+}
+
+
+def replay(names: list[str], fn):
+    backend = ReplayAdbBackend.from_fixtures(names)
+    with replaying(backend):
+        result = asyncio.run(fn())
+    return backend, result
+
+
+def parse_fixture(name: str):
+    _, screen = replay([name], driver.parse_any_screen)
+    return screen
+
+
+@pytest.mark.parametrize("name", sorted(EXPECTED_SCREENS))
+def test_parse_fixture(name):
+    backend, screen = replay([name], driver.parse_any_screen)
+    assert isinstance(screen, EXPECTED_SCREENS[name])
+    assert backend.dump_count == 1
+
+
+def test_parsed_action_screen():
+    screen = parse_fixture("action")
+    assert screen.basic_info == driver.ActionBasicInfo("Log in", "KBC", "Today, 14:02")
+    assert screen.shared_data != []
+
+
+def test_confirm_flow():
+    backend, outcome = replay(CONFIRM_FLOW, lambda: driver.confirm_app_action("1234", "KBC", "Log in"))
+    assert outcome == "Confirmed app action KBC: Log in"
+    home = parse_fixture("home_pending")
+    action = parse_fixture("action")
+    pinpad = parse_fixture("pinpad")
+    assert backend.taps == [
+        home.card_center,
+        action.confirm_button_center,
+        *(pinpad.get_symbol_center(symbol) for symbol in "1234>"),
+    ]
+    # One dump per screen up to the one confirming the action
+    assert backend.dump_count == 4
+
+
+def test_confirm_flow_dismisses_play_rating():
+    backend, outcome = replay(
+        ["play_rating", *CONFIRM_FLOW],
+        lambda: driver.confirm_app_action("1234", "KBC", "Log in"),
+    )
+    assert outcome == "Confirmed app action KBC: Log in"
+    assert backend.taps[0] == parse_fixture("play_rating").not_now_button_center
+    assert len(backend.scripts) == 4
+
+
+def test_confirm_without_pending_actions():
+    with pytest.raises(driver.NoPendingActionsException):
+        replay(["home_no_pending"], lambda: driver.confirm_app_action("1234", "KBC", "Log in"))
+
+
+def test_confirm_other_app_action():
+    with pytest.raises(driver.UnexpectedPendingActionException):
+        replay(CONFIRM_FLOW, lambda: driver.confirm_app_action("1234", "Belfius", "Log in"))
+
+
+def test_confirm_stops_at_poka_yoke():
+    with pytest.raises(driver.ConfirmAppActionInteractionRequired) as info:
+        replay(
+            ["home_pending", "action", "poka_yoke"],
+            lambda: driver.confirm_app_action("1234", "KBC", "Log in"),
+        )
+    assert isinstance(info.value.screen, driver.PokaYokeScreen)
+
+
+def test_pin_flow():
+    backend, _ = replay(["pinpad", "action_confirmed"], lambda: driver.pinpad_screen_enter_pin("9870"))
+    pinpad = parse_fixture("pinpad")
+    assert backend.taps == [pinpad.get_symbol_center(symbol) for symbol in "9870>"]
+    # All digits in a single input script
+    assert len(backend.scripts) == 1
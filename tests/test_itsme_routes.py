@@ -0,0 +1,103 @@
+import asyncio
+from typing import AsyncIterator, Optional
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+import pytest
+
+from droid_remote.device import adb
+from droid_remote.device.scheduler import current_lease
+from droid_remote.webapp.aio_util import prefix_all, wrap_all
+from droid_remote.webapp.exception_handling import with_exception_handling
+from droid_remote.webapp.itsme import parse_screen
+from itsme_adb.replay import ReplayAdbBackend, replaying
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(parse_screen.driver.adb, "SCREEN_POLL_INITIAL_DELAY", 0.001)
+    monkeypatch.setattr(parse_screen.driver.adb, "SCREEN_POLL_MAX_DELAY", 0.001)
+
+
+class LeaseRecordingReplayAdbBackend(ReplayAdbBackend):
+    """Records the device lease every adb call is made under"""
+
+    def __init__(self, dumps: list[bytes]):
+        super().__init__(dumps)
+        self.leases: list[Optional[object]] = []
+
+    async def shell(self, script: str, serial: Optional[str] = None):
+        self.leases.append(current_lease.get())
+        return await super().shell(script, serial)
+
+    async def stream_exec_out(self, *args: str, serial: Optional[str] = None) -> AsyncIterator[bytes]:
+        self.leases.append(current_lease.get())
+        async for chunk in super().stream_exec_out(*args, serial=serial):
+            yield chunk
+
+
+def post_parse(names: list[str], route: str, form: dict[str, str]):
+    backend = LeaseRecordingReplayAdbBackend.from_fixtures(names)
+
+    async def main():
+        app = web.Application()
+        app.add_routes(wrap_all(
+            prefix_all(parse_screen.create_routes("1234"), "/"),
+            with_exception_handling,
+        ))
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.post(f"/{route}", data=form)
+            assert resp.status == 200
+            return await resp.text()
+
+    with replaying(backend):
+        return backend, asyncio.run(main())
+
+
+def test_parse_only():
+    backend, html = post_parse(["home_pending", "action"], "any", {})
+    assert "Pending action" in html
+    assert backend.taps == []
+    assert backend.dump_count == 1
+
+
+def test_parse_auto_tap_card_and_enter_pin():
+    backend, html = post_parse(
+        ["home_pending", "action", "pinpad", "action_confirmed"],
+        "any",
+        {"auto-tap-card": "on", "auto-enter-pin": "on"},
+    )
+    # Stops at the action screen, confirming is up to the user
+    assert "Pending action confirmation" in html
+    assert len(backend.taps) == 1
+    assert backend.dump_count == 2
+    # All in one UI session
+    assert len(set(map(id, backend.leases))) == 1
+    assert backend.leases[0] is not None
+
+
+def test_parse_auto_enter_pin():
+    backend, html = post_parse(
+        ["pinpad", "action_confirmed"],
+        "post-confirm",
+        {"auto-enter-pin": "on"},
+    )
+    assert len(backend.scripts) == 1
+    assert len(backend.taps) == 5
+    assert backend.dump_count == 2
+
+
+def test_parse_dismisses_play_rating():
+    backend, html = post_parse(["play_rating", "home_no_pending"], "any", {})
+    assert "No pending actions" in html
+    assert len(backend.taps) == 1
+
+
+def test_streamed_dump_does_not_leak_the_lease():
+    async def main():
+        async for _ in adb.stream_screen_hierarchy():
+            assert current_lease.get() is None
+        assert adb.current_device().scheduler.is_idle
+
+    with replaying(ReplayAdbBackend.from_fixtures(["home_pending"])):
+        asyncio.run(main())
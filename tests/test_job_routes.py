@@ -0,0 +1,67 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+import pytest
+
+from droid_remote.jobs import JobStore
+from droid_remote.webapp.aio_util import prefix_all
+from droid_remote.webapp.job_routes import create_routes
+from itsme_adb import driver
+from itsme_adb.replay import ReplayAdbBackend, replaying
+
+
+CONFIRM_FLOW = ["home_pending", "action", "pinpad", "action_confirmed", "home_no_pending"]
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(driver.adb, "SCREEN_POLL_INITIAL_DELAY", 0.001)
+    monkeypatch.setattr(driver.adb, "SCREEN_POLL_MAX_DELAY", 0.001)
+
+
+def run_job(names: list[str], query: str):
+    """Status and body of the POST, and the finished job if one started"""
+    async def main():
+        app = web.Application()
+        app.add_routes(prefix_all(create_routes(JobStore(), "1234", None), "/jobs/"))
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.post(f"/jobs/confirm-known-action{query}")
+            body = await resp.json()
+            if resp.status != 202:
+                return resp.status, body, None
+            while True:
+                job = await (await client.get(body["url"])).json()
+                if job["state"] != "running":
+                    return resp.status, body, job
+                await asyncio.sleep(0.01)
+
+    with replaying(ReplayAdbBackend.from_fixtures(names)):
+        return asyncio.run(main())
+
+
+@pytest.mark.parametrize("query", ["", "?app=KBC", "?app=KBC&action=%20"])
+def test_missing_parameters(query):
+    status, body, _ = run_job(CONFIRM_FLOW, query)
+    assert status == 400
+    assert "Missing query parameter" in body["error"]
+
+
+def test_confirmed():
+    _, _, job = run_job(CONFIRM_FLOW, "?app=KBC&action=Log%20in")
+    assert job["state"] == "succeeded"
+    assert job["result"] == {"outcome": "confirmed", "message": "Confirmed app action KBC: Log in"}
+
+
+def test_no_pending_actions_fails():
+    _, _, job = run_job(["home_no_pending"], "?app=KBC&action=Log%20in")
+    assert job["state"] == "failed"
+    assert job["error"] == "No pending actions"
+    assert job["result"] == {"outcome": "no-pending-actions"}
+
+
+def test_interaction_required_fails():
+    _, _, job = run_job(["home_pending", "action", "poka_yoke"], "?app=KBC&action=Log%20in")
+    assert job["state"] == "failed"
+    assert job["result"]["outcome"] == "interaction-required"
+    assert job["result"]["screen"] == "PokaYokeScreen"
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+
+from droid_remote.webapp.itsme import known_actions
+from droid_remote.webapp.itsme.known_actions import (
+    KnownActionsStore, KnownItsmeActions, read_known_actions_file,
+)
+
+
+def test_change_during_flush_is_flushed(tmp_path, monkeypatch):
+    monkeypatch.setattr(known_actions, "KNOWN_ACTIONS_FLUSH_DELAY", 0.01)
+    writing = threading.Event()
+    release = threading.Event()
+    write_atomically = known_actions.write_atomically
+
+    def slow_write(path, content):
+        writing.set()
+        release.wait()
+        write_atomically(path, content)
+    monkeypatch.setattr(known_actions, "write_atomically", slow_write)
+
+    path = tmp_path / "known_actions.json"
+    store = KnownActionsStore()
+    store.load(path)
+
+    async def main():
+        assert store.add("Test app", "First")
+        async with asyncio.timeout(5):
+            while not writing.is_set():
+                await asyncio.sleep(0.01)
+        # Too late for the running flush
+        assert store.add("Test app", "Second")
+        release.set()
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if not store.is_dirty:
+                break
+
+    asyncio.run(main())
+    assert not store.is_dirty
+    known = read_known_actions_file(path)
+    assert known is not None
+    assert set(known.app_actions["Test app"]) == {"First", "Second"}
+
+
+def test_flushed_file_round_trips(tmp_path):
+    path = tmp_path / "known_actions.json"
+    store = KnownActionsStore()
+    store.load(path)
+    store.add("Bank \"Ü\"", "Log in")
+    store.add("Bank \"Ü\"", "Confirm")
+    store.flush_sync()
+
+    known = read_known_actions_file(path)
+    assert known == KnownItsmeActions(app_actions=store.app_actions)
+    reloaded = KnownActionsStore()
+    reloaded.load(path)
+    assert reloaded.app_actions == store.app_actions
+    assert reloaded._serialize() == path.read_text()
@@ -0,0 +1,49 @@
+import logging
+from queue import Queue
+
+from droid_remote.event_bus import EventBus, EventBusLogHandler
+from droid_remote.log_setup import InProcessQueueHandler
+
+
+def make_record(message: str):
+    return logging.makeLogRecord({"levelno": logging.INFO, "msg": message})
+
+
+def test_full_queue_drops_and_reports():
+    queue: Queue = Queue(2)
+    handler = InProcessQueueHandler(queue)
+    for i in range(5):
+        handler.handle(make_record(f"record {i}"))
+    assert handler.dropped == 3
+    assert [queue.get_nowait().getMessage() for _ in range(2)] == ["record 0", "record 1"]
+
+    handler.handle(make_record("after"))
+    warning, record = queue.get_nowait(), queue.get_nowait()
+    assert warning.levelno == logging.WARNING
+    assert warning.getMessage() == "Log queue full, dropped 3 record(s)"
+    assert record.getMessage() == "after"
+    assert handler.dropped == 3
+
+
+class CountingFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__()
+        self.formatted: list[str] = []
+
+    def format(self, record):
+        self.formatted.append(record.getMessage())
+        return super().format(record)
+
+
+def test_event_bus_records_formatted_for_subscribers_only():
+    event_bus = EventBus()
+    handler = EventBusLogHandler(event_bus)
+    formatter = CountingFormatter()
+    handler.setFormatter(formatter)
+    handler.handle(make_record("nobody listens"))
+    with event_bus.subscribe(log_level=logging.WARNING):
+        handler.handle(make_record("below the level"))
+        handler.handle(logging.makeLogRecord({"levelno": logging.WARNING, "msg": "wanted"}))
+    handler.handle(make_record("closed"))
+    assert event_bus.log_level is None
+    assert formatter.formatted == ["wanted"]
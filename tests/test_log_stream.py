@@ -0,0 +1,30 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from droid_remote.event_bus import EventBus
+from droid_remote.webapp.log_stream import handle_ws
+
+
+def test_closed_client_unsubscribes_without_new_events():
+    event_bus = EventBus()
+
+    async def main():
+        app = web.Application()
+        app.add_routes([web.get("/ws", lambda request: handle_ws(event_bus, request))])
+        async with TestClient(TestServer(app)) as client:
+            ws = await client.ws_connect("/ws")
+            event_bus.emit("hello")
+            assert "hello" in await ws.receive_str(timeout=5)
+            assert len(event_bus._subscriptions) == 1
+
+            # Nothing is emitted afterwards, only the close can end the handler.
+            # The close handshake waits for the server to answer
+            async with asyncio.timeout(2):
+                await ws.close()
+                while len(event_bus._subscriptions) > 0:
+                    await asyncio.sleep(0.01)
+        assert event_bus.log_level is None
+
+    asyncio.run(main())
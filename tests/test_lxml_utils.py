@@ -0,0 +1,31 @@
+from lxml import etree
+
+from droid_remote.lxml_utils import compiled_xpath, elements_xpath
+
+
+SCREEN = etree.fromstring(
+    "<hierarchy>"
+    '<node text="Log in" />'
+    '<node text="Don\'t allow" />'
+    '<node text=\'Say "hi"\' />'
+    '<node text="It\'s &quot;fine&quot;" />'
+    "</hierarchy>"
+)
+
+
+def texts(elements):
+    return [e.attrib["text"] for e in elements]
+
+
+def test_variables_with_quotes_need_no_escaping():
+    for text in ["Don't allow", 'Say "hi"', 'It\'s "fine"']:
+        assert texts(elements_xpath(SCREEN, "//node[@text=$text]", text=text)) == [text]
+    assert texts(elements_xpath(SCREEN, "//node[starts-with(@text, $prefix)]", prefix="It's")) == ['It\'s "fine"']
+
+
+def test_expression_compiled_once_for_all_values():
+    compiled_xpath.cache_clear()
+    for text in ["Log in", "Don't allow", "missing'"]:
+        elements_xpath(SCREEN, "//node[@text=$text]", text=text)
+    info = compiled_xpath.cache_info()
+    assert (info.misses, info.hits) == (1, 2)
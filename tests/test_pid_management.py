@@ -0,0 +1,43 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from droid_remote import pid_management
+from droid_remote.pid_management import wait_for_process_exit
+
+
+async def exit_wait_duration(sleep: float):
+    proc = await asyncio.create_subprocess_exec("sleep", str(sleep))
+    start = time.monotonic()
+    async with asyncio.timeout(5):
+        await wait_for_process_exit(proc.pid)
+    duration = time.monotonic() - start
+    await proc.wait()
+    return duration
+
+
+@pytest.mark.skipif(not hasattr(os, "pidfd_open"), reason="No pidfd support")
+def test_wait_for_process_exit_with_pidfd(monkeypatch):
+    monkeypatch.setattr(pid_management, "PROCESS_EXIT_POLL_INTERVAL", 60)
+    # Would take a minute if it polled
+    assert 0.2 <= asyncio.run(exit_wait_duration(0.3)) < 2
+
+
+def test_wait_for_process_exit_falls_back_to_polling(monkeypatch):
+    def no_pidfd(pid):
+        raise OSError("pidfd_open not supported")
+    monkeypatch.setattr(pid_management.os, "pidfd_open", no_pidfd, raising=False)
+    monkeypatch.setattr(pid_management, "PROCESS_EXIT_POLL_INTERVAL", 0.05)
+    assert 0.2 <= asyncio.run(exit_wait_duration(0.3)) < 2
+
+
+def test_wait_for_process_exit_without_process():
+    async def main():
+        async with asyncio.timeout(1):
+            await wait_for_process_exit(None)
+            proc = await asyncio.create_subprocess_exec("true")
+            await proc.wait()
+            await wait_for_process_exit(proc.pid)
+    asyncio.run(main())
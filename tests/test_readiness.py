@@ -0,0 +1,50 @@
+import asyncio
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from aiohttp_basicauth import BasicAuthMiddleware
+
+from droid_remote import readiness
+from droid_remote.device.registry import Device
+from droid_remote.device.scheduler import Priority, current_priority
+from droid_remote.readiness import ReadinessMonitor
+from droid_remote.webapp import handle_readiness
+
+
+async def failing_check():
+    raise Exception("device XYZ123 offline")
+
+
+def test_readiness_details_need_credentials():
+    monitor = ReadinessMonitor({"adb": failing_check})
+    auth = BasicAuthMiddleware(username="admin", password="secret", force=False)
+
+    async def main():
+        await monitor._run_check("adb", failing_check)
+        app = web.Application()
+        app.add_routes([web.get("/healthz/ready", lambda request: handle_readiness(monitor, auth, request))])
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get("/healthz/ready")
+            assert resp.status == 503
+            body = await resp.json()
+            assert body == {"ready": False, "failing": ["adb"]}
+            assert "XYZ123" not in await resp.text()
+
+            resp = await client.get("/healthz/ready", auth=aiohttp.BasicAuth("admin", "secret"))
+            assert resp.status == 503
+            assert "XYZ123" in (await resp.json())["checks"]["adb"]["detail"]
+
+    asyncio.run(main())
+
+
+def test_adb_check_runs_in_the_background(monkeypatch):
+    priorities = []
+
+    async def list_devices():
+        priorities.append(current_priority.get())
+        return [Device("A", "device", {})]
+    monkeypatch.setattr(readiness.adb, "list_devices", list_devices)
+
+    assert asyncio.run(readiness.check_adb()) == "1 device(s) online: A"
+    assert priorities == [Priority.BACKGROUND]
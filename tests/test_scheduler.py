@@ -0,0 +1,156 @@
+import asyncio
+
+from droid_remote.device.scheduler import DeviceScheduler, Priority, priority, single_flight
+
+
+async def hold(scheduler: DeviceScheduler, release: asyncio.Event):
+    """Keep the device busy from another task: tasks created while holding a
+    lease inherit it, and would pass straight through"""
+    async with scheduler.command():
+        await release.wait()
+
+
+async def run_queued(scheduler: DeviceScheduler, calls: list[tuple[str, Priority]]):
+    """Queue `calls` while the device is busy, return the order they ran in"""
+    order = []
+
+    async def call(name: str, call_priority: Priority):
+        with priority(call_priority):
+            async with scheduler.command():
+                order.append(name)
+
+    release = asyncio.Event()
+    holder = asyncio.create_task(hold(scheduler, release))
+    await asyncio.sleep(0)
+    tasks = []
+    for name, call_priority in calls:
+        tasks.append(asyncio.create_task(call(name, call_priority)))
+        # Queued in this order
+        await asyncio.sleep(0)
+    assert scheduler.queue_length == len(calls)
+    release.set()
+    async with asyncio.timeout(5):
+        await asyncio.gather(holder, *tasks)
+    assert scheduler.is_idle
+    return order
+
+
+def test_interactive_calls_go_first_then_in_arrival_order():
+    calls = [
+        ("keep-alive", Priority.BACKGROUND),
+        ("tap", Priority.INTERACTIVE),
+        ("health", Priority.BACKGROUND),
+        ("dump", Priority.INTERACTIVE),
+    ]
+    order = asyncio.run(run_queued(DeviceScheduler(), calls))
+    assert order == ["tap", "dump", "keep-alive", "health"]
+
+
+def test_cancelled_waiter_is_skipped():
+    scheduler = DeviceScheduler()
+    order = []
+
+    async def call(name: str):
+        async with scheduler.command():
+            order.append(name)
+
+    async def main():
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(scheduler, release))
+        await asyncio.sleep(0)
+        gone = asyncio.create_task(call("gone"))
+        await asyncio.sleep(0)
+        kept = asyncio.create_task(call("kept"))
+        await asyncio.sleep(0)
+        gone.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        async with asyncio.timeout(5):
+            await asyncio.gather(holder, kept)
+        assert scheduler.is_idle
+
+    asyncio.run(main())
+    assert order == ["kept"]
+
+
+def test_ui_session_is_reentrant_and_exclusive():
+    scheduler = DeviceScheduler()
+    order = []
+
+    async def other_call():
+        async with scheduler.command():
+            order.append("other")
+
+    async def flow(started: asyncio.Event):
+        async with scheduler.ui_session():
+            started.set()
+            for step in ["tap", "dump"]:
+                # Within the session: doesn't wait for it
+                async with scheduler.command():
+                    order.append(step)
+                await asyncio.sleep(0.01)
+
+    async def main():
+        started = asyncio.Event()
+        async with asyncio.timeout(5):
+            session = asyncio.create_task(flow(started))
+            await started.wait()
+            await asyncio.gather(session, other_call())
+
+    asyncio.run(main())
+    assert order == ["tap", "dump", "other"]
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    scheduler = DeviceScheduler()
+    runs = 0
+
+    async def dump():
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(0.05)
+        return runs
+
+    async def main():
+        first = await asyncio.gather(*[scheduler.single_flight("dump", dump) for _ in range(5)])
+        # Once done, the next call runs again
+        second = await scheduler.single_flight("dump", dump)
+        return first, second
+
+    assert asyncio.run(main()) == ([1] * 5, 2)
+
+
+def test_single_flight_survives_a_caller_giving_up():
+    scheduler = DeviceScheduler()
+
+    async def dump():
+        await asyncio.sleep(0.05)
+        return "screen"
+
+    async def main():
+        impatient = asyncio.create_task(scheduler.single_flight("dump", dump))
+        patient = asyncio.create_task(scheduler.single_flight("dump", dump))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        async with asyncio.timeout(5):
+            return await patient
+
+    assert asyncio.run(main()) == "screen"
+
+
+def test_single_flight_decorator_keys_on_arguments():
+    calls = []
+
+    @single_flight()
+    async def read(path: str, max_size: int = 0):
+        calls.append((path, max_size))
+        await asyncio.sleep(0.01)
+        return path
+
+    async def main():
+        return await asyncio.gather(
+            read("a"), read("a"), read("b"), read("a", max_size=1), read("a", max_size=1),
+        )
+
+    assert asyncio.run(main()) == ["a", "a", "b", "a", "a"]
+    assert sorted(calls) == [("a", 0), ("a", 1), ("b", 0)]
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from droid_remote.subprocess_utils import (
+    CommandException,
+    CommandOutputLimitError,
+    CommandTimeoutError,
+    execute,
+    stream_command,
+)
+
+
+async def collect(*command: str, **kwargs):
+    return b"".join([chunk async for chunk in stream_command(*command, **kwargs)])
+
+
+def test_stream_command_reads_stderr_concurrently():
+    # More stderr than a pipe holds, before any stdout
+    script = "head -c 1000000 /dev/zero >&2; echo out"
+    assert asyncio.run(collect("sh", "-c", script, timeout=5)) == b"out\n"
+
+
+def test_stream_command_raises_with_stderr():
+    with pytest.raises(CommandException) as info:
+        asyncio.run(collect("sh", "-c", "echo out; echo err >&2; exit 2"))
+    assert info.value.returncode == 2
+    assert info.value.stderr == "err\n"
+
+
+def test_execute_timeout_keeps_partial_output():
+    with pytest.raises(CommandTimeoutError) as info:
+        asyncio.run(execute("sh", "-c", "echo out; echo err >&2; sleep 10", timeout=0.5))
+    assert info.value.stdout == "out\n"
+    assert info.value.stderr == "err\n"
+
+
+def test_execute_output_limit_keeps_truncated_output():
+    with pytest.raises(CommandOutputLimitError) as info:
+        asyncio.run(execute("sh", "-c", "echo err >&2; sleep 0.2; head -c 100000 /dev/zero; sleep 10", max_output=1000))
+    assert len(info.value.stdout) == 1000
+    assert info.value.stderr == "err\n"
+
+
+def test_stream_command_stderr_overflow_without_timeout():
+    async def main():
+        # Would hang on a full stderr pipe if it weren't killed
+        async with asyncio.timeout(5):
+            await collect("sh", "-c", "head -c 1000000 /dev/zero >&2; sleep 30", timeout=None, max_output=1000)
+
+    with pytest.raises(CommandOutputLimitError) as info:
+        asyncio.run(main())
+    assert len(info.value.stderr) == 1000
@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+from aiohttp import WSServerHandshakeError, web
+from aiohttp.test_utils import TestClient, TestServer
+import pytest
+
+from droid_remote.tasker.channel import TaskerChannel
+from droid_remote.tasker.model import TaskCallbackData, TaskInvocation
+
+
+TOKEN = "s3cret"
+
+
+def with_channel(token, fn):
+    channel = TaskerChannel()
+    callbacks: list[TaskCallbackData] = []
+
+    async def main():
+        app = web.Application()
+        app.add_routes([web.get("/channel", channel.create_handler(callbacks.append, token))])
+        async with TestClient(TestServer(app)) as client:
+            await fn(client, channel, callbacks)
+
+    asyncio.run(main())
+
+
+def bearer(token: str):
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.mark.parametrize("headers", [{}, bearer("wrong"), {"Authorization": TOKEN}])
+def test_refuses_connection_without_token(headers):
+    async def check(client, channel, _):
+        with pytest.raises(WSServerHandshakeError) as info:
+            await client.ws_connect("/channel", headers=headers)
+        assert info.value.status == 401
+        assert not channel.is_connected
+    with_channel(TOKEN, check)
+
+
+def test_disabled_without_configured_token():
+    async def check(client, channel, _):
+        with pytest.raises(WSServerHandshakeError):
+            await client.ws_connect("/channel", headers=bearer("None"))
+        assert not channel.is_connected
+    with_channel(None, check)
+
+
+def test_dispatch_and_callback():
+    async def check(client, channel, callbacks):
+        ws = await client.ws_connect("/channel", headers=bearer(TOKEN))
+        await asyncio.sleep(0.01)
+        assert channel.is_connected
+        await asyncio.gather(
+            channel.send(TaskInvocation("a", "wake", "")),
+            channel.send(TaskInvocation("b", "unlock", "")),
+        )
+        frame = json.loads((await ws.receive()).data)
+        assert [task["correlationId"] for task in frame["tasks"]] == ["a", "b"]
+        await ws.send_str(json.dumps({
+            "type": "callback",
+            "callbacks": [{"correlationId": "a", "returnCode": 0, "result": "ok"}],
+        }))
+        await asyncio.sleep(0.01)
+        assert [callback.correlation_id for callback in callbacks] == ["a"]
+        await ws.close()
+    with_channel(TOKEN, check)
+
+
+def test_live_connection_kept_on_unauthorized_takeover():
+    async def check(client, channel, _):
+        ws = await client.ws_connect("/channel", headers=bearer(TOKEN))
+        await asyncio.sleep(0.01)
+        with pytest.raises(WSServerHandshakeError):
+            await client.ws_connect("/channel", headers=bearer("attacker"))
+        assert channel.is_connected
+        assert not ws.closed
+        await ws.close()
+    with_channel(TOKEN, check)
@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+from droid_remote import watchdog
+from droid_remote.watchdog import RestartPolicy
+
+
+def fake_clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(watchdog, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_restart_backoff_resets_once_healthy(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    policy = RestartPolicy()
+    delays = []
+    for _ in range(3):
+        delays.append(policy.next_delay())
+        policy.record_restart()
+        # Spread out, so the crash-loop breaker stays out of it
+        clock.now += watchdog.CRASH_LOOP_WINDOW
+    assert delays == [0, 1, 2]
+
+    policy.record_healthy()
+    assert policy.next_delay() == 0
+
+
+def test_restart_backoff_is_capped(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    policy = RestartPolicy()
+    for _ in range(10):
+        policy.next_delay()
+        policy.record_restart()
+        clock.now += watchdog.CRASH_LOOP_WINDOW + 1
+    assert policy.next_delay() == watchdog.RESTART_BACKOFF_MAX
+
+
+def test_crash_loop_breaker(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    policy = RestartPolicy()
+    for _ in range(watchdog.CRASH_LOOP_MAX_RESTARTS):
+        assert policy.next_delay() < watchdog.CRASH_LOOP_COOLDOWN
+        policy.record_restart()
+        policy.record_healthy()
+        clock.now += 1
+    assert policy.next_delay() == watchdog.CRASH_LOOP_COOLDOWN
+    # Holding off once is enough, the window starts over
+    assert policy.next_delay() == 0
+
+
+def test_restarts_outside_the_window_are_forgotten(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    policy = RestartPolicy()
+    for _ in range(watchdog.CRASH_LOOP_MAX_RESTARTS - 1):
+        policy.record_restart()
+        policy.record_healthy()
+    clock.now += watchdog.CRASH_LOOP_WINDOW + 1
+    for _ in range(watchdog.CRASH_LOOP_MAX_RESTARTS - 1):
+        policy.record_restart()
+        policy.record_healthy()
+    assert policy.next_delay() == 0